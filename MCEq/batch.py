@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.batch` - calculations on grids of parameters
+=======================================================
+
+This module runs :class:`MCEq.core.MCEqRun` for all combinations of
+interaction models, charm models, atmospheres, zenith angles and primary
+models. The work is ordered by the cost of the transitions between
+configurations:
+
+- a change of the interaction or charm model requires the matrices to be
+  rebuilt. Each such combination forms an independent group, which is
+  processed by one worker process,
+- within a group, a change of the atmosphere or the zenith angle
+  requires a new density spline and integration path,
+- all primary models for the same atmosphere and angle are integrated
+  together, since they only differ by the initial condition.
+
+Typical interaction::
+
+      $ grid = {'interaction_model': ['SIBYLL2.3', 'QGSJET-II-04'],
+      $         'theta_deg': [0., 30., 60.],
+      $         'primary_model': [(pm.HillasGaisser2012, 'H3a'),
+      $                           (pm.GaisserStanevTilav, '4-gen')]}
+      $ res = run_batch(mceq_kwargs, grid, ['total_mu+', 'total_numu'],
+      $                 n_workers=2)
+      $ res['fluxes'].shape  # (n_configs, n_names, d)
+
+Fluxes averaged over zenith angles (Gauss-Legendre nodes in
+:math:`\\cos\\theta`) and/or the months of a year are obtained with
+:func:`average_flux`::
+
+      $ res = average_flux(mceq_kwargs, ['total_numu'], cos_theta=8,
+      $                    atm_weights=month_weights('MSIS00', 'SouthPole'),
+      $                    n_workers=4)
+"""
+
+import numpy as np
+from collections import namedtuple, OrderedDict
+from mceq_config import dbg, config
+
+#: Configuration of a single calculation
+BatchConfig = namedtuple('BatchConfig', ['interaction_model', 'charm_model',
+                                         'atm_model', 'theta_deg',
+                                         'primary_model'])
+
+# Instance of MCEqRun in worker processes, see _init_worker
+_worker_run = None
+
+
+def expand_grid(grid, defaults=None):
+    """Returns the unique configurations of a parameter grid.
+
+    Args:
+      grid (dict): lists of values for the fields of :class:`BatchConfig`.
+                   Fields not in the grid are taken from ``defaults``.
+      defaults (dict, optional): single values of fields, e.g. the
+                                 arguments of :class:`MCEq.core.MCEqRun`
+
+    Returns:
+      list: unique :class:`BatchConfig` tuples, in the order of the grid
+    """
+    from itertools import product
+
+    defaults = defaults or {}
+    defaults.setdefault('charm_model', None)
+    values = []
+    for field in BatchConfig._fields:
+        if field in grid:
+            values.append(grid[field])
+        elif field in defaults:
+            values.append([defaults[field]])
+        else:
+            raise Exception('batch::expand_grid(): No value for ' +
+                            field + '.')
+
+    unique = OrderedDict()
+    for combination in product(*values):
+        unique[BatchConfig(*combination)] = None
+
+    return unique.keys()
+
+
+def plan_batch(configs):
+    """Orders the configurations for a minimal number of expensive
+    transitions.
+
+    Args:
+      configs (list): :class:`BatchConfig` tuples
+
+    Returns:
+      list: groups ``((interaction_model, charm_model), [(atm_model,
+      theta_deg, [primary_model, ...]), ...])``, one per set of matrices
+    """
+    groups = OrderedDict()
+    for cfg in configs:
+        models = (cfg.interaction_model, cfg.charm_model)
+        geometry = (cfg.atm_model, cfg.theta_deg)
+        group = groups.setdefault(models, OrderedDict())
+        primaries = group.setdefault(geometry, [])
+        if cfg.primary_model not in primaries:
+            primaries.append(cfg.primary_model)
+
+    plan = []
+    for models, group in groups.iteritems():
+        # Same atmospheres next to each other, then increasing angle
+        steps = sorted(group.items(), key=lambda item: (str(item[0][0]),
+                                                        item[0][1]))
+        plan.append((models, [(atm_model, theta_deg, primaries)
+                              for (atm_model, theta_deg), primaries
+                              in steps]))
+    return plan
+
+
+def _multi_rhs(solve_kwargs):
+    """Checks if :func:`solve_primaries` can integrate all initial
+    conditions in one pass, with the same result as
+    :func:`MCEq.core.MCEqRun.solve`.
+
+    This requires the forward-euler integrator with the numpy kernel,
+    since the other kernels only accept a single state vector, and no
+    arguments of :func:`MCEq.core.MCEqRun.solve` except ``grid_var``.
+    """
+    return (config['integrator'] != 'odepack' and
+            config['kernel_config'] == 'numpy' and
+            not set(solve_kwargs) - set(['grid_var']))
+
+
+def solve_primaries(mceq_run, primary_models, solve_kwargs=None):
+    """Solves the current configuration for several primary models.
+
+    If possible (see :func:`_multi_rhs`), all initial conditions are
+    integrated in one pass of :func:`MCEq.kernels.kern_numpy`, with one
+    column of the state matrix per primary model. Solutions in the
+    :class:`MCEq.results.SolutionCache` are used and new ones are added,
+    if ``use_solution_cache`` is enabled. Otherwise, the models are
+    solved one after the other with :func:`MCEq.core.MCEqRun.solve`.
+
+    The primary model of ``mceq_run`` is restored afterwards.
+
+    Args:
+      mceq_run (MCEqRun): configured instance
+      primary_models (list): (class, tag) tuples
+      solve_kwargs (dict, optional): arguments for
+                                     :func:`MCEq.core.MCEqRun.solve`
+
+    Returns:
+      list: solutions (state vectors at the surface), one per model
+    """
+    solve_kwargs = solve_kwargs or {}
+    saved = dict([(attr, getattr(mceq_run, attr))
+                  for attr in ['pmodel', 'get_nucleon_spectrum', 'phi0']
+                  if hasattr(mceq_run, attr)])
+    try:
+        if len(primary_models) == 1 or not _multi_rhs(solve_kwargs):
+            solutions = []
+            for primary_model in primary_models:
+                mceq_run.set_primary_model(*primary_model)
+                mceq_run.solve(**solve_kwargs)
+                solutions.append(np.copy(mceq_run.solution))
+            return solutions
+        return _solve_multi_rhs(mceq_run, primary_models, solve_kwargs)
+    finally:
+        for attr, value in saved.iteritems():
+            setattr(mceq_run, attr, value)
+
+
+def _solve_multi_rhs(mceq_run, primary_models, solve_kwargs):
+    """Integrates the initial conditions of several primary models in
+    one pass, see :func:`solve_primaries`."""
+    from MCEq.kernels import kern_numpy
+
+    cache = None
+    if config['use_solution_cache']:
+        from MCEq.results import get_solution_cache
+        cache = get_solution_cache()
+
+    solutions = [None] * len(primary_models)
+    keys = [None] * len(primary_models)
+    missing, phi0 = [], []
+    for i, primary_model in enumerate(primary_models):
+        mceq_run.set_primary_model(*primary_model)
+        if cache is not None:
+            keys[i] = mceq_run.solution_key(**solve_kwargs)
+            cached = cache.get(keys[i])
+            if cached is not None:
+                solutions[i] = np.copy(cached[0])
+                continue
+        missing.append(i)
+        phi0.append(mceq_run.phi0)
+
+    if not missing:
+        return solutions
+
+    mceq_run._calculate_integration_path(solve_kwargs.get('grid_var', 'X'))
+    nsteps, dX, rho_inv = mceq_run.integration_path
+
+    solution = kern_numpy(nsteps, dX, rho_inv, mceq_run.int_m,
+                          mceq_run.dec_m, np.column_stack(phi0), [])[0]
+
+    for col, i in enumerate(missing):
+        solutions[i] = np.ascontiguousarray(solution[:, col])
+        if cache is not None:
+            cache.put(keys[i], solutions[i], [])
+
+    return solutions
+
+
+def _run_group(group, mceq_run=None, particle_names=None,
+               solve_kwargs=None, store_dir=None):
+    """Calculates all configurations of one group of :func:`plan_batch`.
+
+    If ``store_dir`` is given, the solutions are also appended to the
+    :class:`MCEq.results.ResultStore` in this directory.
+
+    Returns:
+      (tuple): (energy grid, list of (:class:`BatchConfig`, spectra of
+      shape (n_names, d)) tuples)
+    """
+    from time import time
+
+    if mceq_run is None:
+        mceq_run, particle_names, solve_kwargs, store_dir = _worker_run
+    store = None
+    if store_dir is not None:
+        from MCEq.results import ResultStore
+        store = ResultStore(store_dir)
+    (interaction_model, charm_model), steps = group
+
+    now = time()
+    if (mceq_run.yields_params.get('interaction_model'),
+            mceq_run.yields_params.get('charm_model')) != \
+            (interaction_model, charm_model):
+        mceq_run.set_interaction_model(interaction_model, charm_model)
+
+    results = []
+    for atm_model, theta_deg, primary_models in steps:
+        if mceq_run.atm_config != atm_model:
+            mceq_run.set_atm_model(atm_model, update_theta=False)
+        # Results are stored under theta_deg, so it has to be exact
+        mceq_run.set_theta_deg(theta_deg, exact=True)
+
+        for primary_model, solution in zip(
+                primary_models, solve_primaries(mceq_run, primary_models,
+                                                solve_kwargs)):
+            cfg = BatchConfig(interaction_model, charm_model, atm_model,
+                              theta_deg, primary_model)
+            mceq_run.solution = solution
+            spectra = mceq_run.get_solutions(particle_names)[:, 0]
+            results.append((cfg, spectra))
+            if store is not None:
+                store.add(cfg, mceq_run, solution)
+
+    if dbg > 0:
+        print ('batch::_run_group(): {0}/{1}: {2} configurations in ' +
+               '{3:1.1f}s').format(interaction_model, charm_model,
+                                   len(results), time() - now)
+    return mceq_run.e_grid, results
+
+
+def _init_worker(mceq_kwargs, particle_names, solve_kwargs, store_dir):
+    """Creates the instance of :class:`MCEq.core.MCEqRun` of a
+    worker process."""
+    from MCEq.core import MCEqRun
+    global _worker_run
+    _worker_run = (MCEqRun(**mceq_kwargs), particle_names, solve_kwargs,
+                   store_dir)
+
+
+def run_batch(mceq_kwargs, grid, particle_names, n_workers=1,
+              solve_kwargs=None, mceq_run=None, store_dir=None):
+    """Calculates the spectra for all configurations of a parameter grid.
+
+    Duplicate configurations are calculated once. The groups of
+    configurations, which share the same matrices, are distributed over
+    ``n_workers`` processes. Each worker creates its own instance of
+    :class:`MCEq.core.MCEqRun` with ``mceq_kwargs``.
+
+    Args:
+      mceq_kwargs (dict): arguments of :class:`MCEq.core.MCEqRun`, also
+                          used as defaults for fields missing in ``grid``
+      grid (dict): lists of values for the fields of :class:`BatchConfig`
+      particle_names (list): names of the spectra, as accepted by
+                             :func:`MCEq.core.MCEqRun.get_solution`
+      n_workers (int, optional): number of processes. 1 runs in this
+                                 process.
+      solve_kwargs (dict, optional): arguments for
+                                     :func:`MCEq.core.MCEqRun.solve`
+      mceq_run (MCEqRun, optional): existing instance for ``n_workers=1``
+      store_dir (str, optional): directory of a
+                                 :class:`MCEq.results.ResultStore`, to
+                                 which the full solutions are appended
+
+    Returns:
+      dict: ``configs`` (list of :class:`BatchConfig`), ``particle_names``,
+      ``e_grid`` and ``fluxes`` (numpy.array of shape
+      (n_configs, n_names, d))
+    """
+    from time import time
+    from multiprocessing import Pool
+
+    now = time()
+    configs = expand_grid(grid, dict(mceq_kwargs))
+    plan = plan_batch(configs)
+    print ('batch::run_batch(): {0} unique configurations in {1} ' +
+           'groups.').format(len(configs), len(plan))
+
+    results, pool = {}, None
+    e_grid = None if mceq_run is None else mceq_run.e_grid
+    if not plan:
+        group_results = []
+    elif n_workers == 1:
+        if mceq_run is None:
+            from MCEq.core import MCEqRun
+            mceq_run = MCEqRun(**mceq_kwargs)
+        group_results = (_run_group(group, mceq_run, particle_names,
+                                    solve_kwargs, store_dir)
+                         for group in plan)
+    else:
+        pool = Pool(n_workers, initializer=_init_worker,
+                    initargs=(mceq_kwargs, particle_names, solve_kwargs,
+                              store_dir))
+        group_results = pool.imap_unordered(_run_group, plan)
+
+    try:
+        for e_grid, group_result in group_results:
+            results.update(group_result)
+    finally:
+        if pool is not None:
+            # All results have been received unless an exception
+            # occurred, in which case the remaining groups are dropped
+            pool.terminate()
+            pool.join()
+
+    print 'batch::run_batch(): finished after {0:1.1f}s'.format(time() - now)
+
+    if configs:
+        fluxes = np.array([results[cfg] for cfg in configs])
+    else:
+        fluxes = np.zeros((0, len(particle_names),
+                           0 if e_grid is None else len(e_grid)))
+
+    return {'configs': configs,
+            'particle_names': list(particle_names),
+            'e_grid': e_grid,
+            'fluxes': fluxes}
+
+
+#: Months and their numbers of days, see :func:`month_weights`
+_month_days = [('January', 31), ('February', 28), ('March', 31),
+               ('April', 30), ('May', 31), ('June', 30), ('July', 31),
+               ('August', 31), ('September', 30), ('October', 31),
+               ('November', 30), ('December', 31)]
+
+
+def month_weights(base_model='MSIS00', location='SouthPole'):
+    """Returns the atmospheres of all months, weighted by their number of
+    days, for yearly averages with :func:`average_flux`.
+
+    Args:
+      base_model (str, optional): model with monthly seasons
+      location (str, optional): location of the model
+
+    Returns:
+      list: ((base_model, location, month), days) tuples
+    """
+    return [((base_model, location, month), float(days))
+            for month, days in _month_days]
+
+
+def gauss_cos_theta(n_nodes, cos_theta_range=(0., 1.)):
+    """Returns Gauss-Legendre nodes in :math:`\\cos\\theta` and weights,
+    which average over the solid angle of ``cos_theta_range``.
+
+    Args:
+      n_nodes (int): number of nodes
+      cos_theta_range (tuple, optional): interval of :math:`\\cos\\theta`
+
+    Returns:
+      (tuple): nodes and weights, which sum to one
+    """
+    xg, wg = np.polynomial.legendre.leggauss(n_nodes)
+    c_lo, c_up = cos_theta_range
+    return 0.5 * (c_up - c_lo) * xg + 0.5 * (c_up + c_lo), 0.5 * wg
+
+
+def _solve_weighted(task, mceq_run=None, particle_names=None,
+                    solve_kwargs=None):
+    """Solves one (atmosphere, angle) node of :func:`average_flux` and
+    returns the energy grid and the weighted spectra."""
+    if mceq_run is None:
+        mceq_run, particle_names, solve_kwargs = _worker_run[:3]
+    atm_model, theta_deg, weight = task
+
+    if mceq_run.atm_config != atm_model:
+        mceq_run.set_atm_model(atm_model, update_theta=False)
+    # The weights are only valid at the exact nodes
+    mceq_run.set_theta_deg(theta_deg, exact=True)
+    mceq_run.solve(**(solve_kwargs or {}))
+
+    return (mceq_run.e_grid,
+            weight * mceq_run.get_solutions(particle_names)[:, 0])
+
+
+def average_flux(mceq_kwargs, particle_names, cos_theta=5, atm_weights=None,
+                 cos_theta_range=(0., 1.), n_workers=1, solve_kwargs=None,
+                 mceq_run=None):
+    """Calculates fluxes averaged over zenith angles and/or atmospheres.
+
+    The nodes are the combinations of the atmospheres in ``atm_weights``
+    and the zenith angles. The solutions are weighted and summed as they
+    arrive, such that memory does not grow with the number of nodes.
+    The atmosphere cache is only used for the exact angles of the nodes
+    (see :func:`MCEq.core.MCEqRun.set_theta_deg`).
+    With ``n_workers > 1``, the nodes are distributed over worker
+    processes, which receive blocks of nodes with the same atmosphere.
+
+    Args:
+      mceq_kwargs (dict): arguments of :class:`MCEq.core.MCEqRun`
+      particle_names (list): names of the spectra, as accepted by
+                             :func:`MCEq.core.MCEqRun.get_solution`
+      cos_theta (int or tuple, optional): number of Gauss-Legendre nodes
+        in ``cos_theta_range`` (see :func:`gauss_cos_theta`), or a tuple
+        (nodes, weights)
+      atm_weights (list, optional): (atmosphere, weight) tuples, e.g. from
+        :func:`month_weights`. By default the ``atm_model`` of
+        ``mceq_kwargs`` is used.
+      cos_theta_range (tuple, optional): interval of :math:`\\cos\\theta`
+      n_workers (int, optional): number of processes. 1 runs in this
+                                 process.
+      solve_kwargs (dict, optional): arguments for
+                                     :func:`MCEq.core.MCEqRun.solve`
+      mceq_run (MCEqRun, optional): existing instance for ``n_workers=1``
+
+    Returns:
+      dict: ``e_grid``, ``particle_names``, ``cos_theta``, ``atm_weights``
+      and the averaged ``flux`` of shape (n_names, d)
+    """
+    from time import time
+    from multiprocessing import Pool
+
+    now = time()
+    if isinstance(cos_theta, int):
+        nodes, weights = gauss_cos_theta(cos_theta, cos_theta_range)
+    else:
+        nodes, weights = np.asarray(cos_theta[0]), np.asarray(cos_theta[1])
+    if np.any(nodes < 0.) or np.any(nodes > 1.):
+        raise Exception('batch::average_flux(): Only down-going angles ' +
+                        '(0 <= cos(theta) <= 1) are supported.')
+    if atm_weights is None:
+        atm_weights = [(mceq_kwargs['atm_model'], 1.)]
+
+    norm = np.sum(weights) * np.sum([w for _, w in atm_weights])
+    tasks = [(atm_model, np.degrees(np.arccos(c)), w_atm * w_c / norm)
+             for atm_model, w_atm in atm_weights
+             for c, w_c in zip(nodes, weights)]
+    if not tasks:
+        raise Exception('batch::average_flux(): No nodes to average.')
+    print 'batch::average_flux(): {0} nodes.'.format(len(tasks))
+
+    flux, pool = None, None
+    if n_workers == 1:
+        if mceq_run is None:
+            from MCEq.core import MCEqRun
+            mceq_run = MCEqRun(**mceq_kwargs)
+        weighted = (_solve_weighted(task, mceq_run, particle_names,
+                                    solve_kwargs) for task in tasks)
+    else:
+        pool = Pool(n_workers, initializer=_init_worker,
+                    initargs=(mceq_kwargs, particle_names, solve_kwargs,
+                              None))
+        chunksize = int(np.ceil(len(tasks) / float(n_workers)))
+        weighted = pool.imap_unordered(_solve_weighted, tasks, chunksize)
+
+    try:
+        for e_grid, spectra in weighted:
+            if flux is None:
+                flux = spectra
+            else:
+                flux += spectra
+    finally:
+        if pool is not None:
+            # All results have been received unless an exception
+            # occurred, in which case the remaining nodes are dropped
+            pool.terminate()
+            pool.join()
+
+    print 'batch::average_flux(): finished after {0:1.1f}s'.format(
+        time() - now)
+
+    return {'e_grid': e_grid,
+            'particle_names': list(particle_names),
+            'cos_theta': (nodes, weights),
+            'atm_weights': atm_weights,
+            'flux': flux}
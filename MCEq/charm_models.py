@@ -10,7 +10,7 @@ as the class :class:`MRS_charm`. The abstract class
 classes.
 
 The :class:`Yields` instantiates derived classes of
-:class:`CharmModel` and calls :func:`CharmModel.get_yield_matrix`
+:class:`CharmModel` and calls :func:`CharmModel.get_yield_matrices`
 when overwriting a model yield file in 
 :func:`Yields.set_custom_charm_model`.
 """
@@ -45,6 +45,48 @@ class CharmModel():
         """
         raise NotImplementedError("CharmModel::get_yield_matrix(): " + 
                                   "Base class called.")
+
+    def yield_class(self, proj, sec):
+        """Returns a key, which identifies the yield matrix of the
+        (``proj``, ``sec``) combination.
+
+        Combinations with the same key share the same yield matrix in
+        :func:`get_yield_matrices`, which is computed only once. Derived
+        classes can override this method if their yields do not depend
+        on all details of projectile and secondary.
+
+        Args:
+           proj (int): PDG ID of the interacting particle (projectile)
+           sec (int): PDG ID of the final state charmed meson (secondary)
+
+        Returns:
+           hashable key
+        """
+        return (proj, sec)
+
+    def get_yield_matrices(self, projs, secs):
+        """Returns the yield matrices for all combinations of
+        projectiles and secondaries.
+
+        Each distinct matrix (see :func:`yield_class`) is calculated only
+        once by :func:`get_yield_matrix` and shared between the
+        combinations. The returned matrices must not be modified.
+
+        Args:
+           projs (list): PDG IDs of the projectiles
+           secs (list): PDG IDs of the final state charmed particles
+
+        Returns:
+           dict: yield matrices with (proj, sec) keys
+        """
+        yields, computed = {}, {}
+        for proj in projs:
+            for sec in secs:
+                ykey = self.yield_class(proj, sec)
+                if ykey not in computed:
+                    computed[ykey] = self.get_yield_matrix(proj, sec)
+                yields[(proj, sec)] = computed[ykey]
+        return yields
     
 class MRS_charm(CharmModel):
     """Martin-Ryskin-Stasto charm model.
@@ -93,6 +135,9 @@ class MRS_charm(CharmModel):
     
     #: charm secondaries, which are predicted by this model
     allowed_sec = [411, 421, 431, 4122]
+
+    #: number of Gauss-Legendre nodes for the integration in :func:`sigma_cc`
+    n_gauss = 32
     
     def __init__(self, e_grid, csm):
         
@@ -108,49 +153,61 @@ class MRS_charm(CharmModel):
         
     def sigma_cc(self, E):
         """Returns the integrated ccbar cross-section in mb.
-        
+
+        The integral is evaluated for all energies at once using a
+        fixed Gauss-Legendre rule with :attr:`n_gauss` nodes.
+
+        Args:
+          E (float or np.array): center-of-mass energy in GeV
+
         Note:
           Integration is not going over complete phase-space due to
           limitations of the parameterization.
         """
-        from scipy.integrate import quad
-        E = np.asarray(E)
-        if E.size > 1:
-            return 2 * np.array(
-                [quad(self.dsig_dx, 0.05, 0.6, args=Ei)[0] for Ei in E ])
-        else:
-            return 2 * quad(self.dsig_dx, 0.05, 0.6, args=E)[0]
+        x_lo, x_up = 0.05, 0.6
+        xg, wg = np.polynomial.legendre.leggauss(self.n_gauss)
+        xg = 0.5 * (x_up - x_lo) * xg + 0.5 * (x_up + x_lo)
+        wg = 0.5 * (x_up - x_lo) * wg
+
+        E = np.asarray(E, dtype='float64')
+        res = 2 * np.sum(wg * self.dsig_dx(xg, E[..., np.newaxis]),
+                         axis=-1)
+        return res if res.ndim else float(res)
         
     def dsig_dx(self, x, E):
         """Returns the Feynman-:math:`x_F` distribution 
         of :math:`\\sigma_{c\\bar{c}}` in mb
+
+        ``x`` and ``E`` are broadcasted against each other, such that
+        complete grids can be evaluated in one call.
         
         Args:
           x (float or np.array): :math:`x_F`
-          E (float): center-of-mass energy in GeV
+          E (float or np.array): center-of-mass energy in GeV
         
         Returns:
           float: :math:`\\sigma_{c\\bar{c}}` in mb
         """
         
-        x = np.asarray(x)
-        E = np.asarray(E)
-        beta = 0.05 - 0.016 * np.log(E / 10e4)
-        n, A = None, None
-        if E < 1e4:
-            return 0.
-        elif E >= 1e4 and E < 1e8:
-            n = 7.6 + 0.025 * np.log(E / 1e4)
-            A = 140 + (11.*np.log(E / 1e2)) ** 1.65
-        elif E >= 1e8 and E <= 1e11:
-            n = 7.6 + 0.012 * np.log(E / 1e4)
-            A = 4100. + 245.*np.log(E / 1e8)
-        else:
+        x, E = np.broadcast_arrays(np.asarray(x, dtype='float64'),
+                                   np.asarray(E, dtype='float64'))
+        if np.any(E > 1e11):
             raise Exception("MRS_charm()::out of range")
+
         res = np.zeros_like(x)
-        ran = (x > 0.01) & (x < 0.7)
-        res[ran] = np.array(A * x[ran] ** (beta - 1.) * 
-                            (1 - x[ran] ** 1.2) ** n / 1e3)
+        ran = (x > 0.01) & (x < 0.7) & (E >= 1e4)
+        if not np.any(ran):
+            return res
+        x, E = x[ran], E[ran]
+        low = E < 1e8
+
+        beta = 0.05 - 0.016 * np.log(E / 10e4)
+        n = np.where(low, 7.6 + 0.025 * np.log(E / 1e4),
+                     7.6 + 0.012 * np.log(E / 1e4))
+        A = np.where(low, 140 + (11. * np.log(E / 1e2)) ** 1.65,
+                     4100. + 245. * np.log(E / 1e8))
+
+        res[ran] = A * x ** (beta - 1.) * (1 - x ** 1.2) ** n / 1e3
         return res
     
     def D_dist(self, x, E, mes):
@@ -183,8 +240,32 @@ class MRS_charm(CharmModel):
         xc = self.lambda_c_frag(x)
         return self.dsig_dx(xc, E) * self.D0_scale * self.cs_scales[4122]
 
+    def yield_class(self, proj, sec):
+        """Returns a key, which identifies the yield matrix of the
+        (``proj``, ``sec``) combination.
+
+        The yields depend only on the type of the charmed particle,
+        all combinations which do not produce charm share the zero matrix.
+
+        Args:
+          proj (int): projectile PDG ID
+          sec (int): charmed particle PDG ID
+
+        Returns:
+          int or None: absolute PDG ID of ``sec`` or ``None``
+        """
+        if (proj not in self.allowed_proj) or (abs(sec) not in self.allowed_sec):
+            return None
+        if abs(sec) == 4122 and \
+            ((np.sign(proj) != np.sign(sec)) or abs(proj) < 1000):
+            return None
+        return abs(sec)
+
     def get_yield_matrix(self, proj, sec):
         """Returns the yield matrix in proper format for :class:`MCEqRun`.
+
+        The matrix is evaluated on the complete 
+        :math:`(E_{sec}, E_{proj})` grid in one vectorized expression.
         
         Args:
           proj (int): projectile PDG ID :math:`\\pm` [2212, 211, 321]
@@ -196,24 +277,20 @@ class MRS_charm(CharmModel):
         """
         # TODO: Make this function a member of the base class!
         
-        if (proj not in self.allowed_proj) or (abs(sec) not in self.allowed_sec):
-            return self.no_prod
-        
-        self.xdist = None
-        
-        if abs(sec) == 4122 and \
-            ((np.sign(proj) != np.sign(sec)) or abs(proj) < 1000):
+        if self.yield_class(proj, sec) is None:
             return self.no_prod
+
+        # x = E_sec / E_proj with E_sec along the rows and E_proj along
+        # the columns
+        e_proj = self.e_grid[np.newaxis, :]
+        x = self.e_grid[:, np.newaxis] / e_proj
+        if abs(sec) == 4122:
+            xdist = self.LambdaC_dist(x, e_proj)
         else:
-            self.xdist = lambda e: self.LambdaC_dist(self.e_grid / e, e) / e
-        if abs(sec) != 4122:
-            self.xdist = lambda e: self.D_dist(self.e_grid / e, e, abs(sec)) / e
-        
-        m_out = np.zeros_like(self.no_prod)
+            xdist = self.D_dist(x, e_proj, abs(sec))
         
         # convert x distribution to E_sec distribution and distribute on the grid
-        for i, e in enumerate(self.e_grid):
-            m_out[:, i] = self.xdist(e) / self.siginel[i]
+        m_out = xdist / (self.e_grid * self.siginel)
         
         if dbg > 1:
             print ('MRS_charm::get_yield_matrix({0},{1}): ' + 
@@ -87,6 +87,13 @@ class MCEqRun():
         #: handler for cross-section data of type :class:`MCEq.data.HadAirCrossSections`
         self.cs = HadAirCrossSections(**self.cs_params)
 
+        # Coarse energy grid for preview calculations. The solution is
+        # obtained on the coarse grid self.e_grid. Use self.y.to_data_grid
+        # to map spectra back to the grid of the data files.
+        if config['preview_rebin'] > 1:
+            for data_obj in [self.y, self.ds, self.cs]:
+                data_obj.rebin(config['preview_rebin'])
+
         # Save primary model params
         self.pm_params = primary_model
 
@@ -200,6 +207,18 @@ class MCEqRun():
                     if (dbg):
                         print p.name + '_' + str(i), some_index
 
+        # Digest of the matrices, see :func:`MCEqRun.solution_key`
+        self._matrix_digest = None
+        # Aggregation operators and powers of the energy grid, see
+        # :func:`MCEqRun.get_solutions`
+        self._agg_ops = {}
+        self._e_grid_mag = {}
+        # Layout of the intermediate solutions, see
+        # :func:`MCEqRun._set_grid_layout`
+        self._grid_idcs = None
+        self._grid_dtype = None
+        self._grid_agg_ops = {}
+
         # Set interaction model and compute grids and matrices
         if interaction_model != None:
             self.delay_pmod_init = False
@@ -352,6 +371,8 @@ class MCEqRun():
         if config['use_sparse']:
             self._convert_to_sparse()
 
+        self._matrix_digest = None
+
         if dbg > 0:
             int_m_density = (float(np.count_nonzero(self.int_m)) /
                          float(self.int_m.size))
@@ -440,7 +461,8 @@ class MCEqRun():
         else:
             return None
 
-    def get_solution(self, particle_name, mag=0., grid_idx=None):
+    def get_solution(self, particle_name, mag=0., grid_idx=None,
+                     obs_idx=None):
         """Retrieves solution of the calculation on the energy grid.
 
         Some special prefixes are accepted for lepton names:
@@ -465,37 +487,149 @@ class MCEqRun():
             intermediate solutions on a depth grid, then ``grid_idx`` specifies
             the index of the depth grid for which the solution is retrieved. If
             not specified the flux at the surface is returned
+          obs_idx (int, optional): index of the observation level in the
+            ``obs_heights`` argument of :func:`MCEqRun.solve`
 
         Returns:
           (numpy.array): flux of particles on energy grid :attr:`e_grid`
         """
-        res = np.zeros(self.d)
-        ref = self.pname2pref
-        sol = None
+        if obs_idx is not None:
+            return (self._get_agg_operator(particle_name).dot(
+                self.obs_sol[obs_idx]) * self._get_e_grid_mag(mag))
+
         if grid_idx == None:
-            sol = self.solution
+            return (self._get_agg_operator(particle_name).dot(self.solution) *
+                    self._get_e_grid_mag(mag))
+
+        return (self._get_grid_operator(particle_name).dot(
+            self._get_grid_state(grid_idx)) * self._get_e_grid_mag(mag))
+
+    def get_solutions(self, particle_names, grid_idcs=None, mag=0.):
+        """Retrieves the solutions of several particles on several
+        depth grid points at once.
+
+        All spectra are obtained with one sparse matrix product of the
+        stacked aggregation operators (see :func:`MCEqRun.get_solution`)
+        with the stacked states.
+
+        Args:
+          particle_names (list): names, as accepted by
+            :func:`MCEqRun.get_solution`
+          grid_idcs (list, optional): indices of the depth grid. An entry
+            ``None`` selects the solution at the surface. If not specified,
+            only the solution at the surface is returned.
+          mag (float, optional): 'magnification factor': the solution is
+            multiplied by ``sol`` :math:`= \\Phi \\cdot E^{mag}`
+
+        Returns:
+          (numpy.array): fluxes of shape (n_names, n_grid, d)
+        """
+        from scipy.sparse import vstack
+
+        if grid_idcs is None:
+            grid_idcs = [None]
+        if all([idx is None for idx in grid_idcs]):
+            get_op = self._get_agg_operator
+            states = np.column_stack([self.solution] * len(grid_idcs))
         else:
-            sol = self.grid_sol[grid_idx]
+            get_op = self._get_grid_operator
+            states = np.column_stack([self._get_grid_state(idx)
+                                      for idx in grid_idcs])
+        op = vstack([get_op(name) for name in particle_names], format='csr')
+        res = op.dot(states).reshape(len(particle_names), self.d,
+                                     len(grid_idcs))
+        return res.transpose(0, 2, 1) * self._get_e_grid_mag(mag)
+
+    def _get_agg_operator(self, particle_name):
+        """Returns the sparse matrix of shape (d, dim_states), which selects
+        and sums the slices of the state vector belonging to
+        ``particle_name``. The matrices are cached per name.
+        """
+        if particle_name in self._agg_ops:
+            return self._agg_ops[particle_name]
+
+        from scipy.sparse import csr_matrix
 
+        names = self._component_names(particle_name)
+        ref = self.pname2pref
+        cols = np.concatenate([np.arange(ref[name].lidx(), ref[name].uidx())
+                               for name in names])
+        rows = np.tile(np.arange(self.d), len(names))
+        self._agg_ops[particle_name] = csr_matrix(
+            (np.ones(cols.size), (rows, cols)),
+            shape=(self.d, self.dim_states))
+        return self._agg_ops[particle_name]
+
+    def _component_names(self, particle_name):
+        """Returns the names of the species, which are summed for
+        ``particle_name``, resolving the ``total_`` and ``conv_`` prefixes.
+        """
         if particle_name.startswith('total'):
             lep_str = particle_name.split('_')[1]
-            for prefix in ('pr_', 'pi_', 'k_', ''):
-                particle_name = prefix + lep_str
-                res += sol[ref[particle_name].lidx():
-                           ref[particle_name].uidx()] * \
-                    self.e_grid ** mag
+            return [prefix + lep_str for prefix in ('pr_', 'pi_', 'k_', '')]
         elif particle_name.startswith('conv'):
             lep_str = particle_name.split('_')[1]
-            for prefix in ('pi_', 'k_', ''):
-                particle_name = prefix + lep_str
-                res += sol[ref[particle_name].lidx():
-                           ref[particle_name].uidx()] * \
-                    self.e_grid ** mag
-        else:
-            res = sol[ref[particle_name].lidx():
-                      ref[particle_name].uidx()] * \
-                self.e_grid ** mag
-        return res
+            return [prefix + lep_str for prefix in ('pi_', 'k_', '')]
+        return [particle_name]
+
+    def _set_grid_layout(self, grid_species=None, grid_dtype=None):
+        """Selects the species and precision of the intermediate solutions.
+
+        Args:
+          grid_species (list, optional): names, as accepted by
+            :func:`MCEqRun.get_solution`. By default all species are stored.
+          grid_dtype (str, optional): storage type, see
+            :func:`MCEq.output.encode_state`
+        """
+        from MCEq.output import state_indices
+
+        self._grid_dtype = grid_dtype
+        self._grid_agg_ops = {}
+        if grid_species is None:
+            self._grid_idcs = None
+            return
+        names = []
+        for particle_name in grid_species:
+            for name in self._component_names(particle_name):
+                if name not in names:
+                    names.append(name)
+        names.sort(key=lambda name: self.pname2pref[name].lidx())
+        self._grid_idcs = state_indices(self, names)
+
+    def _get_grid_state(self, grid_idx):
+        """Returns the (decoded) intermediate solution at ``grid_idx``,
+        restricted to the stored species. ``None`` selects the solution at
+        the surface."""
+        from MCEq.output import decode_state
+
+        if grid_idx is None:
+            if self._grid_idcs is None:
+                return self.solution
+            return self.solution[self._grid_idcs]
+        if self._grid_dtype is None:
+            return self.grid_sol[grid_idx]
+        return decode_state(self.grid_sol[grid_idx], self._grid_dtype)
+
+    def _get_grid_operator(self, particle_name):
+        """Returns the aggregation operator (see
+        :func:`MCEqRun._get_agg_operator`) for the stored species of the
+        intermediate solutions."""
+        if self._grid_idcs is None:
+            return self._get_agg_operator(particle_name)
+        if particle_name not in self._grid_agg_ops:
+            op = self._get_agg_operator(particle_name)
+            grid_op = op[:, self._grid_idcs]
+            if grid_op.nnz != op.nnz:
+                raise Exception('MCEqRun::get_solution(): ' + particle_name +
+                                ' was not in grid_species of solve().')
+            self._grid_agg_ops[particle_name] = grid_op
+        return self._grid_agg_ops[particle_name]
+
+    def _get_e_grid_mag(self, mag):
+        """Returns :math:`E^{mag}` on :attr:`e_grid`, cached per ``mag``."""
+        if mag not in self._e_grid_mag:
+            self._e_grid_mag[mag] = self.e_grid ** mag
+        return self._e_grid_mag[mag]
 
     def set_obs_particles(self, obs_ids):
         """Adds a list of mother particle strings which decay products
@@ -540,8 +674,9 @@ class MCEqRun():
         self.yields_params['interaction_model'] = interaction_model
         self.yields_params['charm_model'] = charm_model
 
-        #If a custom charm model is selected force re-read of yields
-        self.y.set_interaction_model(interaction_model)
+        # If the charm model changes, force re-read of yields
+        self.y.set_interaction_model(
+            interaction_model, force=(charm_model != self.y.charm_model))
         self.y.inject_custom_charm_model(charm_model)
 
         self.cs_params['interaction_model'] = interaction_model
@@ -697,7 +832,7 @@ class MCEqRun():
         self.phi0[self.pdg2pref[2112].lidx() + idx_lo] = n_neutrons * wE_lo / widths[idx_lo] ** 2
         self.phi0[self.pdg2pref[2112].lidx() + idx_up] = n_neutrons * wE_up / widths[idx_up] ** 2
 
-    def set_atm_model(self, atm_config):
+    def set_atm_model(self, atm_config, update_theta=True):
         """Sets model of the atmosphere.
 
         To choose, for example, a CORSIKA parametrization for the Southpole in January,
@@ -707,38 +842,46 @@ class MCEqRun():
 
         More details about the choices can be found in :mod:`MCEq.density_profiles`. Calling
         this method will issue a recalculation of the interpolation and the integration path.
+        Instead of a tuple, an atmosphere object, e.g. a
+        :class:`MCEq.density_profiles.TabulatedAtmosphere`, can be passed.
 
         Args:
-          atm_config (tuple of strings): (parametrization type, location string, season string)
+          atm_config (tuple of strings or CascadeAtmosphere): (parametrization type,
+            location string, season string) or atmosphere object
+          update_theta (bool, optional): set up the zenith angle
+            :attr:`theta_deg` for the new atmosphere. Disable if
+            :func:`set_theta_deg` is called right afterwards.
         """
-        from MCEq.density_profiles import CorsikaAtmosphere, MSIS00Atmosphere
+        from MCEq.density_profiles import get_atmosphere, CascadeAtmosphere
+
+        if isinstance(atm_config, CascadeAtmosphere):
+            self.atm_model = atm_config
+            atm_config = (atm_config.__class__.__name__,
+                          atm_config.location, atm_config.season)
+        else:
+            self.atm_model = get_atmosphere(atm_config)
 
         base_model, location, season = atm_config
 
         if dbg:
             print 'MCEqRun::set_atm_model(): ', base_model, location, season
 
-        if base_model == 'MSIS00':
-            self.atm_model = MSIS00Atmosphere(
-                location, season)
-        elif base_model == 'CORSIKA':
-            self.atm_model = CorsikaAtmosphere(
-                location, season)
-        else:
-            raise Exception(
-                'MCEqRun::set_atm_model(): Unknown atmospheric base model.')
         self.atm_config = atm_config
 
-        if self.theta_deg != None:
+        if update_theta and self.theta_deg != None:
             self.set_theta_deg(self.theta_deg)
 
-    def set_theta_deg(self, theta_deg):
+    def set_theta_deg(self, theta_deg, exact=False):
         """Sets zenith angle :math:`\\theta` as seen from a detector.
 
         Currently only 'down-going' angles (0-90 degrees) are supported.
+        With the atmosphere cache, the closest cached angle within 1
+        degree may be selected instead, see
+        :func:`MCEq.density_profiles.CascadeAtmosphere.set_theta`.
 
         Args:
-          atm_config (tuple of strings): (parametrization type, location string, season string)
+          theta_deg (float): zenith angle in degrees
+          exact (bool, optional): use exactly ``theta_deg``
         """
         if dbg:
             print 'MCEqRun::set_theta_deg(): ', theta_deg
@@ -752,7 +895,7 @@ class MCEqRun():
             print 'Theta selection correponds to cached value, skipping calc.'
             return
 
-        self.atm_model.set_theta(theta_deg)
+        self.atm_model.set_theta(theta_deg, exact)
         self.integration_path = None
 
     def _zero_mat(self):
@@ -769,6 +912,11 @@ class MCEqRun():
             if dbg > 2:
                 print reclev * '\t', 'following to', r[d].name
 
+            # skip daughters, which are not produced in the energy range
+            if not self.ds.is_decay_block(r[p].pdgid, idcs, r[d].pdgid,
+                                          (0, self.d)):
+                continue
+
             dprop = self._zero_mat()
             self.ds.assign_d_idx(r[p].pdgid, idcs,
                                  r[d].pdgid, r[d].hadridx(),
@@ -834,7 +982,9 @@ class MCEqRun():
 
             # go through all secondaries
             for s in p.secondaries:
-                if not pref[s].is_resonance:
+                if (not pref[s].is_resonance and
+                    self.y.is_yield_block(p.pdgid, p.hadridx(),
+                                          s, pref[s].hadridx())):
                     cmat = self._zero_mat()
                     self.y.assign_yield_idx(p.pdgid,
                                             p.hadridx(),
@@ -844,6 +994,10 @@ class MCEqRun():
                     self.C[pref[s].lidx():pref[s].uidx(),
                                  p.lidx():p.uidx()] += cmat
 
+                if not self.y.is_yield_block(p.pdgid, p.hadridx(),
+                                             s, pref[s].residx()):
+                    continue
+
                 cmat = self._zero_mat()
                 self.y.assign_yield_idx(p.pdgid,
                                         p.hadridx(),
@@ -854,13 +1008,86 @@ class MCEqRun():
                                     p.pdgid, pref[s].residx(),
                                     self.C, reclev=1)
 
+    def solution_key(self, **kwargs):
+        """Returns a digest of everything, which determines the solution.
+
+        These are the matrices, the atmosphere and zenith angle, the
+        initial condition, the integrator settings and the arguments
+        of :func:`MCEqRun.solve`.
+
+        Args:
+          kwargs: arguments of :func:`MCEqRun.solve`
+
+        Returns:
+          str: hexadecimal digest
+        """
+        from hashlib import md5
+        from MCEq.data import _array_digest
+
+        if self._matrix_digest is None:
+            digests = []
+            for mat in [self.int_m, self.dec_m]:
+                if hasattr(mat, 'indptr'):
+                    digests += [_array_digest(mat.data),
+                                _array_digest(mat.indices),
+                                _array_digest(mat.indptr)]
+                else:
+                    digests.append(_array_digest(mat))
+            self._matrix_digest = md5(''.join(digests)).hexdigest()
+
+        int_grid = kwargs.get('int_grid', None)
+        if int_grid is not None:
+            int_grid = _array_digest(np.asarray(int_grid, dtype=np.float64))
+
+        key = (self._matrix_digest, self.atm_model._cache_key(),
+               float(self.atm_model.theta_deg), _array_digest(self.phi0),
+               int_grid, self.max_ldec, config['integrator'],
+               config['kernel_config'], config['use_sparse'],
+               sorted(config['ode_params'].items())
+               if config['integrator'] == 'odepack' else None,
+               sorted([(k, v) for k, v in kwargs.iteritems()
+                       if k != 'int_grid']))
+        return md5(repr(key)).hexdigest()
+
     def solve(self, **kwargs):
+        """Solves the cascade equations for the current configuration.
+
+        If ``use_solution_cache`` is enabled in :mod:`mceq_config`, the
+        solution is looked up in the :class:`MCEq.results.SolutionCache`
+        first, with the key :func:`MCEqRun.solution_key`. Calculations
+        with a ``grid_sink``, ``obs_heights`` or ``functionals`` are not
+        cached.
+
+        Args:
+          kwargs: arguments of the integrator, e.g. ``int_grid``,
+            ``grid_species``, ``grid_dtype``, ``obs_heights`` and
+            ``functionals`` (see :func:`MCEqRun._forward_euler`)
+        """
 
         if dbg > 1:
             print (self.cname + "::solve(): " +
                    "solver={0} and sparse={1}").format(self.solver,
                                                        self.sparse)
 
+        use_cache = (config['use_solution_cache'] and
+                     kwargs.get('grid_sink', None) is None and
+                     kwargs.get('obs_heights', None) is None and
+                     kwargs.get('functionals', None) is None)
+        if use_cache:
+            from MCEq.results import get_solution_cache
+            cache = get_solution_cache()
+            key = self.solution_key(**kwargs)
+            cached = cache.get(key)
+            if cached is not None:
+                if dbg > 0:
+                    print self.cname + "::solve(): using cached solution."
+                self.solution = np.copy(cached[0])
+                self.grid_sol = ([] if cached[1] is None
+                                 else list(np.copy(cached[1])))
+                self._set_grid_layout(kwargs.get('grid_species', None),
+                                      kwargs.get('grid_dtype', None))
+                return
+
         if config['integrator'] != "odepack":
             self._forward_euler(**kwargs)
         elif config['integrator'] == 'odepack':
@@ -870,6 +1097,11 @@ class MCEqRun():
                 ("MCEq::solve(): Unknown integrator selection '{0}'."
                  ).format(config['integrator']))
 
+        if use_cache:
+            cache.put(key, self.solution,
+                      self.grid_sol if config['integrator'] != 'odepack'
+                      else None)
+
     def _odepack(self, dXstep=1., initial_depth=0.1,
                  *args, **kwargs):
         from scipy.integrate import ode
@@ -917,13 +1149,61 @@ class MCEqRun():
 
         self.solution = r.y
 
-    def _forward_euler(self, int_grid=None, grid_var='X'):
+    def _forward_euler(self, int_grid=None, grid_var='X', grid_sink=None,
+                       grid_species=None, grid_dtype=None, obs_heights=None,
+                       functionals=None):
+        """Integrates with the forward-euler kernel selected in
+        :mod:`mceq_config`.
+
+        Args:
+          int_grid (numpy.array, optional): increasing depths at which the
+            intermediate solutions are passed to ``grid_sink``. They are
+            interpolated between the integration steps (see
+            :class:`MCEq.kernels.DenseOutput`), such that the integration
+            path does not depend on ``int_grid``.
+          grid_var (str, optional): variable of ``int_grid``
+          grid_sink (object, optional): receives the intermediate solutions,
+            see :mod:`MCEq.output`. By default, they are kept in
+            :attr:`grid_sol`. Otherwise :attr:`grid_sol` is left empty.
+          grid_species (list, optional): names of the particles, which are
+            kept in :attr:`grid_sol`, as accepted by
+            :func:`MCEqRun.get_solution`. By default all species are kept.
+          grid_dtype (str, optional): storage type of :attr:`grid_sol`, e.g.
+            ``'float32'`` or ``'log16'``, see
+            :func:`MCEq.output.encode_state`
+          obs_heights (list, optional): heights in m of additional
+            observation levels between ``h_obs`` and ``h_atm`` of
+            :mod:`mceq_config`. The full states at the depths,
+            where the path crosses these heights, are stored in
+            :attr:`obs_sol` and their local zenith angles in
+            :attr:`obs_theta_deg`.
+          functionals (numpy.array or scipy.sparse matrix, optional):
+            weights of shape (n_functionals, dim_states), e.g. from
+            :func:`MCEq.output.energy_integrals`. Only their values at
+            ``int_grid`` are stored in :attr:`grid_functionals`, with shape
+            (n_grid, n_functionals), and :attr:`grid_sol` is left empty.
+        """
+        from MCEq.output import ListSink, FunctionalSink
+
+        self._set_grid_layout(grid_species, grid_dtype)
+        keep_grid_sol = grid_sink is None and functionals is None
+        if functionals is not None:
+            if grid_sink is not None:
+                raise Exception(self.cname + '::_forward_euler(): ' +
+                                'functionals and grid_sink are exclusive.')
+            grid_sink = FunctionalSink(functionals)
+        elif grid_sink is None:
+            grid_sink = ListSink(self._grid_idcs, self._grid_dtype)
+
+        if obs_heights is not None:
+            int_grid, grid_sink = self._add_obs_levels(obs_heights, int_grid,
+                                                       grid_sink)
 
         # Calculate integration path if not yet happened
-        self._calculate_integration_path(int_grid, grid_var)
+        self._calculate_integration_path(grid_var)
 
         phi0 = np.copy(self.phi0)
-        nsteps, dX, rho_inv, grid_idcs = self.integration_path
+        nsteps, dX, rho_inv = self.integration_path
 
         if dbg > 0:
             print ("{0}::_forward_euler(): Solver will perform {1} " +
@@ -959,22 +1239,74 @@ class MCEqRun():
 
 
         self.solution, self.grid_sol = kernel(nsteps, dX, rho_inv,
-            self.int_m, self.dec_m, phi0, grid_idcs, self.progressBar)
+            self.int_m, self.dec_m, phi0, int_grid, self.progressBar,
+            grid_sink)
+        if functionals is not None:
+            self.grid_functionals = self.grid_sol
+        if not keep_grid_sol:
+            self.grid_sol = []
+        if obs_heights is not None:
+            self.obs_sol = grid_sink.obs_sol
 
         self.progressBar.finish()
 
         print ("\n{0}::_forward_euler(): time elapsed during " +
                "integration: {1} sec").format(self.cname, time() - start)
 
-    def _calculate_integration_path(self, int_grid, grid_var):
+    def _add_obs_levels(self, obs_heights, int_grid, grid_sink):
+        """Merges the depths of observation levels into the output grid.
+
+        Args:
+          obs_heights (list): heights of the observation levels in m
+          int_grid (numpy.array): depths of the intermediate solutions
+          grid_sink (object): sink of the intermediate solutions
+
+        Returns:
+          (tuple): merged grid of depths and :class:`MCEq.output.ObsLevelSink`
+        """
+        from MCEq.output import ObsLevelSink
+        import geometry as geom
+
+        h_cm = np.asarray(obs_heights, dtype=np.float64) * 1e2
+        X_obs = self.atm_model.slant_depth_at_heights(h_cm)
+        #: (numpy.array) heights in m of the observation levels
+        self.obs_heights = h_cm / 1e2
+        #: (numpy.array) local zenith angles at the observation levels
+        self.obs_theta_deg = np.degrees(geom.theta_at_h(h_cm,
+                                                        self.atm_model.thrad))
+
+        n_grid = 0 if int_grid is None else len(int_grid)
+        merged = np.concatenate((np.zeros(0) if int_grid is None
+                                 else np.asarray(int_grid, dtype=np.float64),
+                                 X_obs))
+        order = np.argsort(merged, kind='mergesort')
+        grid_map = np.where(order < n_grid, order, -1)
+        obs_map = np.where(order >= n_grid, order - n_grid, -1)
+
+        if dbg > 0:
+            print (self.cname + "::_add_obs_levels(): observation levels " +
+                   "at X = {0} g/cm2").format(X_obs)
+
+        return merged[order], ObsLevelSink(grid_sink, grid_map, obs_map)
+
+    def _calculate_integration_path(self, grid_var='X'):
+        """Calculates the step sizes and densities of the integration.
+
+        The path is kept until the zenith angle, the atmosphere or the
+        largest decay rate (i.e. the interaction model) change.
+
+        Args:
+          grid_var (str, optional): integration variable
+        """
 
         print "MCEqRun::_calculate_integration_path():"
 
-        if (self.integration_path and np.alltrue(int_grid == self.int_grid) and
-            np.alltrue(self.grid_var == grid_var)):
+        if (self.integration_path and self.grid_var == grid_var and
+                self._path_ldec == self.max_ldec):
             return
 
-        self.int_grid, self.grid_var = int_grid, grid_var
+        self.grid_var = grid_var
+        self._path_ldec = self.max_ldec
         if grid_var != 'X':
             raise NotImplementedError('MCEqRun::_calculate_integration_path():' +
                'choice of grid variable other than the depth X are not possible, yet.')
@@ -987,9 +1319,6 @@ class MCEqRun():
         rho_inv_vec = []
 
         X = 0.
-        step = 0
-        grid_step = 0
-        grid_idcs = []
 
         self._init_progress_bar(X_surf)
         self.progressBar.start()
@@ -998,23 +1327,16 @@ class MCEqRun():
             self.progressBar.update(X)
             ri_x = ri(X)
             dX = 1. / (max_ldec * ri_x)
-            if (np.any(int_grid) and (grid_step < int_grid.size)
-                and (X + dX >= int_grid[grid_step])):
-                dX = int_grid[grid_step] - X
-                grid_idcs.append(step)
-                grid_step += 1
             dX_vec.append(dX)
             rho_inv_vec.append(ri_x)
             X = X + dX
-            step += 1
 
         # Integrate
         self.progressBar.finish()
 
         dX_vec = np.array(dX_vec, dtype=np.float32)
         rho_inv_vec = np.array(rho_inv_vec, dtype=np.float32)
-        self.integration_path = dX_vec.size, dX_vec, \
-                                rho_inv_vec, grid_idcs
+        self.integration_path = dX_vec.size, dX_vec, rho_inv_vec
 
 class EdepZFactors():
 
@@ -16,10 +16,13 @@ validating data structures:
   usage in :class:`MCEqRun`
 - :class:`EdepZFactos` calculates energy-dependent spectrum weighted
   moments (Z-Factors)
+- :class:`DataRegistry` shares the content of the data files between
+  all instances of the classes above within one process
   
 """
 
 import numpy as np
+from contextlib import contextmanager
 from mceq_config import config, dbg
 
 
@@ -265,7 +268,449 @@ def _decompress(fname):
 
     return data
 
-class InteractionYields():
+def _file_checksum(fname):
+    """Returns the md5 checksum of a file.
+
+    Args:
+      fname (str): file name
+
+    Returns:
+      (str): hex digest of the file content
+    """
+    import hashlib
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+def _nonzero_band(mat):
+    """Returns the index ranges of rows and columns, which contain
+    non-zero elements.
+
+    Args:
+      mat (numpy.array): matrix
+
+    Returns:
+      tuple(int,int,int,int): (lower row, upper row, lower column,
+      upper column) with exclusive upper bounds or ``None`` if ``mat``
+      contains only zeros
+    """
+    rows = np.flatnonzero(np.any(mat, axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(np.any(mat, axis=0))
+    return (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+
+def _in_band(band, rowidx, colidx):
+    """Checks if the sub-block defined by ``rowidx`` and ``colidx``
+    overlaps with the non-zero ``band`` from :func:`_nonzero_band`.
+
+    Args:
+      band (tuple): non-zero band of a matrix or ``None``
+      rowidx (int,int): row index range
+      colidx (int,int): column index range
+
+    Returns:
+      bool: ``True`` if the sub-block may contain non-zero elements
+    """
+    if band is None:
+        return False
+    return (rowidx[0] < band[1] and band[0] < rowidx[1] and
+            colidx[0] < band[3] and band[2] < colidx[1])
+
+def _gen_yield_index(mat_dict, excl_daughters=(), transpose=False):
+    """Generates the index of mother-daughter relationships and
+    the non-zero bands of the matrices.
+
+    Args:
+      mat_dict (dict): dictionary of matrices with (mother, daughter) keys
+      excl_daughters (list, optional): absolute PDG IDs of daughters which
+                                       are not listed in the index
+      transpose (bool, optional): if ``True``, the bands are recorded for
+                                  the transposed matrices
+
+    Returns:
+      (tuple): (array of mothers, dict of daughter lists,
+      dict of non-zero bands)
+    """
+    mothers = np.unique(zip(*mat_dict.keys())[0])
+    daughter_dict = dict([(mother, []) for mother in mothers])
+    band_dict = {}
+
+    for key, mat in mat_dict.iteritems():
+        band = _nonzero_band(mat.T if transpose else mat)
+        if band is None:
+            continue
+        band_dict[key] = band
+        mother, daughter = key
+        if (abs(daughter) not in excl_daughters and
+            daughter not in daughter_dict[mother]):
+            daughter_dict[mother].append(daughter)
+
+    return mothers, daughter_dict, band_dict
+
+def _load_index(fname, gen_index):
+    """Loads the index belonging to the data file ``fname``.
+
+    The index is stored in a separate file next to the data file
+    together with the checksum of the data file. If the index file
+    does not exist or if the checksum does not match, the index is
+    regenerated by calling ``gen_index`` and stored again.
+
+    Args:
+      fname (str): file name of the data file
+      gen_index (function): generates the index if needed
+
+    Returns:
+      content of the index
+    """
+    import os
+    import cPickle as pickle
+
+    iname = os.path.splitext(fname)[0] + '_index.ppd'
+    checksum = _file_checksum(fname)
+    try:
+        with open(iname, 'rb') as f:
+            stored = pickle.load(f)
+        if stored['checksum'] == checksum:
+            return stored['index']
+        if dbg > 0:
+            print '_load_index(): checksum mismatch, regenerating', iname
+    except (IOError, EOFError, KeyError, pickle.UnpicklingError):
+        if dbg > 0:
+            print '_load_index(): generating index', iname
+
+    index = gen_index()
+    try:
+        with open(iname, 'wb') as f:
+            pickle.dump({'checksum': checksum, 'index': index},
+                        f, protocol=-1)
+    except IOError:
+        print '_load_index(): could not store index', iname
+
+    return index
+
+class DataRegistry():
+
+    """Process-wide registry of shared, read-only data objects.
+
+    Objects are identified by a key, typically containing the file path
+    and, if applicable, the interaction model. The first call to
+    :func:`acquire` creates the object using the ``loader`` function,
+    subsequent calls return the same object and increase its reference
+    count. Once all references are released, the object is dropped from
+    the registry.
+
+    The module level instance :data:`data_registry` is used by
+    :class:`InteractionYields`, :class:`DecayYields` and
+    :class:`HadAirCrossSections`, such that each data file is read from
+    disk only once per session, regardless of how many instances of
+    :class:`MCEq.core.MCEqRun` or :class:`MCEq.core.EdepZFactors` exist.
+
+    Note:
+      Objects handed out by the registry are shared. Do not modify them.
+    """
+
+    def __init__(self):
+        # key -> [object, reference count]
+        self._entries = {}
+
+    def acquire(self, key, loader):
+        """Returns the object registered under ``key`` and increases its
+        reference count.
+
+        Args:
+          key (tuple): identifier of the object
+          loader (function): called without arguments to create the
+                             object if it is not yet registered
+        Returns:
+          shared object
+        """
+        if key not in self._entries:
+            if dbg > 1:
+                print 'DataRegistry::acquire(): loading', key
+            self._entries[key] = [loader(), 0]
+        entry = self._entries[key]
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, key):
+        """Decreases the reference count of the object registered under
+        ``key`` and drops the object if it is not referenced anymore.
+
+        Args:
+          key (tuple): identifier of the object
+        """
+        if key not in self._entries:
+            return
+        entry = self._entries[key]
+        entry[1] -= 1
+        if entry[1] <= 0:
+            if dbg > 1:
+                print 'DataRegistry::release(): dropping', key
+            del self._entries[key]
+
+    def refcount(self, key):
+        """Returns the number of references to the object under ``key``."""
+        return self._entries[key][1] if key in self._entries else 0
+
+    def clear(self):
+        """Drops all objects from the registry, e.g. after data files have
+        been replaced on disk.
+        """
+        self._entries = {}
+
+#: (:class:`DataRegistry`) registry shared by all data classes in this process
+data_registry = DataRegistry()
+
+def get_cross_sections(interaction_model):
+    """Returns a shared, read-only :class:`HadAirCrossSections` object.
+
+    Release the object with :func:`release_cross_sections` when it
+    is not needed anymore, or use :func:`shared_cross_sections`.
+
+    Args:
+      interaction_model (str): interaction model name
+    """
+    from os.path import join
+    key = ('HadAirCrossSections',
+           join(config['data_dir'], config['cs_fname']), interaction_model)
+    return data_registry.acquire(
+        key, lambda: HadAirCrossSections(interaction_model))
+
+def release_cross_sections(interaction_model):
+    """Releases an object obtained from :func:`get_cross_sections`.
+
+    Args:
+      interaction_model (str): interaction model name
+    """
+    from os.path import join
+    data_registry.release(('HadAirCrossSections',
+        join(config['data_dir'], config['cs_fname']), interaction_model))
+
+@contextmanager
+def shared_cross_sections(interaction_model):
+    """Context manager, which provides the object of
+    :func:`get_cross_sections` and releases it on exit, also if an
+    exception occurs.
+
+    Example::
+
+        with shared_cross_sections('SIBYLL2.3') as cs:
+            sigma = cs.get_cs(2212)
+
+    Args:
+      interaction_model (str): interaction model name
+    """
+    cs = get_cross_sections(interaction_model)
+    try:
+        yield cs
+    finally:
+        release_cross_sections(interaction_model)
+
+def _load_yield_file(fname):
+    """Un-pickles the yield file and loads its index.
+
+    Args:
+      fname (str): file name
+
+    Returns:
+      (tuple): (dictionary of yields for each interaction model,
+      energy grid, energy bins, index of each interaction model)
+    """
+    import cPickle as pickle
+    try:
+        with open(fname, 'r') as f:
+            yield_dict = pickle.load(f)
+    except IOError:
+        yield_dict = _decompress(fname)
+        #raise IOError('InteractionYields::_load(): Yield file not found.')
+
+    e_grid = yield_dict.pop('evec')
+    e_bins = yield_dict.pop('ebins')
+    index = _load_index(fname, lambda: dict(
+        [(iam, _gen_yield_index(yields, excl_daughters=[11, 22]))
+         for iam, yields in yield_dict.iteritems()]))
+
+    return yield_dict, e_grid, e_bins, index
+
+def _load_decay_file(fname):
+    """Un-pickles the decay file and loads its index.
+
+    Args:
+      fname (str): file name
+
+    Returns:
+      (tuple): (dictionary of decay matrices, index)
+    """
+    import cPickle as pickle
+    try:
+        with open(fname, 'r') as f:
+            decay_dict = pickle.load(f)
+    except IOError:
+        decay_dict = _decompress(fname)
+        # raise IOError('DecayYields::_load(): Yield file not found.')
+
+    return decay_dict, _load_index(fname, lambda: _gen_yield_index(
+        decay_dict, transpose=True))
+
+def _load_cs_file(fname):
+    """Un-pickles the cross-section file.
+
+    Args:
+      fname (str): file name
+
+    Returns:
+      (dict): dictionary of cross-sections for each interaction model
+    """
+    import cPickle as pickle
+    try:
+        with open(fname, 'r') as f:
+            return pickle.load(f)
+    except IOError:
+        return _decompress(fname)
+        # raise IOError('HadAirCrossSections::_load(): ' +
+        #               'Yield file not found.')
+
+def _rebin_operators(widths, n_merge):
+    """Returns the operators, which map spectra between an energy grid and
+    a coarser grid, where ``n_merge`` neighboring bins are merged.
+
+    Spectra are densities :math:`dN/dE`. The restriction operator
+    :math:`R` averages the fine bins weighted with their widths, such
+    that the number of particles is conserved. The prolongation operator
+    :math:`P` maps a coarse spectrum back to the fine grid assuming a
+    constant :math:`dN/dE` within each coarse bin. A (yield or decay)
+    matrix :math:`M`, which maps fine spectra onto fine spectra, becomes
+    :math:`R M P` on the coarse grid. If the number of bins is not a
+    multiple of ``n_merge``, the last coarse bin contains fewer bins.
+
+    Args:
+      widths (numpy.array): widths of the fine bins
+      n_merge (int): number of fine bins per coarse bin
+
+    Returns:
+      (tuple): (:math:`R` with shape (coarse, fine), :math:`P` with
+      shape (fine, coarse))
+    """
+    d = widths.size
+    group = np.arange(d) // n_merge
+    P = np.zeros((d, group[-1] + 1))
+    P[np.arange(d), group] = 1.
+    R = (P * widths[:, np.newaxis]).T
+    R /= np.sum(R, axis=1)[:, np.newaxis]
+    return R, P
+
+def _rebin_band(band, n_merge):
+    """Converts a non-zero band (see :func:`_nonzero_band`) to
+    the coarse grid defined in :func:`_rebin_operators`.
+    """
+    if band is None or n_merge == 1:
+        return band
+    return (band[0] // n_merge, (band[1] - 1) // n_merge + 1,
+            band[2] // n_merge, (band[3] - 1) // n_merge + 1)
+
+#: in-memory cache of injected charm yields, see
+#: :func:`InteractionYields.inject_custom_charm_model`
+_charm_cache = {}
+
+def _array_digest(arr):
+    """Returns the md5 hex digest of the content of a numpy array."""
+    import hashlib
+    return hashlib.md5(np.ascontiguousarray(arr).tostring()).hexdigest()
+
+def _charm_cache_fname(key):
+    """Returns the file name of the on-disk cache for injected charm yields.
+
+    Args:
+      key (tuple): (interaction model, charm model, energy grid digest)
+    """
+    from os.path import join
+    iam, model, digest = key
+    return join(config['data_dir'], 'charm_cache_{0}_{1}_{2}.ppd'.format(
+        iam, model, digest[:12]))
+
+def _load_charm_blocks(key):
+    """Loads injected charm yields from the on-disk cache into
+    the in-memory cache, if available.
+
+    Args:
+      key (tuple): (interaction model, charm model, energy grid digest)
+    """
+    import cPickle as pickle
+    try:
+        with open(_charm_cache_fname(key), 'rb') as f:
+            _charm_cache[key] = pickle.load(f)
+    except (IOError, EOFError, pickle.UnpicklingError):
+        pass
+
+def _dump_charm_blocks(key):
+    """Stores injected charm yields from the in-memory cache on disk.
+
+    Args:
+      key (tuple): (interaction model, charm model, energy grid digest)
+    """
+    import os
+    import cPickle as pickle
+    from tempfile import mkstemp
+    fname = _charm_cache_fname(key)
+    tmp_fname = None
+    try:
+        # Unique temporary file, since several processes may store
+        # the same entry concurrently
+        fd, tmp_fname = mkstemp(dir=os.path.dirname(fname), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(_charm_cache[key], f, protocol=-1)
+        os.chmod(tmp_fname, 0644)
+        os.rename(tmp_fname, fname)
+    except (IOError, OSError):
+        print '_dump_charm_blocks(): could not store', fname
+        if tmp_fname is not None and os.path.isfile(tmp_fname):
+            os.remove(tmp_fname)
+
+def clear_charm_cache(disk=True):
+    """Clears the cache of injected charm yields.
+
+    Args:
+      disk (bool, optional): if ``True``, delete also the on-disk cache
+    """
+    import os
+    from glob import glob
+    _charm_cache.clear()
+    if disk:
+        for fname in glob(os.path.join(config['data_dir'],
+                                       'charm_cache_*.ppd')):
+            os.remove(fname)
+
+class _SharedData():
+
+    """Mixin for classes, which keep a reference to an object in
+    :data:`data_registry`. The reference is released when the
+    instance is deleted or explicitly by calling :func:`release`.
+    """
+    #: (tuple) key of the data in :data:`data_registry`
+    _data_key = None
+
+    def _acquire(self, key, loader):
+        self.release()
+        self._data_key = key
+        return data_registry.acquire(key, loader)
+
+    def release(self):
+        """Releases the reference to the shared data file content."""
+        if self._data_key is not None:
+            data_registry.release(self._data_key)
+            self._data_key = None
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            # module globals may be gone at interpreter shutdown
+            pass
+
+class InteractionYields(_SharedData):
 
     """Class for managing the dictionary of interaction yield matrices.
 
@@ -297,70 +742,100 @@ class InteractionYields():
     dim = 0
     #: (tuple) selection of a band of coeffictients (in xf)
     band = None
+    #: (int) number of merged bins of the yield file grid, see :func:`rebin`
+    n_merge = 1
+    #: (tuple) restriction and prolongation operators, see :func:`rebin`
+    rebin_ops = None
 
     def __init__(self, interaction_model, charm_model=None):
 
         self._load()
 
-        # If parameters are provided during object creation,
-        # load the tables during object creation.
-        if interaction_model != None:
-            self.set_interaction_model(interaction_model)
+        try:
+            # If parameters are provided during object creation,
+            # load the tables during object creation.
+            if interaction_model != None:
+                self.set_interaction_model(interaction_model)
 
-        if charm_model and interaction_model:
-            self.inject_custom_charm_model(charm_model)
+            if charm_model and interaction_model:
+                self.inject_custom_charm_model(charm_model)
+        except:
+            # Do not keep the shared data of a failed instance
+            self.release()
+            raise
 
     def _load(self):
         """Un-pickles the yields dictionary using the path specified as
         ``yield_fname`` in :mod:`mceq_config`.
 
-        Class attributes :attr:`e_grid`, :attr:`e_bins`, :attr:`weights`, 
-        :attr:`dim` are set here.
+        The content of the file is shared with other instances via
+        :data:`data_registry`. Class attributes :attr:`e_grid`,
+        :attr:`e_bins`, :attr:`weights`, :attr:`dim` are set here.
 
         Raises:
           IOError: if file not found
         """
-        import cPickle as pickle
         from os.path import join
-        try:
-            with open(join(config['data_dir'],
-                           config['yield_fname']), 'r') as f:
-                self.yield_dict = pickle.load(f)
-        except IOError:
-            self.yield_dict = _decompress(join(config['data_dir'],
-                                            config['yield_fname']))
-            #raise IOError('InteractionYields::_load(): Yield file not found.')
-
-        self.e_grid = self.yield_dict.pop('evec')
-        self.e_bins = self.yield_dict.pop('ebins')
+        fname = join(config['data_dir'], config['yield_fname'])
+        #: (dict) index of each interaction model, see
+        #: :func:`_gen_yield_index`
+        self.yield_dict, self.data_e_grid, self.data_e_bins, self.index = \
+            self._acquire(('InteractionYields', fname),
+                          lambda: _load_yield_file(fname))
+        #: (numpy.array) bin widths of the yield file grid
+        self.data_weights = np.diag(self.data_e_bins[1:] -
+                                    self.data_e_bins[:-1])
+
+        self.rebin(self.n_merge)
+
+    def rebin(self, n_merge):
+        """Sets up a coarser energy grid by merging ``n_merge``
+        neighboring bins of the grid from the yield file.
+
+        The yield matrices are not modified. :func:`get_y_matrix` maps
+        them on the coarse grid with the number conserving operators
+        from :func:`_rebin_operators`, which are stored in
+        :attr:`rebin_ops`. The attributes :attr:`e_grid`, :attr:`e_bins`,
+        :attr:`weights` and :attr:`dim` refer to the coarse grid. Use
+        :func:`to_data_grid` to map spectra back to the grid of the file.
+
+        Args:
+          n_merge (int): number of merged bins, 1 restores the original grid
+        """
+        self.n_merge = n_merge
+        if n_merge == 1:
+            self.rebin_ops = None
+            self.e_grid, self.e_bins = self.data_e_grid, self.data_e_bins
+        else:
+            self.rebin_ops = _rebin_operators(np.diag(self.data_weights),
+                                              n_merge)
+            self.e_bins = np.append(self.data_e_bins[:-1:n_merge],
+                                    self.data_e_bins[-1])
+            self.e_grid = np.sqrt(self.e_bins[1:] * self.e_bins[:-1])
+            if dbg > 0:
+                print ('InteractionYields::rebin(): merging {0} bins, ' +
+                       'new dimension {1}').format(n_merge, self.e_grid.size)
+
         self.weights = np.diag(self.e_bins[1:] - self.e_bins[:-1])
         self.dim = self.e_grid.size
         self.no_interaction = np.zeros(self.dim ** 2).reshape(
             self.dim, self.dim)
 
-    def _gen_index(self, yield_dict):
-        """Generates index of mother-daughter relationships.
+    def to_data_grid(self, spectrum):
+        """Maps a spectrum :math:`dN/dE` from the (coarse) grid :attr:`e_grid`
+        to the grid of the yield file :attr:`data_e_grid`.
 
-        Currently this function is called each time an interaction model
-        is set. In future versions this index will be part of the pickled
-        dictionary.
+        Within each coarse bin the spectrum is assumed to be constant.
 
         Args:
-          yield_dict (dict): dictionary of yields for one interaction model
-        """
-        self.projectiles = np.unique(zip(*yield_dict.keys())[0])
-        self.secondary_dict = {}
-        for projectile in self.projectiles:
-            self.secondary_dict[projectile] = []
+          spectrum (numpy.array): spectrum on :attr:`e_grid`
 
-        for key, mat in yield_dict.iteritems():
-            proj, sec = key
-            # exclude electrons and photons
-            if np.sum(mat) > 0 and abs(sec) not in [11, 22]:
-                assert(sec not in self.secondary_dict[proj]), \
-                ("InteractionYields:_gen_index()::" +
-                "Error in construction of index array: {0} -> {1}".format(proj, sec))
-                self.secondary_dict[proj].append(sec)
+        Returns:
+          numpy.array: spectrum on :attr:`data_e_grid`
+        """
+        if self.rebin_ops is None:
+            return spectrum
+        return self.rebin_ops[1].dot(spectrum)
 
     def set_interaction_model(self, interaction_model, force=False):
         """Selects an interaction model and prepares all internal variables. 
@@ -381,7 +856,8 @@ class InteractionYields():
                             "available for the selected interaction " +
                             "model: {0}.".format(interaction_model))
 
-        self._gen_index(self.yield_dict[interaction_model])
+        self.projectiles, self.secondary_dict, self.band_dict = \
+            self.index[interaction_model]
 
         self.nspec = len(self.projectiles)
         self.yields = self.yield_dict[interaction_model]
@@ -418,6 +894,26 @@ class InteractionYields():
 
         return True
 
+    def is_yield_block(self, projectile, projidx, daughter, dtridx):
+        """Checks if the sub-block of the yield matrix, defined by
+        ``projidx`` and ``dtridx``, contains non-zero elements.
+
+        The check uses only the non-zero bands from the index and
+        does not touch the yield matrices.
+
+        Args:
+          projectile (int): PDG ID of projectile particle
+          projidx (int,int): index range relative to the projectile's
+                             energy grid
+          daughter (int): PDG ID of final state daughter/secondary particle
+          dtridx (int,int): index range relative to the daughter's
+                            energy grid
+        Returns:
+          bool: ``False`` if the sub-block contains only zeros
+        """
+        return _in_band(_rebin_band(self.band_dict.get(
+            (projectile, daughter)), self.n_merge), dtridx, projidx)
+
     def get_y_matrix(self, projectile, daughter):
         """Returns a ``DIM x DIM`` yield matrix.
 
@@ -433,10 +929,12 @@ class InteractionYields():
           carried out. 
         """
         # TODO: modify yields to include the bin size
+        m = self.yields[(projectile, daughter)].dot(self.data_weights)
+        if self.rebin_ops is not None:
+            m = self.rebin_ops[0].dot(m).dot(self.rebin_ops[1])
         if not self.band:
-            return self.yields[(projectile, daughter)].dot(self.weights)
+            return m
         else:
-            m = self.yields[(projectile, daughter)].dot(self.weights)
             # set all elements except those inside selected xf band to 0
             
             m[np.tril_indices(self.dim, -2 - self.band[1])] = 0
@@ -458,6 +956,8 @@ class InteractionYields():
                             to the daughters's energy grid
           cmat (numpy.array): array reference to the interaction matrix 
         """
+        if not self.is_yield_block(projectile, projidx, daughter, dtridx):
+            return
         cmat[dtridx[0]:dtridx[1], projidx[0]:projidx[1]] = \
             self.get_y_matrix(projectile, daughter)[dtridx[0]:dtridx[1],
                                                     projidx[0]:projidx[1]]
@@ -471,6 +971,13 @@ class InteractionYields():
         combinations and replaces the yield matrices with those from
         the ``model``.
 
+        The injected matrices are cached in memory for each combination
+        of interaction model, charm model and energy grid, such that
+        alternating between charm models does not require to recompute
+        them. If ``use_charm_cache`` is enabled in :mod:`mceq_config`,
+        the cache is also kept on disk in the ``data_dir``. Use
+        :func:`clear_charm_cache` if the underlying data changes.
+
         Args:
           model (str): charm model name
 
@@ -478,10 +985,7 @@ class InteractionYields():
           NotImplementedError: if model string unknown.
         """
 
-        from ParticleDataTool import SibyllParticleTable
-        from charm_models import MRS_charm  # @UnresolvedImport
-
-        if model == None:
+        if model == None or model == self.charm_model:
             return
 
         if self.charm_model and self.charm_model != model:
@@ -491,43 +995,106 @@ class InteractionYields():
 #                            'changing injected charm model back to ' +
 #                            'default not implemented .')
 
+        key = (self.iam, model, _array_digest(self.data_e_grid))
+        if key not in _charm_cache and config['use_charm_cache']:
+            _load_charm_blocks(key)
+        if key not in _charm_cache:
+            blocks = self._gen_charm_blocks(model)
+            _charm_cache[key] = (blocks, dict(
+                [(k, _nonzero_band(mat)) for k, mat in blocks.iteritems()]))
+            if config['use_charm_cache']:
+                _dump_charm_blocks(key)
+        elif dbg > 0:
+            print ('InteractionYields:inject_custom_charm_model():: using ' +
+                   'cached yields for {0}/{1}').format(self.iam, model)
+
+        blocks, bands = _charm_cache[key]
+
+        # make a copy of current yields and index before starting
+        # overwriting/injecting a charm model on top
+        self.yields = dict(self.yields)
+        self.yields.update(blocks)
+        self._update_index(bands)
+        self.charm_model = model
+
+    def _gen_charm_blocks(self, model):
+        """Calculates the yield matrices of all (projectile, charm_daughter)
+        combinations for the charm model ``model``.
+
+        Args:
+          model (str): charm model name
+
+        Returns:
+          (dict): yield matrices with (projectile, charm_daughter) keys
+
+        Raises:
+          NotImplementedError: if model string unknown.
+        """
+        from ParticleDataTool import SibyllParticleTable
+        from charm_models import MRS_charm  # @UnresolvedImport
+
         sib = SibyllParticleTable()
         charm_modids = [sib.modid2pdg[modid] for modid in
                         sib.mod_ids if abs(modid) >= 59]
         del sib
-        # make a copy of current yields before starting overwriting/injecting
-        # a charm model on top
-        from copy import copy
-        self.yields = copy(self.yields)
-        
+
+        blocks = {}
         if model == 'MRS':
             
             # Set charm production to zero
-            cs = HadAirCrossSections(self.iam)
-            mrs = MRS_charm(self.e_grid, cs)
-            for proj in self.projectiles:
-                for chid in charm_modids:
-                    self.yields[(proj, chid)] = mrs.get_yield_matrix(
-                        proj, chid)
+            with shared_cross_sections(self.iam) as cs:
+                mrs = MRS_charm(self.data_e_grid, cs)
+                blocks = mrs.get_yield_matrices(self.projectiles,
+                                                charm_modids)
 
         elif model == 'sibyll23_pl':
-            cs_h_air = HadAirCrossSections('SIBYLL2.3')
-            cs_h_p = HadAirCrossSections('SIBYLL2.3_pp')
-            for proj in self.projectiles:
-                cs_scale = np.diag(cs_h_p.get_cs(proj)/cs_h_air.get_cs(proj))
-                for chid in charm_modids:
-                    # rescale yields with sigma_pp/sigma_air to ensure
-                    # that in a later step indeed sigma_{pp,ccbar} is taken
-                    
-                    self.yields[(proj, chid)] = self.yield_dict[
-                        'SIBYLL2.3_rc1_pl'][(proj, chid)].dot(cs_scale) * 14.5
+            with shared_cross_sections('SIBYLL2.3') as cs_h_air, \
+                    shared_cross_sections('SIBYLL2.3_pp') as cs_h_p:
+                for proj in self.projectiles:
+                    cs_scale = np.diag(cs_h_p.get_cs(proj) /
+                                       cs_h_air.get_cs(proj))
+                    for chid in charm_modids:
+                        # rescale yields with sigma_pp/sigma_air to ensure
+                        # that in a later step indeed sigma_{pp,ccbar} is
+                        # taken
+                        blocks[(proj, chid)] = self.yield_dict[
+                            'SIBYLL2.3_rc1_pl'][(proj, chid)].dot(
+                                cs_scale) * 14.5
 
         else:
             raise NotImplementedError('InteractionYields:inject_custom_charm_model()::' +
                                       ' Unsupported model')
 
-        self._gen_index(self.yields)
-        self.charm_model = model
+        return blocks
+
+    def _update_index(self, bands):
+        """Updates the index after replacing some of the yield matrices.
+
+        In contrast to :func:`_gen_yield_index`, only the replaced
+        matrices are considered.
+
+        Args:
+          bands (dict): non-zero bands of the replaced matrices, with
+                        (projectile, daughter) keys
+        """
+        secondary_dict = dict([(proj, list(secs)) for proj, secs
+                               in self.secondary_dict.iteritems()])
+        band_dict = dict(self.band_dict)
+
+        for (proj, sec), band in bands.iteritems():
+            secs = secondary_dict.setdefault(proj, [])
+            if band is None:
+                band_dict.pop((proj, sec), None)
+                if sec in secs:
+                    secs.remove(sec)
+                continue
+            band_dict[(proj, sec)] = band
+            # exclude electrons and photons
+            if abs(sec) not in [11, 22] and sec not in secs:
+                secs.append(sec)
+
+        self.projectiles = np.unique(secondary_dict.keys())
+        self.secondary_dict, self.band_dict = secondary_dict, band_dict
 
     def __repr__(self):
         a_string = 'Possible (projectile,secondary) configurations:\n'
@@ -537,7 +1104,7 @@ class InteractionYields():
         return a_string
 
 
-class DecayYields():
+class DecayYields(_SharedData):
 
     """Class for managing the dictionary of decay yield matrices.
 
@@ -549,10 +1116,20 @@ class DecayYields():
       weights (numpy.array): bin widths of energy grid
     """
 
+    #: (int) number of merged bins, see :func:`rebin`
+    n_merge = 1
+    #: (tuple) restriction and prolongation operators, see :func:`rebin`
+    rebin_ops = None
+
     def __init__(self, weights):
         self.weights = weights
         self._load()
-        self._gen_index()
+        try:
+            self._gen_index()
+        except:
+            # Do not keep the shared data of a failed instance
+            self.release()
+            raise
 
         self.particle_keys = self.mothers
 
@@ -560,37 +1137,31 @@ class DecayYields():
         """Un-pickles the yields dictionary using the path specified as
         ``decay_fname`` in :mod:`mceq_config`.
 
+        The content of the file is shared with other instances via
+        :data:`data_registry`.
+
         Raises:
           IOError: if file not found
         """
-        import cPickle as pickle
         from os.path import join
-        try:
-            with open(join(config['data_dir'],
-                           config['decay_fname']), 'r') as f:
-                self.decay_dict = pickle.load(f)
-        except IOError:
-            self.decay_dict = _decompress(join(config['data_dir'],
-                                            config['decay_fname']))
-            # raise IOError('DecayYields::_load(): Yield file not found.')
+        fname = join(config['data_dir'], config['decay_fname'])
+        #: (tuple) index of the decay file, see :func:`_gen_index`
+        decay_dict, self.index = self._acquire(
+            ('DecayYields', fname), lambda: _load_decay_file(fname))
+        # copy, since the aliases are added in _gen_index
+        self.decay_dict = dict(decay_dict)
 
     def _gen_index(self):
-        """Generates index of mother-daughter relationships.
+        """Sets up the index of mother-daughter relationships.
 
-        This function is called once after un-pickling. In future 
-        versions this index will be part of the pickled dictionary.
+        The index is stored in a file next to the decay file and
+        loaded in :func:`_load`. Besides the lists of daughters, it
+        contains the non-zero band of each decay matrix in
+        :attr:`band_dict`.
         """
-        self.mothers = np.unique(zip(*self.decay_dict.keys())[0])
-        self.daughter_dict = {}
-
-        for mother in self.mothers:
-            self.daughter_dict[mother] = []
-
-        for key, mat in self.decay_dict.iteritems():
-            mother, daughter = key
-            if np.sum(mat) > 0:
-                if daughter not in self.daughter_dict[mother]:
-                    self.daughter_dict[mother].append(daughter)
+        self.mothers, daughter_dict, band_dict = self.index
+        self.daughter_dict = dict(daughter_dict)
+        self.band_dict = dict(band_dict)
 
         # special treatment for muons, which should decay even if they
         # have an alias ID
@@ -600,8 +1171,23 @@ class DecayYields():
             self.daughter_dict[-alias] = self.daughter_dict[-13]
             for d in self.daughter_dict[alias]:
                 self.decay_dict[(alias, d)] = self.decay_dict[(13, d)]
+                self.band_dict[(alias, d)] = self.band_dict[(13, d)]
             for d in self.daughter_dict[-alias]:
                 self.decay_dict[(-alias, d)] = self.decay_dict[(-13, d)]
+                self.band_dict[(-alias, d)] = self.band_dict[(-13, d)]
+
+    def rebin(self, n_merge):
+        """Maps the decay matrices on a coarser energy grid, where
+        ``n_merge`` neighboring bins are merged.
+
+        See :func:`InteractionYields.rebin` for details.
+
+        Args:
+          n_merge (int): number of merged bins, 1 restores the original grid
+        """
+        self.n_merge = n_merge
+        self.rebin_ops = None if n_merge == 1 else \
+            _rebin_operators(np.diag(self.weights), n_merge)
 
     def get_d_matrix(self, mother, daughter):
         """Returns a ``DIM x DIM`` decay matrix.
@@ -621,7 +1207,10 @@ class DecayYields():
             print ("DecayYields:get_d_matrix():: trying to get empty matrix" +
                    "{0} -> {1}").format(mother, daughter)
         # TODO: fix structure of the decay dict
-        return (self.decay_dict[(mother, daughter)].T).dot(self.weights)
+        m = (self.decay_dict[(mother, daughter)].T).dot(self.weights)
+        if self.rebin_ops is not None:
+            m = self.rebin_ops[0].dot(m).dot(self.rebin_ops[1])
+        return m
 
     def assign_d_idx(self, mother, moidx,
                      daughter, dtridx, dmat):
@@ -637,10 +1226,31 @@ class DecayYields():
                             to the daughters's energy grid
           dmat (numpy.array): array reference to the decay matrix 
         """
+        if not self.is_decay_block(mother, moidx, daughter, dtridx):
+            return
         dmat[dtridx[0]:dtridx[1], moidx[0]:moidx[1]] = \
             self.get_d_matrix(mother, daughter)[dtridx[0]:dtridx[1],
                                                 moidx[0]:moidx[1]]
 
+    def is_decay_block(self, mother, moidx, daughter, dtridx):
+        """Checks if the sub-block of the decay matrix, defined by
+        ``moidx`` and ``dtridx``, contains non-zero elements.
+
+        The check uses only the non-zero bands from the index and
+        does not touch the decay matrices.
+
+        Args:
+          mother (int): PDG ID of mother particle
+          moidx (int,int): index range relative to the mother's energy grid
+          daughter (int): PDG ID of final state daughter particle
+          dtridx (int,int): index range relative to the daughter's
+                            energy grid
+        Returns:
+          bool: ``False`` if the sub-block contains only zeros
+        """
+        return _in_band(_rebin_band(self.band_dict.get((mother, daughter)),
+                                    self.n_merge), dtridx, moidx)
+
     def is_daughter(self, mother, daughter):
         """Checks if ``daughter`` is a decay daughter of ``mother``.
 
@@ -678,7 +1288,7 @@ class DecayYields():
         return a_string
 
 
-class HadAirCrossSections():
+class HadAirCrossSections(_SharedData):
 
     """Class for managing the dictionary of hadron-air cross-sections.
 
@@ -693,6 +1303,10 @@ class HadAirCrossSections():
     iam = None
     #: current energy grid
     egrid = None
+    #: (int) number of merged bins, see :func:`rebin`
+    n_merge = 1
+    #: (tuple) restriction and prolongation operators, see :func:`rebin`
+    rebin_ops = None
 
     #: unit - :math:`\text{GeV} \cdot \text{fm}`
     GeVfm = 0.19732696312541853
@@ -707,30 +1321,32 @@ class HadAirCrossSections():
 
         self._load()
 
-        if interaction_model != None:
-            self.set_interaction_model(interaction_model)
-        else:
-            # Set some default interaction model to allow for cross-sections
-            self.set_interaction_model('SIBYLL2.2')
+        try:
+            if interaction_model != None:
+                self.set_interaction_model(interaction_model)
+            else:
+                # Set some default interaction model to allow for
+                # cross-sections
+                self.set_interaction_model('SIBYLL2.2')
+        except:
+            # Do not keep the shared data of a failed instance
+            self.release()
+            raise
 
     def _load(self):
         """Un-pickles a dictionary using the path specified as
-        ``decay_fname`` in :mod:`mceq_config`.
+        ``cs_fname`` in :mod:`mceq_config`.
+
+        The content of the file is shared with other instances via
+        :data:`data_registry`.
 
         Raises:
           IOError: if file not found
         """
-        import cPickle as pickle
         from os.path import join
-        try:
-            with open(join(config['data_dir'],
-                           config['cs_fname']), 'r') as f:
-                self.cs_dict = pickle.load(f)
-        except IOError:
-            self.cs_dict = _decompress(join(config['data_dir'],
-                                            config['cs_fname']))
-            # raise IOError('HadAirCrossSections::_load(): ' +
-            #               'Yield file not found.')
+        fname = join(config['data_dir'], config['cs_fname'])
+        self.cs_dict = self._acquire(('HadAirCrossSections', fname),
+                                     lambda: _load_cs_file(fname))
 
         self.egrid = self.cs_dict['evec']
 
@@ -764,6 +1380,20 @@ class HadAirCrossSections():
                             "interaction model {0} available.".format(interaction_model))
         self.cs = self.cs_dict[self.iam]
 
+    def rebin(self, n_merge):
+        """Averages the cross-sections over a coarser energy grid, where
+        ``n_merge`` neighboring bins are merged.
+
+        See :func:`InteractionYields.rebin` for details.
+
+        Args:
+          n_merge (int): number of merged bins, 1 restores the original grid
+        """
+        from misc import get_bins_and_width_from_centers
+        self.n_merge = n_merge
+        self.rebin_ops = None if n_merge == 1 else _rebin_operators(
+            get_bins_and_width_from_centers(self.egrid)[1], n_merge)
+
     def get_cs(self, projectile, mbarn=False):
         """Returns inelastic ``projectile``-air cross-section 
         :math:`\\sigma_{inel}^{proj-Air}(E)` as vector spanned over 
@@ -778,26 +1408,36 @@ class HadAirCrossSections():
           numpy.array: cross-section in :math:`mbarn` or :math:`\\text{cm}^2` 
         """
 
-        message_templ = 'HadAirCrossSections(): replacing {0} with {1} cross-section'
         scale = 1.0
 
         if not mbarn:
             scale = self.mbarn2cm2
 
+        cs = self._get_data_cs(projectile)
+        if self.rebin_ops is not None and np.ndim(cs):
+            cs = self.rebin_ops[0].dot(cs)
+        return scale * cs
+
+    def _get_data_cs(self, projectile):
+        """Returns the cross-section in mbarn on the grid of the
+        cross-section file (see :func:`get_cs`).
+        """
+        message_templ = 'HadAirCrossSections(): replacing {0} with {1} cross-section'
+
         if abs(projectile) in self.cs.keys():
-            return scale * self.cs[projectile]
+            return self.cs[projectile]
         elif abs(projectile) in [411, 421, 431, 15]:
             if dbg > 2:
                 print message_templ.format('D', 'K+-')
-            return scale * self.cs[321]
+            return self.cs[321]
         elif abs(projectile) in [4332, 4232, 4132]:
             if dbg > 2:
                 print message_templ.format('charmed baryon', 'nucleon')
-            return scale * self.cs[2212]
+            return self.cs[2212]
         elif abs(projectile) > 2000 and abs(projectile) < 5000:
             if dbg > 2:
                 print message_templ.format(projectile, 'nucleon')
-            return scale * self.cs[2212]
+            return self.cs[2212]
         elif 11 < abs(projectile) < 17 or 7000 < abs(projectile) < 7500:
             if dbg > 2:
                 print 'HadAirCrossSections(): returning 0 cross-section for lepton', projectile
@@ -805,7 +1445,7 @@ class HadAirCrossSections():
         else:
             if dbg > 2:
                 print message_templ.format(projectile, 'pion')
-            return scale * self.cs[211]
+            return self.cs[211]
 
     def __repr__(self):
         a_string = 'HadAirCrossSections() available for the projectiles: \n'
@@ -4,10 +4,11 @@
 ===============================================================
 
 This module includes classes and functions modeling the Earth's atmosphere.
-Currently, two different types models are supported:
+Currently, three different types models are supported:
 
 - Linsley-type/CORSIKA-style parameterization
 - Numerical atmosphere via external routine (NRLMSISE-00)
+- Tabulated density profiles, e.g. from measurements
 
 Both implementations have to inherit from the abstract class 
 :class:`CascadeAtmosphere`, which provides the functions for other parts of
@@ -32,6 +33,7 @@ Example:
       $ python MCEq/atmospheres.py
 """
 
+import os
 import numpy as np
 import geometry as geom
 from numba import jit, double  # @UnresolvedImport
@@ -39,49 +41,128 @@ from os.path import join
 from abc import ABCMeta, abstractmethod
 from mceq_config import dbg, config
 
-def _load_cache():
-    """Loads atmosphere cache from file.
+def _cache_fname(key, theta_deg=None):
+    """Returns the file name of a cached spline in the directory
+    ``config['atm_cache_dir']`` (relative to ``config['data_dir']``).
 
-    If file does not exist, function returns
-    a new empty dictionary.
+    Each spline is stored in its own file, such that a lookup is a
+    single file access and concurrent writers of different entries
+    do not interfere.
+
+    Args:
+      key (tuple): atmosphere key, e.g. (class name, location, season)
+      theta_deg (float, optional): zenith angle. If None, only the
+                                   prefix common to all angles is returned
 
     Returns:
-        dict: Dictionary containing splines.
+      str: full path of the cache file
+    """
+    prefix = '_'.join([str(k).replace(' ', '').replace(os.sep, '-')
+                       for k in key])
+    if theta_deg is None:
+        return join(config['data_dir'], config['atm_cache_dir'],
+                    prefix + '_')
+    return join(config['data_dir'], config['atm_cache_dir'],
+                '{0}_{1:08.4f}.npz'.format(prefix, theta_deg))
+
+
+def _load_cache(key, theta_deg, exact=False):
+    """Loads a spline of :math:`\\rho(X)` from the atmosphere cache.
+
+    If no entry exists for ``theta_deg``, the closest cached zenith
+    angle within 1 degree is used, unless ``exact`` is set.
+
+    Args:
+      key (tuple): atmosphere key, e.g. (class name, location, season)
+      theta_deg (float): zenith angle in degrees
+      exact (bool, optional): only use an entry for ``theta_deg``
+                              (within the :math:`10^{-4}` degrees of
+                              the file names)
 
+    Returns:
+      (tuple): (zenith angle of the entry, X_surf, spline) or None
     """
-    import cPickle as pickle
+    from glob import glob
+    from scipy.interpolate import PPoly
+
+    fname = _cache_fname(key, theta_deg)
+    if not os.path.isfile(fname):
+        if exact:
+            return None
+        prefix = _cache_fname(key)
+        cached_thetas = np.array([float(f[len(prefix):-4])
+                                  for f in glob(prefix + '[0-9][0-9][0-9].' +
+                                                '[0-9][0-9][0-9][0-9].npz')])
+        if not cached_thetas.size:
+            return None
+        closest = cached_thetas[np.argmin(np.abs(cached_thetas - 
+                                                 theta_deg))]
+        if abs(closest - theta_deg) >= 1.:
+            return None
+        theta_deg = closest
+        fname = _cache_fname(key, theta_deg)
+
     if dbg > 0:
-        print "atmospheres::_load_cache(): loading cache."
-    fname = join(config['data_dir'],
-                 config['atm_cache_file'])
-    
+        print "density_profiles::_load_cache(): loading", fname
     try:
-        return pickle.load(open(fname, 'r'))
-    except IOError:
-        print "density_profiles::_load_cache(): creating new cache.."
-        return {}
+        entry = np.load(fname)
+        return (theta_deg, float(entry['X_surf']),
+                PPoly(entry['c'], entry['x']))
+    except (IOError, KeyError, ValueError):
+        print "density_profiles::_load_cache(): skipping unreadable", fname
+        return None
+
 
-def _dump_cache(cache):
-    """Stores atmosphere cache to file.
+def _atomic_savez(fname, **arrays):
+    """Stores arrays in a .npz file, which is first written under a
+    temporary name and then atomically renamed, such that readers
+    never see incomplete files.
 
     Args:
-        (dict) current cache
+      fname (str): full path of the file
+      arrays (dict): arrays to store
     Raises:
         IOError:
     """
-    import cPickle as pickle
-    
-    if dbg > 0:
-        print "density_profiles::_dump_cache() dumping cache."
-    fname = join(config['data_dir'],
-                 config['atm_cache_file'])
-    print fname
+    from tempfile import mkstemp
+
+    cache_dir = os.path.dirname(fname)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+    except OSError:
+        # Directory created by a concurrent process
+        pass
     try:
-        pickle.dump(cache, open(fname, 'w'), protocol=-1)
-    except IOError:
-        raise IOError("density_profiles::_dump_cache(): " + 
+        fd, tmp_fname = mkstemp(dir=cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.chmod(tmp_fname, 0644)
+        os.rename(tmp_fname, fname)
+    except (IOError, OSError):
+        raise IOError("density_profiles::_atomic_savez(): " + 
                 'could not (re-)create cache. Wrong working directory?')
 
+
+def _dump_cache(key, theta_deg, X_surf, spline):
+    """Stores a spline of :math:`\\rho(X)` in the atmosphere cache.
+
+    The spline is stored as plain breakpoint and coefficient arrays of
+    its piecewise polynomial representation, see :func:`_atomic_savez`.
+
+    Args:
+      key (tuple): atmosphere key, e.g. (class name, location, season)
+      theta_deg (float): zenith angle in degrees
+      X_surf (float): slant depth at the surface
+      spline (scipy.interpolate.PPoly): spline of :math:`\\rho(X)`
+    Raises:
+        IOError:
+    """
+    fname = _cache_fname(key, theta_deg)
+    if dbg > 0:
+        print "density_profiles::_dump_cache(): dumping", fname
+    _atomic_savez(fname, X_surf=X_surf, x=spline.x, c=spline.c)
+
 class CascadeAtmosphere():
     """Abstract class containing common methods on atmosphere.
     You have to inherit from this class and implement the virtual method 
@@ -107,11 +188,15 @@ class CascadeAtmosphere():
     def get_density(self, h_cm):
         """Abstract method which implementation  should return the density in g/cm**3.
 
+        Implementations have to accept arrays of heights, since the
+        density is evaluated for all integration nodes at once in
+        :func:`calculate_density_spline`.
+
         Args:
-           h_cm (float):  height in cm
+           h_cm (float or numpy.array):  height in cm
 
         Returns:
-           float: density in g/cm**3
+           float or numpy.array: density in g/cm**3
 
         Raises:
             NotImplementedError:
@@ -119,6 +204,76 @@ class CascadeAtmosphere():
         raise NotImplementedError("CascadeAtmosphere::get_density(): " + 
                                   "Base class called.")
 
+    def calculate_slant_depth(self, dl_vec, n_nodes=8):
+        """Calculates the slant depth :math:`X(\\Delta l)` at the points
+        ``dl_vec`` along the path for the current zenith angle.
+
+        The density is integrated in one cumulative pass along the path,
+        using a Gauss-Legendre rule with ``n_nodes`` nodes between each
+        pair of neighboring points. The density is evaluated for all
+        nodes in one call of :func:`get_density`. The error is estimated
+        by comparison with a rule with ``n_nodes / 2`` nodes.
+
+        Args:
+          dl_vec (numpy.array): increasing path lengths in cm, counted
+                                from the top of the atmosphere
+          n_nodes (int, optional): number of nodes per interval
+
+        Returns:
+          (tuple): (:math:`X` in g/cm**2 at ``dl_vec``, estimate of the
+          maximal absolute error in g/cm**2)
+        """
+        thrad = self.thrad
+        dl_lo, dl_up = dl_vec[:-1], dl_vec[1:]
+        half_width = 0.5 * (dl_up - dl_lo)
+        center = 0.5 * (dl_up + dl_lo)
+
+        def integrate(n):
+            xg, wg = np.polynomial.legendre.leggauss(n)
+            nodes = center[:, np.newaxis] + half_width[:, np.newaxis] * xg
+            rho = self.get_density(geom.h(nodes, thrad))
+            return np.concatenate(
+                ([0.], np.cumsum(half_width * np.dot(rho, wg))))
+
+        X_int = integrate(n_nodes)
+        X_err = np.max(np.abs(X_int - integrate(max(n_nodes / 2, 1))))
+
+        return X_int, X_err
+
+    def slant_depth_at_heights(self, h_cm, n_steps=1000):
+        """Returns the slant depth at which the current path crosses the
+        heights ``h_cm``.
+
+        The path is the one, which reaches the observation level
+        ``h_obs`` of :mod:`MCEq.geometry` at the zenith angle
+        :attr:`theta_deg`. The local zenith angles at the heights are
+        returned by :func:`MCEq.geometry.theta_at_h`.
+
+        Args:
+          h_cm (numpy.array): heights in cm between ``h_obs`` and ``h_atm``
+          n_steps (int, optional): number of integration intervals along
+                                   the path, see :func:`calculate_slant_depth`
+
+        Returns:
+          (numpy.array): slant depths in g/cm**2
+        """
+        if self.theta_deg == None:
+            raise Exception(('{0}::slant_depth_at_heights(): zenith ' +
+                             'angle not set').format(self.__class__.__name__))
+        h_cm = np.atleast_1d(np.asarray(h_cm, dtype=np.float64))
+        if np.any(h_cm < geom.h_obs) or np.any(h_cm > geom.h_atm):
+            raise Exception(('{0}::slant_depth_at_heights(): heights have ' +
+                             'to be between h_obs and h_atm.').format(
+                                 self.__class__.__name__))
+
+        path_length = geom.l(self.thrad)
+        dl_obs = np.clip(geom.delta_l(h_cm, self.thrad), 0., path_length)
+        dl_vec = np.union1d(np.linspace(0, path_length, n_steps), dl_obs)
+        X_obs = np.interp(dl_obs, dl_vec, self.calculate_slant_depth(dl_vec)[0])
+        # Consistency with the integration path at the observation level
+        X_obs[h_cm == geom.h_obs] = self.X_surf
+        return X_obs
+
     def calculate_density_spline(self, n_steps=1000):
         """Calculates and stores a spline of :math:`\\rho(X)`.
         
@@ -129,9 +284,8 @@ class CascadeAtmosphere():
         Raises:
             Exception: if :func:`set_theta` was not called before.
         """
-        from scipy.integrate import quad
         from time import time
-        from scipy.interpolate import UnivariateSpline
+        from scipy.interpolate import splrep, PPoly
         
         if self.theta_deg == None:
             raise Exception('{0}::calculate_density_spline(): ' + 
@@ -145,31 +299,32 @@ class CascadeAtmosphere():
 
         thrad = self.thrad
         path_length = geom.l(thrad)
-        vec_rho_l = np.vectorize(
-            lambda delta_l: self.get_density(geom.h(delta_l, thrad)))
         dl_vec = np.linspace(0, path_length, n_steps)
         
         now = time()
         
-        # Calculate integral for each depth point 
-        # functionality could be more efficient :)
-        X_int = np.zeros_like(dl_vec, dtype='float64')
-        for i, dl in enumerate(dl_vec):
-            X_int[i] = quad(vec_rho_l, 0, dl, epsrel=0.01)[0]
+        # Calculate integral for each depth point in one pass
+        X_int, X_err = self.calculate_slant_depth(dl_vec)
+        rho_l = self.get_density(geom.h(dl_vec, thrad))
 
         print '.. took {0:1.2f}s'.format(time() - now)
+        if dbg > 0:
+            print 'Integration error estimate of X: {0:1.2e} g/cm2'.format(
+                X_err)
 
         # Save depth value at h_obs
         self.X_surf = X_int[-1]
         
-        # Interpolate with bi-splines without smoothing
-        self.s_X2rho = UnivariateSpline(X_int, vec_rho_l(dl_vec),
-                                        k=2, s=0.0)
+        # Interpolate with bi-splines without smoothing and store
+        # the piecewise polynomial representation of the knots,
+        # coefficients and degree (t, c, k)
+        self._set_spline(PPoly.from_spline(splrep(X_int, rho_l, k=2,
+                                                  s=0.0)))
         
-        print 'Average spline error:', np.std(vec_rho_l(dl_vec) / 
+        print 'Average spline error:', np.std(rho_l / 
                                               self.s_X2rho(X_int))
 
-    def set_theta(self, theta_deg):
+    def set_theta(self, theta_deg, exact=False):
         """Configures geometry and initiates spline calculation for
         :math:`\\rho(X)`.
         
@@ -179,61 +334,81 @@ class CascadeAtmosphere():
         :func:`calculate_density_spline`,  make the function 
         :func:`r_X2rho` available to the core code and store the spline 
         in the cache.
+
+        A cached spline of the closest angle within 1 degree is used,
+        unless ``exact`` is set. The selected angle is stored in
+        :attr:`theta_deg`.
          
         Args:
           theta_deg (float): zenith angle :math:`\\theta` at detector
+          exact (bool, optional): do not use splines of other angles
         """
-        def calculate_and_store(key, cache):
-            self.thrad = geom._theta_rad(theta_deg)
-            self.theta_deg = theta_deg
-            self.calculate_density_spline()
-            cache[key][theta_deg] = (self.X_surf, self.s_X2rho)
-            _dump_cache(cache)
-
         if self.theta_deg == theta_deg:
             print self.__class__.__name__ + '::set_theta(): Using previous' + \
                 'density spline.'
             return
         elif config['use_atm_cache']:
-            from MCEq.misc import _get_closest
-            cache = _load_cache()
-            key = (self.__class__.__name__, self.location, self.season)
-            if cache and key in cache.keys():
-                try:
-                    closest = _get_closest(theta_deg, cache[key].keys())[1]
-                    if abs(closest - theta_deg) < 1.:
-                        self.thrad = geom._theta_rad(closest)
-                        self.theta_deg = closest
-                        self.X_surf, self.s_X2rho = cache[key][closest]
-                    else:
-                        calculate_and_store(key, cache)
-                except:
-                    cache[key] = {}
-                    calculate_and_store(key, cache)
-
+            key = self._cache_key()
+            cached = _load_cache(key, theta_deg, exact)
+            if cached is not None:
+                closest, self.X_surf, spline = cached
+                self._set_spline(spline)
+                self.thrad = geom._theta_rad(closest)
+                self.theta_deg = closest
             else:
-                cache[key] = {}
-                calculate_and_store(key, cache)
+                self.thrad = geom._theta_rad(theta_deg)
+                self.theta_deg = theta_deg
+                self.calculate_density_spline()
+                _dump_cache(key, theta_deg, self.X_surf, self.s_X2rho)
 
         else:
             self.thrad = geom._theta_rad(theta_deg)
             self.theta_deg = theta_deg
             self.calculate_density_spline()
 
+    def _cache_key(self):
+        """Returns the key which identifies this atmosphere in the cache.
+
+        Returns:
+          tuple: (class name, location, season)
+        """
+        return (self.__class__.__name__, self.location, self.season)
+
+    def _set_spline(self, spline):
+        """Stores the spline of :math:`\\rho(X)` and its flat breakpoint
+        and coefficient arrays for :func:`r_X2rho`.
+
+        Args:
+          spline (scipy.interpolate.PPoly): spline of :math:`\\rho(X)`
+        """
+        self.s_X2rho = spline
+        # Drop empty intervals at repeated knots
+        keep = np.diff(spline.x) > 0
+        self._spl_x = np.ascontiguousarray(
+            np.append(spline.x[:-1][keep], spline.x[-1]), dtype=np.float64)
+        self._spl_c = np.ascontiguousarray(spline.c[:, keep],
+                                           dtype=np.float64)
+
     def r_X2rho(self, X):
         """Returns the inverse density :math:`\\frac{1}{\\rho}(X)`. 
 
-        The spline `s_X2rho` is used, which was calculated or retrieved
-        from cache during the :func:`set_theta` call.
+        The spline `s_X2rho`, which was calculated or retrieved
+        from cache during the :func:`set_theta` call, is evaluated
+        by the compiled functions :func:`ppoly_rho_inv_jit` and
+        :func:`ppoly_rho_inv_arr_jit`.
 
         Args:
-           X (float):  slant depth in g/cm**2
+           X (float or numpy.array):  slant depth in g/cm**2
 
         Returns:
-           float: :math:`1/\\rho` in cm**3/g
+           float or numpy.array: :math:`1/\\rho` in cm**3/g
 
         """
-        return 1 / self.s_X2rho(X)
+        if np.isscalar(X):
+            return ppoly_rho_inv_jit(X, self._spl_x, self._spl_c)
+        X = np.asarray(X, dtype=np.float64)
+        return ppoly_rho_inv_arr_jit(X.ravel(), self._spl_x,
+                                     self._spl_c).reshape(X.shape)
     
     def X2rho(self, X):
         """Returns the density :math:`\\rho(X)`. 
@@ -413,78 +588,180 @@ class CorsikaAtmosphere(CascadeAtmosphere):
         """Converts column/vertical depth to height.
         
         Args:
-          x_v (float): column depth :math:`X_v` in g/cm**2
+          x_v (float or numpy.array): column depth :math:`X_v` in g/cm**2
           
         Returns:
-          float: height in cm
+          float or numpy.array: height in cm
         """
         _aatm, _batm, _catm, _thickl, _hlay = self._atm_param
 
-        if x_v >= _thickl[1]:
-            height = _catm[0] * np.log(_batm[0] / (x_v - _aatm[0]))
-        elif x_v >= _thickl[2]:
-            height = _catm[1] * np.log(_batm[1] / (x_v - _aatm[1]))
-        elif x_v >= _thickl[3]:
-            height = _catm[2] * np.log(_batm[2] / (x_v - _aatm[2]))
-        elif x_v >= _thickl[4]:
-            height = _catm[3] * np.log(_batm[3] / (x_v - _aatm[3]))
-        else:
-            height = (_aatm[4] - x_v) * _catm[4]
+        x_v = np.asarray(x_v, dtype=np.float64)
+        # Layer index from the number of boundaries below x_v
+        layer = np.sum(x_v[..., np.newaxis] < _thickl[1:], axis=-1)
+        # The logarithm is evaluated, but not used, in the top layer
+        with np.errstate(invalid='ignore', divide='ignore'):
+            height = np.where(layer == 4, (_aatm[4] - x_v) * _catm[4],
+                              _catm[layer] * np.log(_batm[layer] /
+                                                    (x_v - _aatm[layer])))
 
-        return height
+        return height if height.ndim else float(height)
 
     def height2depth(self, h_cm):
         """Converts height to column/vertical depth.
         
         Args:
-          h_cm (float): height in cm
+          h_cm (float or numpy.array): height in cm
           
         Returns:
-          float: column depth :math:`X_v` in g/cm**2
+          float or numpy.array: column depth :math:`X_v` in g/cm**2
         """
 
         _aatm, _batm, _catm, _thickl, _hlay = self._atm_param
 
-        height = h_cm
+        h_cm = np.asarray(h_cm, dtype=np.float64)
+        layer = np.searchsorted(_hlay[1:], h_cm, side='left')
+        x_v = np.where(layer == 4, _aatm[4] - h_cm / _catm[4],
+                       _aatm[layer] + _batm[layer] * 
+                       np.exp(-h_cm / _catm[layer]))
 
-        if height <= _hlay[1]:
-            x_v = _aatm[0] + _batm[0] * np.exp(-height / _catm[0])
-        elif height <= _hlay[2]:
-            x_v = _aatm[1] + _batm[1] * np.exp(-height / _catm[1])
-        elif height <= _hlay[3]:
-            x_v = _aatm[2] + _batm[2] * np.exp(-height / _catm[2])
-        elif height <= _hlay[4]:
-            x_v = _aatm[3] + _batm[3] * np.exp(-height / _catm[3])
-        else:
-            x_v = _aatm[4] - height / _catm[4]
-
-        return x_v
+        return x_v if x_v.ndim else float(x_v)
 
     def get_density(self, h_cm):
         """ Returns the density of air in g/cm**3.
         
-        Uses the optimized module function :func:`corsika_get_density_jit`.
+        Uses the optimized module functions :func:`corsika_get_density_jit`
+        and :func:`corsika_get_density_arr_jit`.
         
         Args:
-          h_cm (float): height in cm
+          h_cm (float or numpy.array): height in cm
         
         Returns:
-          float: column depth :math:`\\rho(h_{cm})` in g/cm**3
+          float or numpy.array: density :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        if np.isscalar(h_cm):
+            return corsika_get_density_jit(h_cm, self._atm_param)
+        h_cm = np.asarray(h_cm, dtype=np.float64)
+        return corsika_get_density_arr_jit(
+            h_cm.ravel(), self._atm_param).reshape(h_cm.shape)
+
+    def _layer_density(self, h_cm, layer):
+        """Returns the density in g/cm**3 using the parameters of a
+        fixed layer, i.e. also at or slightly beyond its boundaries.
+
+        Args:
+          h_cm (numpy.array): height in cm
+          layer (int): index of the layer (0-4)
+
+        Returns:
+          numpy.array: :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        _aatm, _batm, _catm, _thickl, _hlay = self._atm_param
+        if layer == 4:
+            return np.ones_like(h_cm) * _batm[4] / _catm[4]
+        return _batm[layer] / _catm[layer] * np.exp(-h_cm / _catm[layer])
+
+    def calculate_density_spline(self, n_steps=1000):
+        """Calculates and stores a piecewise cubic interpolant of
+        :math:`\\rho(X)`.
+
+        Overrides :func:`CascadeAtmosphere.calculate_density_spline`.
+        The density of the parameterization is a smooth function within
+        each layer, but has kinks (and a step at the top layer) at the
+        layer boundaries. The path is therefore split at the boundaries,
+        such that the Gauss-Legendre integration of
+        :func:`calculate_slant_depth` is exact to machine precision and
+        each layer is interpolated separately, using the density of
+        that layer at both ends of its segment.
+
+        Args:
+          n_steps (int, optional): number of :math:`X` values
+                                   to use for interpolation
+
+        Raises:
+            Exception: if :func:`set_theta` was not called before.
         """
-        return corsika_get_density_jit(h_cm, self._atm_param)
+        from time import time
+        from scipy.interpolate import CubicSpline, PPoly
+
+        if self.theta_deg == None:
+            raise Exception(('{0}::calculate_density_spline(): ' +
+                             'zenith angle not set').format(
+                             self.__class__.__name__))
+        else:
+            print ('{0}::calculate_density_spline(): ' +
+                   'Calculating spline of rho(X) for zenith ' +
+                   '{1} degrees.').format(self.__class__.__name__,
+                                         self.theta_deg)
+
+        _hlay = self._atm_param[4]
+        thrad = self.thrad
+        path_length = geom.l(thrad)
+
+        # Path lengths of the layer boundaries crossed by the trajectory
+        h_bounds = _hlay[(_hlay > geom.h_obs) & (_hlay < geom.h_atm)]
+        dl_bounds = np.sort(np.concatenate(
+            ([0., path_length], geom.delta_l(h_bounds, thrad))))
+        dl_vec = np.unique(np.concatenate(
+            (np.linspace(0, path_length, n_steps), dl_bounds)))
+
+        now = time()
+
+        # Interval midpoints are integrated as well to validate the
+        # interpolation
+        dl_all = np.empty(2 * dl_vec.size - 1)
+        dl_all[::2] = dl_vec
+        dl_all[1::2] = 0.5 * (dl_vec[1:] + dl_vec[:-1])
+        X_all, X_err = self.calculate_slant_depth(dl_all, n_nodes=16)
+        h_all = geom.h(dl_all, thrad)
+
+        coeffs, breaks = [], [X_all[:1]]
+        rho_err = 0.
+        for dl_lo, dl_up in zip(dl_bounds[:-1], dl_bounds[1:]):
+            sl = slice(np.searchsorted(dl_all, dl_lo),
+                       np.searchsorted(dl_all, dl_up) + 1)
+            X_seg, h_seg = X_all[sl], h_all[sl]
+            layer = min(max(np.searchsorted(
+                _hlay, 0.5 * (h_seg[0] + h_seg[-1])) - 1, 0), 4)
+            rho_seg = self._layer_density(h_seg, layer)
+
+            spl = CubicSpline(X_seg[::2], rho_seg[::2])
+            coeffs.append(spl.c)
+            breaks.append(spl.x[1:])
+            rho_err = max(rho_err, np.max(np.abs(
+                spl(X_seg[1::2]) / rho_seg[1::2] - 1.)))
+
+        print '.. took {0:1.2f}s'.format(time() - now)
+        if dbg > 0:
+            print 'Integration error estimate of X: {0:1.2e} g/cm2'.format(
+                X_err)
+
+        # Save depth value at h_obs
+        self.X_surf = X_all[-1]
+
+        self._set_spline(PPoly(np.hstack(coeffs), np.concatenate(breaks)))
+
+        print 'Maximal relative interpolation error: {0:1.2e}'.format(
+            rho_err)
 
     def rho_inv(self, X, cos_theta):
         """Returns reciprocal density in cm**3/g using planar approximation.
         
-        This function uses the optimized function :func:`planar_rho_inv_jit`
+        This function uses the optimized functions :func:`planar_rho_inv_jit`
+        and :func:`planar_rho_inv_arr_jit`.
          
         Args:
-          h_cm (float): height in cm
+          X (float or numpy.array): slant depth in g/cm**2
+          cos_theta (float): :math:`\\cos(\\theta)`
         
         Returns:
-          float: :math:`\\frac{1}{\\rho}(X,\\cos{\\theta})` cm**3/g
+          float or numpy.array: :math:`\\frac{1}{\\rho}(X,\\cos{\\theta})`
+          cm**3/g
         """
-        return planar_rho_inv_jit(X, cos_theta, self._atm_param)
+        if np.isscalar(X):
+            return planar_rho_inv_jit(X, cos_theta, self._atm_param)
+        X = np.asarray(X, dtype=np.float64)
+        return planar_rho_inv_arr_jit(
+            X.ravel(), cos_theta, self._atm_param).reshape(X.shape)
 
     def calc_thickl(self):
         """Calculates thickness layers for :func:`depth2height` 
@@ -511,6 +788,75 @@ class CorsikaAtmosphere(CascadeAtmosphere):
         print '_thickl = np.array([' + ', '.join(thickl) + '])'
 
 
+@jit(double(double, double[:], double[:, :]), target='cpu')
+def ppoly_rho_inv_jit(X, x, c):
+    """Evaluates the reciprocal of a piecewise polynomial, such as the
+    spline of :math:`\\rho(X)`, see :func:`CascadeAtmosphere.r_X2rho`.
+
+    Outside of the breakpoints, the first or last polynomial is
+    extrapolated.
+
+    Args:
+      X (float): slant depth in g/cm**2
+      x (numpy.array): increasing breakpoints
+      c (numpy.array): polynomial coefficients in the local variable
+                       ``X - x[i]``, highest power first
+
+    Returns:
+      float: :math:`1/\\rho(X)` in cm**3/g
+    """
+    # Bisection for the interval x[lo] <= X < x[lo + 1]
+    lo = 0
+    up = x.size - 2
+    while lo < up:
+        mid = (lo + up + 1) // 2
+        if X < x[mid]:
+            up = mid - 1
+        else:
+            lo = mid
+    dx = X - x[lo]
+    res = c[0, lo]
+    for m in xrange(1, c.shape[0]):
+        res = res * dx + c[m, lo]
+    return 1. / res
+
+
+@jit(double[:](double[:], double[:], double[:, :]), target='cpu')
+def ppoly_rho_inv_arr_jit(X, x, c):
+    """Array version of :func:`ppoly_rho_inv_jit`.
+
+    Args:
+      X (numpy.array): slant depths in g/cm**2
+      x (numpy.array): increasing breakpoints
+      c (numpy.array): polynomial coefficients
+
+    Returns:
+      numpy.array: :math:`1/\\rho(X)` in cm**3/g
+    """
+    res = np.empty(X.size)
+    n_int = x.size - 1
+    lo = 0
+    for i in xrange(X.size):
+        Xi = X[i]
+        # Reuse the previous interval for sorted input
+        if not ((lo == 0 or Xi >= x[lo]) and
+                (lo == n_int - 1 or Xi < x[lo + 1])):
+            lo = 0
+            up = n_int - 1
+            while lo < up:
+                mid = (lo + up + 1) // 2
+                if Xi < x[mid]:
+                    up = mid - 1
+                else:
+                    lo = mid
+        dx = Xi - x[lo]
+        r = c[0, lo]
+        for m in xrange(1, c.shape[0]):
+            r = r * dx + c[m, lo]
+        res[i] = 1. / r
+    return res
+
+
 @jit(double(double, double, double[:, :]), target='cpu')
 def planar_rho_inv_jit(X, cos_theta, param):
     """Optimized calculation of :math:`1/\\rho(X,\\theta)` in
@@ -573,6 +919,43 @@ def corsika_get_density_jit(h_cm, param):
 
     return res
 
+
+@jit(double[:](double[:], double, double[:, :]), target='cpu')
+def planar_rho_inv_arr_jit(X, cos_theta, param):
+    """Array version of :func:`planar_rho_inv_jit`.
+    
+    Args:
+      X (numpy.array): slant depths in g/cm**2
+      cos_theta (float): :math:`\\cos(\\theta)`
+      param (numpy.array): 5x5 parameter array from 
+                        :class:`CorsikaAtmosphere`
+    
+    Returns:
+      numpy.array: :math:`1/\\rho(X,\\theta)` in cm**3/g
+    """
+    res = np.empty(X.size)
+    for i in xrange(X.size):
+        res[i] = planar_rho_inv_jit(X[i], cos_theta, param)
+    return res
+
+
+@jit(double[:](double[:], double[:, :]), target='cpu')
+def corsika_get_density_arr_jit(h_cm, param):
+    """Array version of :func:`corsika_get_density_jit`.
+    
+    Args:
+      h_cm (numpy.array): heights above surface in cm
+      param (numpy.array): 5x5 parameter array from 
+                        :class:`CorsikaAtmosphere`
+    
+    Returns:
+      numpy.array: :math:`\\rho(h)` in g/cm**3
+    """
+    res = np.empty(h_cm.size)
+    for i in xrange(h_cm.size):
+        res[i] = corsika_get_density_jit(h_cm[i], param)
+    return res
+
 class MSIS00Atmosphere(CascadeAtmosphere):
     """Wrapper class for a python interface to the NRLMSISE-00 model.
     
@@ -591,6 +974,9 @@ class MSIS00Atmosphere(CascadeAtmosphere):
     """
     
     _msis = None
+
+    #: step size in cm of the tabulated density profile
+    table_step = 5e3
     
     def __init__(self, location, season):
         from msis_wrapper import cNRLMSISE00, pyNRLMSISE00
@@ -618,19 +1004,422 @@ class MSIS00Atmosphere(CascadeAtmosphere):
         self.location, self.season = location, season
         # Clear cached value to force spline recalculation
         self.theta_deg = None
+        self._h_table, self._log_rho_table = None, None
+
+    def _table_range(self):
+        """Returns the lowest and highest height in cm of the density
+        table."""
+        return min(0., geom.h_obs), geom.h_atm
+
+    def _table_fname(self):
+        """Returns the cache file name of the density table, which
+        is unique for location, day of year, time of day and the
+        tabulated heights."""
+        inp = self.msis.input
+        doy, sec = [getattr(v, 'value', v) for v in (inp.doy, inp.sec)]
+        h_min, h_max = self._table_range()
+        return join(config['data_dir'], config['atm_cache_dir'],
+                    ('MSIS00_table_{0}_{1:d}_{2:.0f}_{3:.0f}_{4:.0f}_' +
+                     '{5:.0f}.npz').format(self.location, doy, sec,
+                                          h_min, h_max, self.table_step))
+
+    def _tabulate(self):
+        """Tabulates :math:`\\log\\rho(h)` in steps of :attr:`table_step`
+        between the observation level and the top of the atmosphere.
+
+        The table is read from or stored in the atmosphere cache,
+        if 'use_atm_cache' is enabled in the config.
+        """
+        fname = self._table_fname()
+        if config['use_atm_cache'] and os.path.isfile(fname):
+            try:
+                table = np.load(fname)
+                self._h_table = table['h']
+                self._log_rho_table = table['log_rho']
+                return
+            except (IOError, KeyError, ValueError):
+                print (self.__class__.__name__ + '::_tabulate(): ' +
+                       'skipping unreadable ' + fname)
+
+        h_min, h_max = self._table_range()
+        n_steps = int(np.ceil((h_max - h_min) / self.table_step)) + 1
+        self._h_table = h_min + self.table_step * np.arange(n_steps)
+        self._log_rho_table = np.log(
+            self.msis.get_density_profile(self._h_table))
+
+        if config['use_atm_cache']:
+            _atomic_savez(fname, h=self._h_table,
+                          log_rho=self._log_rho_table)
+
+    def get_density(self, h_cm):
+        """ Returns the density of air in g/cm**3.
+        
+        The density is interpolated linearly in :math:`\\log\\rho`
+        from a table, which is calculated by :func:`_tabulate` with
+        one batch of calls to the NRLMSISE-00 library per location
+        and season.
+        
+        Args:
+          h_cm (float or numpy.array): height in cm
+        
+        Returns:
+          float or numpy.array: density :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        if self._h_table is None:
+            self._tabulate()
+        return np.exp(np.interp(h_cm, self._h_table, self._log_rho_table))
+
+
+def _vertical_depth(h_cm, log_rho):
+    """Integrates tabulated density profiles from the top of the table
+    down to each height.
+
+    The density is assumed to be exponential between neighboring
+    heights (linear in :math:`\\log\\rho`), for which the integral is
+    exact. All profiles are integrated at once along the last axis.
+
+    Args:
+      h_cm (numpy.array): increasing heights in cm, shape (n_h,)
+      log_rho (numpy.array): :math:`\\log\\rho` in g/cm**3,
+                             shape (n_h,) or (n_profiles, n_h)
+
+    Returns:
+      numpy.array: vertical depth :math:`X_v` in g/cm**2, same shape as
+      ``log_rho``
+    """
+    dh = np.diff(h_cm)
+    rho = np.exp(log_rho)
+    dlog = log_rho[..., 1:] - log_rho[..., :-1]
+    drho = rho[..., 1:] - rho[..., :-1]
+    # Exact integral of the exponential in each interval, with
+    # the limit rho * dh for constant density
+    flat = np.abs(dlog) < 1e-10
+    with np.errstate(invalid='ignore', divide='ignore'):
+        seg = np.where(flat, rho[..., :-1] * dh, drho * dh / dlog)
+
+    X_v = np.zeros_like(rho)
+    X_v[..., :-1] = np.cumsum(seg[..., ::-1], axis=-1)[..., ::-1]
+    return X_v
+
+
+#: tables of the files read by :func:`_read_tabulated`, by file name
+_tabulated_tables = {}
+
+
+def _read_tabulated(fname):
+    """Reads the profiles of :func:`load_tabulated_atmospheres` and
+    calculates their depth tables.
+
+    The tables are kept in memory for each file, until its modification
+    time changes, such that the profiles can be looked up one by one in
+    :func:`get_atmosphere` without reading the file again.
+
+    Args:
+      fname (str): file name
+
+    Returns:
+      (tuple): (heights, :math:`\log\rho` and :math:`X_v` of shape
+      (n_profiles, n_h), list of labels)
+    """
+    key = os.path.abspath(fname)
+    mtime = os.path.getmtime(key)
+    if key in _tabulated_tables and _tabulated_tables[key][0] == mtime:
+        return _tabulated_tables[key][1]
+
+    table = np.load(fname)
+    h_cm = np.asarray(table['h'], dtype=np.float64)
+    log_rho = np.log(np.atleast_2d(table['rho']).astype(np.float64))
+    if 'labels' in table.files:
+        labels = [str(l) for l in table['labels']]
+    else:
+        labels = [str(i) for i in range(log_rho.shape[0])]
+
+    order = np.argsort(h_cm)
+    h_cm, log_rho = h_cm[order], log_rho[:, order]
+    X_v = _vertical_depth(h_cm, log_rho)
+
+    _tabulated_tables[key] = (mtime, (h_cm, log_rho, X_v, labels))
+    return h_cm, log_rho, X_v, labels
+
+
+def load_tabulated_atmospheres(fname):
+    """Reads many tabulated density profiles from a single file.
+
+    The file is a numpy .npz archive containing the arrays ``h``
+    (heights in cm, shape (n_h,)), ``rho`` (densities in g/cm**3, shape
+    (n_profiles, n_h)) and optionally ``labels`` (shape (n_profiles,),
+    e.g. dates). The vertical depth tables of all profiles are
+    calculated in one vectorized pass.
+
+    Args:
+      fname (str): file name
+
+    Returns:
+      list: :class:`TabulatedAtmosphere` objects, one per profile
+    """
+    from os.path import basename
+
+    h_cm, log_rho, X_v, labels = _read_tabulated(fname)
+    return [TabulatedAtmosphere(h_cm, None, basename(fname), label,
+                                _tables=(log_rho[i], X_v[i]))
+            for i, label in enumerate(labels)]
+
+
+class TabulatedAtmosphere(CascadeAtmosphere):
+    """Atmosphere defined by a tabulated density profile
+    :math:`\\rho(h)`, e.g. from measured temperature and pressure.
+
+    The density is interpolated linearly in :math:`\\log\\rho`, i.e.
+    exponentially between the tabulated heights. The vertical depth
+    :math:`X_v(h)` is precomputed for all heights by an exact cumulative
+    integration, see :func:`_vertical_depth`. Many profiles can be read
+    at once with :func:`load_tabulated_atmospheres`.
+
+    Args:
+      h_cm (numpy.array): heights in cm
+      rho (numpy.array): densities in g/cm**3 at ``h_cm``
+      location (str,optional): label of the location or data source
+      season (str,optional): label of the profile, e.g. the date
+    """
+
+    def __init__(self, h_cm, rho, location='Tabulated', season=None,
+                 _tables=None):
+        if _tables is None:
+            h_cm = np.asarray(h_cm, dtype=np.float64)
+            order = np.argsort(h_cm)
+            h_cm = h_cm[order]
+            log_rho = np.log(np.asarray(rho, dtype=np.float64)[order])
+            X_v = _vertical_depth(h_cm, log_rho)
+        else:
+            log_rho, X_v = _tables
+
+        if h_cm[0] > geom.h_obs or h_cm[-1] < geom.h_atm:
+            raise Exception(('TabulatedAtmosphere::__init__(): The ' +
+                             'profile {0}/{1} does not cover the range ' +
+                             'between h_obs and h_atm.').format(location,
+                                                                season))
+
+        self._h_table, self._log_rho_table, self._X_v_table = \
+            h_cm, log_rho, X_v
+        self.location, self.season = location, season
+        self.theta_deg = None
+        CascadeAtmosphere.__init__(self)
+
+    def _cache_key(self):
+        """Returns the key which identifies this atmosphere in the cache.
+
+        The digest of the profile is part of the key, since different
+        profiles may carry the same labels.
+
+        Returns:
+          tuple: (class name, location, season, digest of the profile)
+        """
+        import hashlib
+        digest = hashlib.md5(np.ascontiguousarray(
+            self._log_rho_table).tostring())
+        digest.update(np.ascontiguousarray(self._h_table).tostring())
+        return (self.__class__.__name__, self.location, self.season,
+                digest.hexdigest()[:12])
+
+    def _interval(self, h_cm):
+        """Returns the index of the table interval containing
+        ``h_cm`` and the scale height of the density there."""
+        h_tab, log_rho = self._h_table, self._log_rho_table
+        idx = np.clip(np.searchsorted(h_tab, h_cm) - 1, 0, h_tab.size - 2)
+        with np.errstate(divide='ignore'):
+            scale = (h_tab[idx + 1] - h_tab[idx]) / \
+                (log_rho[idx] - log_rho[idx + 1])
+        return idx, scale
 
     def get_density(self, h_cm):
         """ Returns the density of air in g/cm**3.
         
-        Wraps around ctypes calls to the NRLMSISE-00 C library.
+        Args:
+          h_cm (float or numpy.array): height in cm
+        
+        Returns:
+          float or numpy.array: density :math:`\\rho(h_{cm})` in g/cm**3
+        """
+        return np.exp(np.interp(h_cm, self._h_table, self._log_rho_table))
+
+    def height2depth(self, h_cm):
+        """Converts height to column/vertical depth.
         
         Args:
-          h_cm (float): height in cm
+          h_cm (float or numpy.array): height in cm
+          
+        Returns:
+          float or numpy.array: column depth :math:`X_v` in g/cm**2
+        """
+        idx, scale = self._interval(h_cm)
+        rho, rho_up = self.get_density(h_cm), \
+            np.exp(self._log_rho_table[idx + 1])
+        dh = self._h_table[idx + 1] - h_cm
+        with np.errstate(invalid='ignore'):
+            x_v = self._X_v_table[idx + 1] + np.where(
+                np.isfinite(scale), scale * (rho - rho_up), rho * dh)
+
+        return x_v if np.ndim(x_v) else float(x_v)
+
+    def depth2height(self, x_v):
+        """Converts column/vertical depth to height.
         
+        Args:
+          x_v (float or numpy.array): column depth :math:`X_v` in g/cm**2
+          
         Returns:
-          float: column depth :math:`\\rho(h_{cm})` in g/cm**3
+          float or numpy.array: height in cm
         """
-        return self.msis.get_density(h_cm)
+        X_tab, h_tab, log_rho = self._X_v_table, self._h_table, \
+            self._log_rho_table
+        # X_v decreases with height
+        idx = np.clip(X_tab.size - 1 - 
+                      np.searchsorted(X_tab[::-1], x_v, side='right'),
+                      0, X_tab.size - 2)
+        idx, scale = idx, self._interval(h_tab[idx + 1])[1]
+        rho_up = np.exp(log_rho[idx + 1])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            height = np.where(
+                np.isfinite(scale),
+                h_tab[idx + 1] - scale * np.log(
+                    1 + (x_v - X_tab[idx + 1]) / (scale * rho_up)),
+                h_tab[idx + 1] - (x_v - X_tab[idx + 1]) / rho_up)
+
+        return height if np.ndim(height) else float(height)
+
+def get_atmosphere(atm_config):
+    """Creates an atmosphere object from a configuration tuple.
+
+    Args:
+      atm_config (tuple of strings): (parametrization type, location string,
+                                      season string), for example
+                                      ('CORSIKA', 'PL_SouthPole', 'January').
+                                      For 'TABULATED', location is the
+                                      file name and season the label of
+                                      the profile, see
+                                      :func:`load_tabulated_atmospheres`.
+
+    Returns:
+      CascadeAtmosphere: atmosphere object
+
+    Raises:
+        Exception: if the parametrization type is unknown.
+    """
+    base_model, location, season = atm_config
+
+    if base_model == 'MSIS00':
+        return MSIS00Atmosphere(location, season)
+    elif base_model == 'CORSIKA':
+        return CorsikaAtmosphere(location, season)
+    elif base_model == 'TABULATED':
+        from os.path import basename
+        h_cm, log_rho, X_v, labels = _read_tabulated(location)
+        if str(season) in labels:
+            i = labels.index(str(season))
+            return TabulatedAtmosphere(h_cm, None, basename(location),
+                                       labels[i],
+                                       _tables=(log_rho[i], X_v[i]))
+        raise Exception(
+            'density_profiles::get_atmosphere(): Profile ' + str(season) +
+            ' not found in ' + str(location) + '.')
+    else:
+        raise Exception(
+            'density_profiles::get_atmosphere(): Unknown atmospheric ' +
+            'base model ' + str(base_model) + '.')
+
+
+def _precompute_entry(args):
+    """Calculates and stores the spline of :math:`\\rho(X)` for one
+    atmosphere and zenith angle. Used by :func:`precompute_atmospheres`.
+
+    Args:
+      args (tuple): (atm_config, theta_deg)
+
+    Returns:
+      (tuple): (atm_config, theta_deg, time in s)
+    """
+    from time import time
+
+    atm_config, theta_deg = args
+    now = time()
+    atm_obj = get_atmosphere(atm_config)
+    # The angle is set directly to bypass the closest-angle
+    # lookup of set_theta
+    atm_obj.thrad = geom._theta_rad(theta_deg)
+    atm_obj.theta_deg = theta_deg
+    atm_obj.calculate_density_spline()
+    _dump_cache(atm_obj._cache_key(), theta_deg,
+                atm_obj.X_surf, atm_obj.s_X2rho)
+
+    return atm_config, theta_deg, time() - now
+
+
+def precompute_atmospheres(atm_configs, thetas, n_workers=None):
+    """Fills the atmosphere cache for all combinations of atmospheres
+    and zenith angles using a pool of processes.
+
+    Entries which already exist in the cache are skipped. Subsequent
+    calls of :func:`CascadeAtmosphere.set_theta` with the same angles
+    only read the cache. Example::
+
+        months = ['January', 'April', 'July', 'October']
+        precompute_atmospheres([('MSIS00', 'SouthPole', m)
+                                for m in months],
+                               np.linspace(0., 90., 19))
+
+    Args:
+      atm_configs (list): atmosphere configuration tuples, see
+                          :func:`get_atmosphere`
+      thetas (list): zenith angles in degrees
+      n_workers (int, optional): number of processes. Defaults to the
+                                 number of CPUs. 1 runs in this process.
+
+    Returns:
+      dict: time in s per calculated (atm_config, theta_deg) entry,
+      None for skipped entries
+    """
+    from time import time
+    from multiprocessing import Pool
+
+    timing, tasks = {}, []
+    for atm_config in atm_configs:
+        key = get_atmosphere(atm_config)._cache_key()
+        for theta_deg in thetas:
+            theta_deg = float(theta_deg)
+            if os.path.isfile(_cache_fname(key, theta_deg)):
+                timing[(tuple(atm_config), theta_deg)] = None
+            else:
+                tasks.append((tuple(atm_config), theta_deg))
+
+    print ('density_profiles::precompute_atmospheres(): {0} entries to ' +
+           'calculate, {1} found in cache.').format(len(tasks), len(timing))
+
+    now = time()
+    pool = None
+    if n_workers == 1:
+        results = (_precompute_entry(task) for task in tasks)
+    else:
+        pool = Pool(n_workers)
+        results = pool.imap_unordered(_precompute_entry, tasks)
+
+    try:
+        for atm_config, theta_deg, elapsed in results:
+            timing[(atm_config, theta_deg)] = elapsed
+            print ('density_profiles::precompute_atmospheres(): {0} at ' +
+                   '{1:5.2f} degrees took {2:1.2f}s').format(
+                   atm_config, theta_deg, elapsed)
+    finally:
+        if pool is not None:
+            # All results have been received unless an exception
+            # occurred, in which case the remaining tasks are dropped
+            pool.terminate()
+            pool.join()
+
+    print ('density_profiles::precompute_atmospheres(): ' +
+           'finished after {0:1.2f}s').format(time() - now)
+
+    return timing
+
 
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
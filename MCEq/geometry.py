@@ -154,6 +154,13 @@ def delta_l(h, theta):
     """
     return _A_1(theta) + l(theta) - np.sqrt((h + r_E) ** 2 - _A_2(theta) ** 2)
 
+def theta_at_h(h, theta):
+    """Returns the local zenith angle in [rad] at height :math:`h` in cm
+    on the path, which reaches the observation level at zenith
+    :math:`\\theta` [rad]. At ``h_obs`` it is equal to :math:`\\theta`.
+    """
+    return np.arcsin(_A_2(theta) / (r_E + h))
+
 def chirkin_cos_theta_star(costheta):
     """:math:`\\cos(\\theta^*)` parameterization.
     
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.interpolation` - interpolation of solutions in zenith angle
+======================================================================
+
+This module contains classes, which solve an instance of
+:class:`MCEq.core.MCEqRun` on a set of zenith angles and interpolate
+the solutions for arbitrary angles and energies.
+
+Typical interaction::
+
+      $ zen_int = ZenithInterpolator(mceq_run, ['total_mu+', 'total_numu'])
+      $ zen_int.build()
+      $ flux = zen_int(0.35, 'total_numu')
+      $ table = zen_int.to_flux_table([-13, 14])
+      $ table.save('numu_flux')
+      $ weights = load_flux_table('numu_flux').weights(pdg, energy, cos_zen)
+"""
+
+import numpy as np
+from numba import jit, double, float32, int64  # @UnresolvedImport
+from mceq_config import dbg
+
+
+class ZenithInterpolator():
+    """Interpolates solutions of :class:`MCEq.core.MCEqRun` in
+    :math:`\\cos\\theta`.
+
+    The solutions are calculated on an adaptively refined grid of
+    :math:`\\cos\\theta` nodes. An interval is split as long as the
+    solution at its midpoint deviates from the interpolation of the
+    other nodes by more than ``rtol``. This concentrates the nodes
+    close to the horizon, where the fluxes change fastest. The
+    logarithm of the fluxes is interpolated with monotonic cubic
+    (PCHIP) polynomials.
+
+    Args:
+      mceq_run (MCEqRun): initialized instance, which is solved for
+                          each node
+      particle_names (list): names of the spectra, as accepted by
+                             :func:`MCEq.core.MCEqRun.get_solution`
+      cos_theta_range (tuple, optional): interval of :math:`\\cos\\theta`
+      n_initial (int, optional): number of initial, equidistant nodes
+      rtol (float, optional): tolerated relative deviation of the
+                              interpolated fluxes
+      max_nodes (int, optional): maximal number of nodes
+      solve_kwargs (dict, optional): arguments for
+                                     :func:`MCEq.core.MCEqRun.solve`
+    """
+
+    def __init__(self, mceq_run, particle_names, cos_theta_range=(0., 1.),
+                 n_initial=5, rtol=1e-2, max_nodes=40, solve_kwargs=None):
+        self.mceq_run = mceq_run
+        self.particle_names = list(particle_names)
+        self.cos_theta_range = cos_theta_range
+        self.n_initial = n_initial
+        self.rtol = rtol
+        self.max_nodes = max_nodes
+        self.solve_kwargs = solve_kwargs or {}
+
+        #: (numpy.array) energy grid of the solutions
+        self.e_grid = mceq_run.e_grid
+        #: (dict) :math:`\\log\\Phi` of shape (n_names, d) per node
+        self.log_flux = {}
+        #: (float) largest deviation at the last refined midpoints
+        self.max_error = None
+        self._interpolator = None
+
+    def _solve(self, cos_theta):
+        """Solves the cascade equation for one node and stores
+        :math:`\\log\\Phi` of the selected spectra."""
+        run = self.mceq_run
+        # Cached splines of neighboring angles would shift the node
+        run.set_theta_deg(np.degrees(np.arccos(cos_theta)), exact=True)
+        run.solve(**self.solve_kwargs)
+        flux = run.get_solutions(self.particle_names)[:, 0]
+        with np.errstate(divide='ignore'):
+            self.log_flux[cos_theta] = np.log(flux)
+        return self.log_flux[cos_theta]
+
+    def _update_interpolator(self):
+        """Creates the interpolator from the current nodes."""
+        from scipy.interpolate import PchipInterpolator
+
+        self.cos_theta_nodes = np.array(sorted(self.log_flux.keys()))
+        log_flux = np.array([self.log_flux[c]
+                             for c in self.cos_theta_nodes])
+        # Zero fluxes are interpolated as very small numbers
+        log_flux[~np.isfinite(log_flux)] = -700.
+        self._interpolator = PchipInterpolator(self.cos_theta_nodes,
+                                               log_flux, axis=0)
+
+    def _deviation(self, log_pred, log_flux):
+        """Returns the largest relative deviation for non-zero fluxes."""
+        valid = np.isfinite(log_flux)
+        if not np.any(valid):
+            return 0.
+        return np.max(np.abs(np.expm1(log_pred[valid] - log_flux[valid])))
+
+    def build(self):
+        """Solves the nodes and refines the grid until the interpolation
+        error is below ``rtol`` or ``max_nodes`` is reached.
+
+        Returns:
+          (float): largest deviation found at the last midpoints
+        """
+        from time import time
+
+        now = time()
+        cmin, cmax = self.cos_theta_range
+        for cos_theta in np.linspace(cmin, cmax, self.n_initial):
+            self._solve(cos_theta)
+        self._update_interpolator()
+
+        intervals = zip(self.cos_theta_nodes[:-1], self.cos_theta_nodes[1:])
+        self.max_error = 0.
+        while intervals and len(self.log_flux) < self.max_nodes:
+            next_intervals, errors = [], []
+            for lo, up in intervals:
+                if len(self.log_flux) >= self.max_nodes:
+                    break
+                mid = 0.5 * (lo + up)
+                log_pred = self._interpolator(mid)
+                err = self._deviation(log_pred, self._solve(mid))
+                errors.append(err)
+                if dbg > 0:
+                    print ('ZenithInterpolator::build(): cos(theta) = ' +
+                           '{0:5.4f}, deviation {1:1.2e}').format(mid, err)
+                if err > self.rtol:
+                    next_intervals += [(lo, mid), (mid, up)]
+            self._update_interpolator()
+            self.max_error = max(errors) if errors else 0.
+            intervals = next_intervals
+
+        if self.max_error > self.rtol:
+            print ('ZenithInterpolator::build(): Warning, max_nodes ' +
+                   'reached with deviation {0:1.2e}.').format(self.max_error)
+        print ('ZenithInterpolator::build(): {0} nodes solved in ' +
+               '{1:1.1f}s.').format(len(self.log_flux), time() - now)
+
+        return self.max_error
+
+    def __call__(self, cos_theta, particle_name=None):
+        """Returns interpolated spectra on the energy grid.
+
+        Args:
+          cos_theta (float or numpy.array): :math:`\\cos\\theta`
+          particle_name (str, optional): one of the ``particle_names``.
+                                         If None, all spectra are returned.
+
+        Returns:
+          (numpy.array): spectra of shape (d,) or (n_names, d) for a
+          scalar ``cos_theta``, with an additional leading axis for
+          arrays
+        """
+        if self._interpolator is None:
+            raise Exception('ZenithInterpolator::__call__(): ' +
+                            'build() has to be called first.')
+        cmin, cmax = self.cos_theta_nodes[0], self.cos_theta_nodes[-1]
+        if np.any((cos_theta < cmin) | (cos_theta > cmax)):
+            raise Exception(('ZenithInterpolator::__call__(): cos(theta) ' +
+                             'outside of the range {0}-{1}.').format(cmin,
+                                                                    cmax))
+        log_flux = self._interpolator(cos_theta)
+        flux = np.where(log_flux > -650., np.exp(log_flux), 0.)
+        if particle_name is None:
+            return flux
+        return flux[..., self.particle_names.index(particle_name), :]
+
+    def to_flux_table(self, pdg_ids, n_cos_theta=201):
+        """Tabulates the interpolated spectra for fast event weighting.
+
+        Args:
+          pdg_ids (list): PDG IDs assigned to the ``particle_names``
+          n_cos_theta (int, optional): number of equidistant
+                                       :math:`\\cos\\theta` values
+
+        Returns:
+          (FluxTable): table of all spectra
+        """
+        cos_theta = np.linspace(self.cos_theta_nodes[0],
+                                self.cos_theta_nodes[-1], n_cos_theta)
+        # (n_cos, n_names, d) -> (n_names, n_cos, d)
+        log_flux = np.swapaxes(self._interpolator(cos_theta), 0, 1)
+        return FluxTable(pdg_ids, cos_theta, self.e_grid, log_flux)
+
+
+class FluxTable():
+    """Lookup table of :math:`\\log\\Phi(E, \\cos\\theta)` for the
+    weighting of large numbers of simulated events.
+
+    The logarithms of the fluxes are stored as one contiguous float32
+    array of shape (n_pdg, n_cos, n_e), which can be saved to and
+    memory mapped from a .npy file, see :func:`load_flux_table`. Both
+    grids have to be equidistant in :math:`\\log E` and
+    :math:`\\cos\\theta`, respectively, such that :func:`weights` finds
+    the cells without searching.
+
+    Args:
+      pdg_ids (list): PDG IDs of the tabulated particles
+      cos_theta (numpy.array): equidistant :math:`\\cos\\theta` values
+      e_grid (numpy.array): energies in GeV, equidistant in log
+      log_flux (numpy.array): :math:`\\log\\Phi` in 1/(GeV cm**2 s sr),
+                              shape (n_pdg, n_cos, n_e)
+    """
+
+    def __init__(self, pdg_ids, cos_theta, e_grid, log_flux):
+        self.pdg_ids = np.asarray(pdg_ids, dtype=np.int64)
+        self.cos_theta = np.asarray(cos_theta, dtype=np.float64)
+        self.e_grid = np.asarray(e_grid, dtype=np.float64)
+
+        for name, grid in [('cos_theta', self.cos_theta),
+                           ('log(e_grid)', np.log(self.e_grid))]:
+            step = np.diff(grid)
+            if grid.size < 2 or not np.allclose(step, step[0], rtol=1e-6):
+                raise Exception('FluxTable::__init__(): ' + name +
+                                ' is not equidistant.')
+
+        if isinstance(log_flux, np.memmap):
+            self.log_flux = log_flux
+        else:
+            log_flux = np.where(np.isfinite(log_flux), log_flux, -700.)
+            self.log_flux = np.ascontiguousarray(log_flux,
+                                                 dtype=np.float32)
+        if self.log_flux.shape != (self.pdg_ids.size, self.cos_theta.size,
+                                   self.e_grid.size):
+            raise Exception('FluxTable::__init__(): log_flux has the ' +
+                            'wrong shape ' + str(self.log_flux.shape) + '.')
+
+    def save(self, fname):
+        """Stores the table in ``fname.npy`` (log-fluxes) and
+        ``fname_axes.npz`` (PDG IDs and grids).
+
+        Args:
+          fname (str): file name without extension
+        """
+        np.save(fname + '.npy', self.log_flux)
+        np.savez(fname + '_axes.npz', pdg_ids=self.pdg_ids,
+                 cos_theta=self.cos_theta, e_grid=self.e_grid)
+
+    def weights(self, pdg, energy, cos_theta):
+        """Returns the fluxes for arrays of events by bilinear
+        interpolation in :math:`(\\log E, \\cos\\theta)` of
+        :math:`\\log\\Phi`.
+
+        The arguments are broadcast against each other. Events outside of
+        the energy range or with unknown PDG IDs get a flux of 0,
+        :math:`\\cos\\theta` is clipped to the tabulated range.
+
+        Args:
+          pdg (int or numpy.array): PDG IDs
+          energy (float or numpy.array): energies in GeV
+          cos_theta (float or numpy.array): :math:`\\cos\\theta`
+
+        Returns:
+          (numpy.array): fluxes in 1/(GeV cm**2 s sr)
+        """
+        pdg, energy, cos_theta = np.broadcast_arrays(pdg, energy, cos_theta)
+        shape = pdg.shape
+        log_e_min, log_e_max = np.log(self.e_grid[[0, -1]])
+        res = flux_table_weights_jit(
+            np.ascontiguousarray(pdg, dtype=np.int64).ravel(),
+            np.log(np.ascontiguousarray(energy, dtype=np.float64).ravel()),
+            np.ascontiguousarray(cos_theta, dtype=np.float64).ravel(),
+            self.pdg_ids, self.log_flux, log_e_min, log_e_max,
+            self.cos_theta[0], self.cos_theta[-1])
+        return res.reshape(shape)
+
+
+def load_flux_table(fname, mmap=True):
+    """Loads a table stored by :func:`FluxTable.save`.
+
+    Args:
+      fname (str): file name without extension
+      mmap (bool, optional): memory map the log-fluxes instead of
+                             reading them
+
+    Returns:
+      (FluxTable): the table
+    """
+    axes = np.load(fname + '_axes.npz')
+    # Copy-on-write mapping, since the compiled lookup expects
+    # writeable arrays
+    log_flux = np.load(fname + '.npy', mmap_mode='c' if mmap else None)
+    return FluxTable(axes['pdg_ids'], axes['cos_theta'],
+                     axes['e_grid'], log_flux)
+
+
+@jit(double[:](int64[:], double[:], double[:], int64[:], float32[:, :, :],
+               double, double, double, double), target='cpu')
+def flux_table_weights_jit(pdg, log_e, cos_theta, pdg_ids, log_flux,
+                           log_e_min, log_e_max, cos_min, cos_max):
+    """Bilinear interpolation of :math:`\\log\\Phi` on equidistant
+    grids, see :func:`FluxTable.weights`.
+
+    Args:
+      pdg (numpy.array): PDG IDs of the events
+      log_e (numpy.array): :math:`\\log E` of the events
+      cos_theta (numpy.array): :math:`\\cos\\theta` of the events
+      pdg_ids (numpy.array): PDG IDs of the table rows
+      log_flux (numpy.array): table of shape (n_pdg, n_cos, n_e)
+      log_e_min, log_e_max (float): range of the :math:`\\log E` grid
+      cos_min, cos_max (float): range of the :math:`\\cos\\theta` grid
+
+    Returns:
+      numpy.array: fluxes of the events
+    """
+    n_pdg = pdg_ids.size
+    n_cos = log_flux.shape[1]
+    n_e = log_flux.shape[2]
+    e_scale = (n_e - 1) / (log_e_max - log_e_min)
+    cos_scale = (n_cos - 1) / (cos_max - cos_min)
+    res = np.empty(pdg.size)
+    row = 0
+    for i in xrange(pdg.size):
+        res[i] = 0.
+        # Events are often sorted by particle type
+        if pdg_ids[row] != pdg[i]:
+            row = -1
+            for j in xrange(n_pdg):
+                if pdg_ids[j] == pdg[i]:
+                    row = j
+            if row < 0:
+                row = 0
+                continue
+
+        u = (log_e[i] - log_e_min) * e_scale
+        if not (u >= 0. and u <= n_e - 1):
+            continue
+        ie = min(int(u), n_e - 2)
+        u -= ie
+
+        v = (min(max(cos_theta[i], cos_min), cos_max) - cos_min) * cos_scale
+        ic = min(int(v), n_cos - 2)
+        v -= ic
+
+        lf = ((1. - v) * ((1. - u) * log_flux[row, ic, ie] +
+                          u * log_flux[row, ic, ie + 1]) +
+              v * ((1. - u) * log_flux[row, ic + 1, ie] +
+                   u * log_flux[row, ic + 1, ie + 1]))
+        # Zero fluxes are stored as -700
+        if lf > -650.:
+            res[i] = np.exp(lf)
+    return res
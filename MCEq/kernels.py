@@ -45,8 +45,91 @@ The functions use different libraries for sparse and dense linear algebra (BLAS)
 import numpy as np
 from mceq_config import config
 
+
+class DenseOutput():
+    """Interpolates the state vector at arbitrary depths between the
+    integration steps.
+
+    Within a step from :math:`X_i` to :math:`X_{i+1}` the state is
+    approximated by the cubic Hermite polynomial through
+    :math:`\\Phi_i, \\Phi_{i+1}` and the derivatives
+    :math:`\\Phi'_i, \\Phi'_{i+1}`, which the kernels calculate anyway.
+    The step sizes therefore do not depend on the output depths. For the
+    last step, the linear (Euler) segment is used.
+
+    If the sink has a ``reduce`` method (see :mod:`MCEq.output`), only
+    the reduced vectors, e.g. the selected elements of the state, are kept
+    and interpolated. They are passed to its ``push_reduced`` method.
+
+    Args:
+      int_grid (numpy.array): increasing depths in g/cm**2
+      sink (object): receives the interpolated states, see
+                     :mod:`MCEq.output`
+    """
+
+    def __init__(self, int_grid, sink):
+        self.int_grid = (np.array([]) if int_grid is None
+                         else np.asarray(int_grid, dtype=np.float64))
+        self.sink = sink
+        self.grid_step = 0
+        self._last = None
+        # States at the beginning of a step have to be kept (stored),
+        # states at the end are only read (viewed)
+        if hasattr(sink, 'reduce'):
+            self._store = self._view = sink.reduce
+            self._push = sink.push_reduced
+        else:
+            self._store, self._view = np.copy, lambda phi: phi
+            self._push = sink.push
+
+    def active(self):
+        return self.grid_step < self.int_grid.size
+
+    def step(self, X, dX, phi, dphi):
+        """Called with the state and its derivative at depth ``X``, before
+        the step to ``X + dX``."""
+        if self._last is not None:
+            self._emit(self._view(phi), self._view(dphi))
+        n = self.int_grid.size
+        while self.grid_step < n and self.int_grid[self.grid_step] <= X:
+            self.sink.push(self.grid_step, phi)
+            self.grid_step += 1
+        if self.grid_step < n and self.int_grid[self.grid_step] <= X + dX:
+            self._last = (X, dX, self._store(phi), self._store(dphi))
+        else:
+            self._last = None
+
+    def _emit(self, phi1, dphi1, X_max=None):
+        X0, h, phi0, dphi0 = self._last
+        if X_max is None:
+            X_max = X0 + h
+        while (self.grid_step < self.int_grid.size and
+               self.int_grid[self.grid_step] <= X_max):
+            t = min((self.int_grid[self.grid_step] - X0) / h, 1.)
+            if dphi1 is None:
+                phi_t = phi0 + (t * h) * dphi0
+            else:
+                t2, t3 = t * t, t * t * t
+                phi_t = ((2 * t3 - 3 * t2 + 1) * phi0 +
+                         ((t3 - 2 * t2 + t) * h) * dphi0 +
+                         (-2 * t3 + 3 * t2) * phi1 +
+                         ((t3 - t2) * h) * dphi1)
+            self._push(self.grid_step, phi_t)
+            self.grid_step += 1
+        self._last = None
+
+    def finish(self, phi):
+        """Emits the depths in the last step and returns the result of the
+        sink. Depths beyond the end of the integration (up to rounding of
+        the step sizes) are ignored."""
+        if self._last is not None:
+            X0, h = self._last[:2]
+            self._emit(None, None, (X0 + h) * (1. + 1e-5))
+        return self.sink.result()
+
+
 def kern_numpy(nsteps, dX, rho_inv, int_m, dec_m,
-               phi, grid_idcs, prog_bar=None):
+               phi, int_grid, prog_bar=None, sink=None):
     """:mod;`numpy` implementation of forward-euler integration.
     
     Args:
@@ -56,29 +139,36 @@ def kern_numpy(nsteps, dX, rho_inv, int_m, dec_m,
       int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
+      int_grid (numpy.array): depths in g/cm**2 of the intermediate
+        solutions, see :class:`DenseOutput`
       prog_bar (object,optional): handle to :class:`ProgressBar` object
+      sink (object,optional): receives the state vectors at ``int_grid``,
+        see :mod:`MCEq.output`. Defaults to a :class:`MCEq.output.ListSink`.
     Returns:
       numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the result of the sink
     """
 
-    grid_sol = []
-    grid_step = 0
+    if sink is None:
+        from MCEq.output import ListSink
+        sink = ListSink()
+    dense = DenseOutput(int_grid, sink)
+    X = 0.
     
     for step in xrange(nsteps):
         if prog_bar and (step % 200 == 0):
             prog_bar.update(step)
-        phi += (int_m.dot(phi) + dec_m.dot(rho_inv[step] * phi)) * dX[step]
-        
-        if (grid_idcs and grid_step < len(grid_idcs) 
-            and grid_idcs[grid_step] == step):
-            grid_sol.append(np.copy(phi))
-            grid_step += 1
+        dphi = int_m.dot(phi) + dec_m.dot(rho_inv[step] * phi)
+        if dense.active():
+            dense.step(X, dX[step], phi, dphi)
+        phi += dphi * dX[step]
+        X += dX[step]
 
-    return phi, grid_sol
+    return phi, dense.finish(phi)
 
 
 def kern_CUDA_dense(nsteps, dX, rho_inv, int_m, dec_m,
-                    phi, grid_idcs, prog_bar=None):
+                    phi, int_grid, prog_bar=None, sink=None):
     """`NVIDIA CUDA cuBLAS <https://developer.nvidia.com/cublas>`_ implementation 
     of forward-euler integration.
     
@@ -93,6 +183,8 @@ def kern_CUDA_dense(nsteps, dX, rho_inv, int_m, dec_m,
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
       prog_bar (object,optional): handle to :class:`ProgressBar` object
+      sink (object,optional): not supported, since the state vector is
+        kept on the GPU
     Returns:
       numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
     """
@@ -133,7 +225,7 @@ def kern_CUDA_dense(nsteps, dX, rho_inv, int_m, dec_m,
     return cu_curr_phi.copy_to_host()
 
 def kern_CUDA_sparse(nsteps, dX, rho_inv, int_m, dec_m,
-                    phi, grid_idcs, prog_bar=None):
+                    phi, int_grid, prog_bar=None, sink=None):
     """`NVIDIA CUDA cuSPARSE <https://developer.nvidia.com/cusparse>`_ implementation 
     of forward-euler integration.
     
@@ -151,6 +243,8 @@ def kern_CUDA_sparse(nsteps, dX, rho_inv, int_m, dec_m,
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
       prog_bar (object,optional): handle to :class:`ProgressBar` object
+      sink (object,optional): not supported, since the state vector is
+        kept on the GPU
     Returns:
       numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
     """
@@ -214,7 +308,7 @@ def kern_CUDA_sparse(nsteps, dX, rho_inv, int_m, dec_m,
     return cu_curr_phi.copy_to_host()
 
 def kern_MKL_sparse(nsteps, dX, rho_inv, int_m, dec_m,
-                    phi, grid_idcs, prog_bar=None):
+                    phi, int_grid, prog_bar=None, sink=None):
     """`Intel MKL sparse BLAS <https://software.intel.com/en-us/articles/intel-mkl-sparse-blas-overview?language=en>`_ 
     implementation of forward-euler integration.
     
@@ -228,10 +322,14 @@ def kern_MKL_sparse(nsteps, dX, rho_inv, int_m, dec_m,
       int_m (numpy.array): interaction matrix :eq:`int_matrix` in dense or sparse representation
       dec_m (numpy.array): decay  matrix :eq:`dec_matrix` in dense or sparse representation
       phi (numpy.array): initial state vector :math:`\\Phi(X_0)` 
-      grid_idcs (list): indices at which longitudinal solutions have to be saved.
+      int_grid (numpy.array): depths in g/cm**2 of the intermediate
+        solutions, see :class:`DenseOutput`
       prog_bar (object,optional): handle to :class:`ProgressBar` object
+      sink (object,optional): receives the state vectors at ``int_grid``,
+        see :mod:`MCEq.output`. Defaults to a :class:`MCEq.output.ListSink`.
     Returns:
       numpy.array: state vector :math:`\\Phi(X_{nsteps})` after integration
+      and the result of the sink
     """
     
     from ctypes import cdll, c_int, c_double, c_char, POINTER, byref
@@ -276,8 +374,11 @@ def kern_MKL_sparse(nsteps, dX, rho_inv, int_m, dec_m,
     cdone = c_double(1.)
     cione = c_int(1)
     
-    grid_step = 0
-    grid_sol = []
+    if sink is None:
+        from MCEq.output import ListSink
+        sink = ListSink()
+    dense = DenseOutput(int_grid, sink)
+    X = 0.
     for step in xrange(nsteps):
         if prog_bar:
             prog_bar.update(step)
@@ -292,16 +393,14 @@ def kern_MKL_sparse(nsteps, dX, rho_inv, int_m, dec_m,
              byref(c_double(rho_inv[step])), matdsc,
              dec_m_data, dec_m_ci, dec_m_pb, dec_m_pe,
              phi, byref(cdone), delta_phi)
+        if dense.active():
+            dense.step(X, dX[step], npphi, npdelta_phi)
         # phi = delta_phi * dX + phi
         axpy(m, c_double(dX[step]),
              delta_phi, cione, phi, cione)
-        
-        if (grid_idcs and grid_step < len(grid_idcs) 
-            and grid_idcs[grid_step] == step):
-            grid_sol.append(np.copy(npphi))
-            grid_step += 1
-            
+        X += dX[step]
+
 
     # Reset number of threads for MKL
     mkl.mkl_set_num_threads(byref(c_int(4)))
-    return npphi, grid_sol
+    return npphi, dense.finish(npphi)
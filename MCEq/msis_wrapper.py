@@ -46,6 +46,15 @@ class NRLMSISE00Base():
         return quad(self.get_density, altitude_cm, 112.8 * 1e5,
                     epsrel=0.001)[0]
 
+    def get_density_profile(self, altitudes_cm):
+        """Returns the densities in g/cm**3 for an array of altitudes
+        at the current location, day of year and time."""
+        import numpy as np
+        rho = np.empty(len(altitudes_cm))
+        for i, altitude_cm in enumerate(altitudes_cm):
+            rho[i] = self.get_density(altitude_cm)
+        return rho
+
 class pyNRLMSISE00(NRLMSISE00Base):                      
     def init_default_values(self):
         """Sets default to June at South Pole"""
@@ -145,6 +154,30 @@ class cNRLMSISE00(NRLMSISE00Base):
                      byref(self.flags), byref(self.output))
         return self.output.d[5]
 
+    def get_density_profile(self, altitudes_cm):
+        """Returns the densities in g/cm**3 for an array of altitudes
+        at the current location, day of year and time.
+
+        The C library evaluates one altitude per call. The ctypes
+        arguments are created once and only the altitude is updated,
+        and the results are written into a numpy buffer."""
+        import numpy as np
+        msis_input = self.input
+        alt = c_double()
+        args = (msis_input.year, msis_input.doy, msis_input.sec, alt,
+                msis_input.g_lat, msis_input.g_long, msis_input.lst,
+                msis_input.f107A, msis_input.f107, msis_input.ap,
+                msis_input.ap_a, byref(self.flags), byref(self.output))
+        d = self.output.d
+        gtd7_py = msis.gtd7_py
+
+        rho = np.empty(len(altitudes_cm))
+        for i, altitude_cm in enumerate(altitudes_cm):
+            alt.value = altitude_cm / 1e5
+            gtd7_py(*args)
+            rho[i] = d[5]
+        return rho
+
 
 def test():
     import numpy as np
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.output` - sinks for longitudinal solutions
+=====================================================
+
+The integration kernels in :mod:`MCEq.kernels` pass the state vector at
+each point of the depth grid (``int_grid`` argument of
+:func:`MCEq.core.MCEqRun.solve`) to a sink object. A sink implements
+``push(grid_step, phi)``, which is called during the integration, and
+``result()``, which is called once the integration has finished.
+Sinks, which keep only a part of the state, implement ``reduce(phi)``
+and ``push_reduced(grid_step, value)`` in addition, such that
+:class:`MCEq.kernels.DenseOutput` interpolates only this part between
+the integration steps.
+
+- :class:`ListSink` keeps copies of the state vectors in a list, or only
+  of selected elements in reduced precision (see :func:`encode_state`).
+  This is the default and the content of
+  :attr:`MCEq.core.MCEqRun.grid_sol`.
+- :class:`CallbackSink` passes the state vectors to a function.
+- :class:`MemmapSink` writes selected elements of the state vectors to a
+  memory-mapped ``.npy`` file, optionally on a background thread. The
+  memory needed does not grow with the number of grid points.
+- :class:`FunctionalSink` keeps only linear functionals of the state
+  vectors, e.g. energy integrals (see :func:`energy_integrals`).
+- :class:`ObsLevelSink` additionally keeps the states at the observation
+  levels of :func:`MCEq.core.MCEqRun.solve` (argument ``obs_heights``).
+
+Typical interaction::
+
+      $ idcs = state_indices(mceq_run, ['mu+', 'mu-'])
+      $ sink = MemmapSink('profile.npy', len(X_grid), idcs)
+      $ mceq_run.solve(int_grid=X_grid, grid_sink=sink)
+      $ profile = np.load('profile.npy', mmap_mode='r')
+"""
+
+import numpy as np
+from mceq_config import dbg
+
+
+def state_indices(mceq_run, particle_names):
+    """Returns the indices of the state vector, which belong to the
+    given particles.
+
+    Args:
+      mceq_run (MCEqRun): instance, which defines the state vector
+      particle_names (list): names of particles, as in
+                             :attr:`MCEq.core.MCEqRun.pname2pref`
+
+    Returns:
+      (numpy.array): indices, ordered like ``particle_names``
+    """
+    ref = mceq_run.pname2pref
+    return np.concatenate([np.arange(ref[name].lidx(), ref[name].uidx())
+                           for name in particle_names])
+
+
+#: Smallest value of :math:`\\log\\Phi` in the ``'log16'`` encoding. It is
+#: decoded as zero.
+log16_floor = -690.
+
+
+def encode_state(phi, dtype):
+    """Converts (a part of) a state vector for storage.
+
+    Args:
+      phi (numpy.array): state vector
+      dtype (str): a numpy float type or ``'log16'``, which stores
+                   :math:`\\log\\Phi` as float16. Its relative precision
+                   is about :math:`5\\cdot10^{-4}\\,|\\log\\Phi|`.
+                   Negative values and values below
+                   :math:`e^{-690}` are stored as zero.
+
+    Returns:
+      (numpy.array): encoded copy of ``phi``
+    """
+    if dtype == 'log16':
+        # Clip before the logarithm, since it is NaN for negative values
+        return np.log(np.maximum(phi, np.exp(log16_floor))).astype(
+            np.float16)
+    return np.array(phi, dtype=dtype)
+
+
+def decode_state(arr, dtype):
+    """Inverts :func:`encode_state` and returns float64 values."""
+    if dtype == 'log16':
+        res = np.exp(arr.astype(np.float64))
+        res[arr <= log16_floor] = 0.
+        return res
+    return np.asarray(arr, dtype=np.float64)
+
+
+class ListSink():
+    """Stores copies of the state vectors in a list.
+
+    Args:
+      idcs (numpy.array, optional): indices of the state vector, see
+                                    :func:`state_indices`. By default
+                                    the full state is stored.
+      dtype (str, optional): storage type, see :func:`encode_state`. By
+                             default, the type of the state is kept.
+    """
+
+    def __init__(self, idcs=None, dtype=None):
+        self.idcs = idcs
+        self.dtype = dtype
+        self.grid_sol = []
+
+    def reduce(self, phi):
+        """Returns a copy of the stored elements of ``phi``."""
+        return np.copy(phi) if self.idcs is None else phi[self.idcs]
+
+    def push(self, grid_step, phi):
+        self.push_reduced(grid_step, self.reduce(phi))
+
+    def push_reduced(self, grid_step, value):
+        if self.dtype is None:
+            self.grid_sol.append(value)
+        else:
+            self.grid_sol.append(encode_state(value, self.dtype))
+
+    def result(self):
+        return self.grid_sol
+
+
+class CallbackSink():
+    """Passes the state vectors to a function.
+
+    The state vector is overwritten in the next integration step. The
+    function has to copy the values, which it keeps.
+
+    Args:
+      callback (function): called with the index of the grid point and
+                           the state vector
+    """
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def push(self, grid_step, phi):
+        self.callback(grid_step, phi)
+
+    def result(self):
+        return None
+
+
+class FunctionalSink():
+    """Evaluates linear functionals of the state vectors.
+
+    Only the values :math:`W \\cdot \\Phi` are stored. Sinks with a
+    ``reduce`` method are recognized by :class:`MCEq.kernels.DenseOutput`,
+    which then interpolates the reduced vectors instead of full states.
+
+    Args:
+      weights (numpy.array or scipy.sparse matrix): functionals of shape
+        (n_functionals, dim_states), e.g. from :func:`energy_integrals`
+    """
+
+    def __init__(self, weights):
+        self.weights = weights
+        self.values = []
+
+    def reduce(self, phi):
+        return self.weights.dot(phi)
+
+    def push(self, grid_step, phi):
+        self.push_reduced(grid_step, self.reduce(phi))
+
+    def push_reduced(self, grid_step, value):
+        self.values.append(value)
+
+    def result(self):
+        """Returns the values of shape (n_grid, n_functionals)."""
+        return np.array(self.values)
+
+
+def energy_integrals(mceq_run, particle_names, e_min=None, e_max=None,
+                     mag=0.):
+    """Returns the functionals :math:`\\int_{E_{min}}^{E_{max}}
+    \\Phi(E) E^{mag} {\\rm d}E` of particles for :class:`FunctionalSink`.
+
+    The integrals are sums over the energy bins, whose centers are within
+    the limits.
+
+    Args:
+      mceq_run (MCEqRun): instance, which defines the state vector
+      particle_names (list): names, as accepted by
+                             :func:`MCEq.core.MCEqRun.get_solution`
+      e_min (float, optional): lower limit in GeV
+      e_max (float, optional): upper limit in GeV
+      mag (float, optional): power of the energy in the integrand
+
+    Returns:
+      (scipy.sparse.csr_matrix): functionals of shape
+      (n_names, dim_states)
+    """
+    from scipy.sparse import csr_matrix, vstack
+
+    e_grid = mceq_run.e_grid
+    w = np.diff(mceq_run.y.e_bins) * e_grid ** mag
+    if e_min is not None:
+        w[e_grid < e_min] = 0.
+    if e_max is not None:
+        w[e_grid > e_max] = 0.
+    w = csr_matrix(w)
+    return vstack([w.dot(mceq_run._get_agg_operator(name))
+                   for name in particle_names], format='csr')
+
+
+class MemmapSink():
+    """Writes (selected elements of) the state vectors to a ``.npy`` file.
+
+    The file has the shape (n_grid, n_idcs) and is created at the first
+    call of :func:`push`. With ``background=True``, the writing is done
+    by a separate thread. At most ``queue_size`` selected state vectors
+    are kept in memory waiting to be written.
+
+    Args:
+      fname (str): name of the ``.npy`` file
+      n_grid (int): number of depth grid points
+      idcs (numpy.array, optional): indices of the state vector, see
+                                    :func:`state_indices`. By default
+                                    the full state is stored.
+      dtype (str, optional): data type in the file
+      background (bool, optional): write in a background thread
+      queue_size (int, optional): capacity of the queue of the thread
+    """
+
+    def __init__(self, fname, n_grid, idcs=None, dtype='float32',
+                 background=False, queue_size=8):
+        self.fname = fname
+        self.n_grid = n_grid
+        self.idcs = idcs
+        self.dtype = dtype
+        self.background = background
+        self.queue_size = queue_size
+        self._mmap = None
+        self._queue = None
+        self._thread = None
+
+    def _open(self, shape):
+        self._mmap = np.lib.format.open_memmap(
+            self.fname, mode='w+', dtype=self.dtype,
+            shape=(self.n_grid,) + shape)
+        if self.background:
+            from threading import Thread
+            from Queue import Queue
+            self._queue = Queue(self.queue_size)
+            self._thread = Thread(target=self._write_loop)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._mmap[item[0]] = item[1]
+
+    def reduce(self, phi):
+        """Returns a copy of the stored elements of ``phi``."""
+        return np.copy(phi) if self.idcs is None else phi[self.idcs]
+
+    def push(self, grid_step, phi):
+        self.push_reduced(grid_step,
+                          phi if self.idcs is None else phi[self.idcs])
+
+    def push_reduced(self, grid_step, value):
+        if self._mmap is None:
+            self._open(value.shape)
+        if self.background:
+            # Copy, since phi is modified by the next integration step
+            self._queue.put((grid_step, np.array(value, dtype=self.dtype)))
+        else:
+            self._mmap[grid_step] = value
+
+    def close(self):
+        """Waits for the background thread and flushes the file."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self._mmap is not None:
+            self._mmap.flush()
+            if dbg > 0:
+                print 'MemmapSink::close(): wrote', self.fname, \
+                    self._mmap.shape
+
+    def result(self):
+        """Closes the sink and returns the memory-mapped array."""
+        self.close()
+        return self._mmap
+
+
+class ObsLevelSink():
+    """Separates the states at observation levels from the intermediate
+    solutions.
+
+    The kernels are called with the merged, sorted grid of the depths of
+    the intermediate solutions and of the observation levels. The states
+    at the observation levels are copied to :attr:`obs_sol`, all others
+    are passed on to ``sink`` with their index in the original grid.
+
+    Until the last observation level has been passed, :func:`reduce`
+    keeps full states. Afterwards, it applies the reduction of ``sink``.
+
+    Args:
+      sink (object): sink of the intermediate solutions
+      grid_map (numpy.array): index in the original grid for each point
+                              of the merged grid, -1 for observation levels
+      obs_map (numpy.array): index of the observation level for each point
+                             of the merged grid, -1 for other points
+    """
+
+    def __init__(self, sink, grid_map, obs_map):
+        self.sink = sink
+        self.grid_map = grid_map
+        self.obs_map = obs_map
+        #: (list) full state vectors at the observation levels
+        self.obs_sol = [None] * int(np.sum(obs_map >= 0))
+        obs_steps = np.flatnonzero(obs_map >= 0)
+        self._last_obs = obs_steps[-1] if obs_steps.size else -1
+        self._next_step = 0
+        self._full = True
+
+    def reduce(self, phi):
+        """Returns a copy of ``phi`` or its reduction by ``sink``, once
+        all observation levels have been passed."""
+        self._full = (self._next_step <= self._last_obs or
+                      not hasattr(self.sink, 'reduce'))
+        return np.copy(phi) if self._full else self.sink.reduce(phi)
+
+    def push(self, grid_step, phi):
+        self._next_step = grid_step + 1
+        if self.obs_map[grid_step] >= 0:
+            self.obs_sol[self.obs_map[grid_step]] = np.copy(phi)
+        else:
+            self.sink.push(self.grid_map[grid_step], phi)
+
+    def push_reduced(self, grid_step, value):
+        if self._full:
+            # The value has not been reduced by the sink
+            self.push(grid_step, value)
+        else:
+            self._next_step = grid_step + 1
+            self.sink.push_reduced(self.grid_map[grid_step], value)
+
+    def result(self):
+        return self.sink.result()
@@ -0,0 +1,582 @@
+# -*- coding: utf-8 -*-
+"""
+:mod:`MCEq.results` - indexed storage of solutions
+==================================================
+
+This module stores the solutions of :class:`MCEq.core.MCEqRun` in a
+directory, indexed by the configuration (interaction model, charm model,
+atmosphere, zenith angle, primary model). The layout of the directory is::
+
+    meta.json            energy grid, species offsets and data type
+    index.json           consolidated index and name of the solution file
+    solutions_<n>.npy    consolidated solutions, one row per entry
+    index/<key>.json     index entries appended since the last consolidation
+    data/<key>.npy       solution (state vector at the surface)
+    data/<key>_grid.npy  longitudinal profile (``grid_sol``), if available
+
+Every entry is written to its own files and made visible by an atomic
+rename, such that several processes can append to the same store without
+locking. :func:`ResultStore.consolidate` merges the appended entries into
+``index.json`` and a single contiguous array of solutions, which is
+written to a new file for each consolidation. All arrays are read as
+memory maps, i.e. only the requested species and energy range are loaded
+from disk.
+
+Typical interaction::
+
+      $ store = ResultStore('results/campaign')
+      $ store.add(('SIBYLL2.3', None, ('MSIS00', 'SouthPole', 'January'),
+      $            0., (pm.HillasGaisser2012, 'H3a')), mceq_run)
+      $ store.consolidate()
+      $ e_grid, flux = store.get(config, 'total_numu', e_range=(1e2, 1e6))
+      $ configs, e_grid, fluxes = store.get_all('total_numu')
+
+The :class:`SolutionCache` memoizes :func:`MCEq.core.MCEqRun.solve`
+for repeated calculations of identical configurations, if
+``use_solution_cache`` is enabled in :mod:`mceq_config`.
+"""
+
+import os
+import json
+import numpy as np
+from os.path import join, isfile, isdir
+from mceq_config import dbg
+
+
+def _normalize_config(config):
+    """Converts a configuration tuple into a JSON compatible list.
+
+    Classes, e.g. of primary models, are replaced by their names, tuples
+    by lists and numbers by floats, such that e.g. a zenith angle of
+    ``0`` and ``0.`` give the same key.
+    """
+    if isinstance(config, type) or type(config).__name__ == 'classobj':
+        return config.__name__
+    elif isinstance(config, (tuple, list)):
+        return [_normalize_config(value) for value in config]
+    elif isinstance(config, (bool, np.bool_)):
+        return bool(config)
+    elif isinstance(config, (int, long, float, np.integer, np.floating)):
+        return float(config)
+    return config
+
+
+def config_key(config):
+    """Returns the key of a configuration in a :class:`ResultStore`.
+
+    Args:
+      config (tuple): e.g. a :class:`MCEq.batch.BatchConfig`
+
+    Returns:
+      str: hexadecimal digest of the normalized configuration
+    """
+    from hashlib import md5
+    return md5(json.dumps(_normalize_config(config))).hexdigest()[:16]
+
+
+def _atomic_write(fname, write):
+    """Writes a file under a temporary name and renames it to ``fname``.
+
+    Args:
+      fname (str): final file name
+      write (function): called with an open file object
+    """
+    from tempfile import mkstemp
+
+    fd, tmp_fname = mkstemp(dir=os.path.dirname(fname), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.chmod(tmp_fname, 0644)
+        os.rename(tmp_fname, fname)
+    except:
+        if isfile(tmp_fname):
+            os.remove(tmp_fname)
+        raise
+
+
+class ResultStore():
+    """Directory of solutions indexed by the configuration.
+
+    Args:
+      path (str): directory of the store. It is created if it does not
+                  exist.
+      dtype (str, optional): data type of new stores, ``'float64'`` or
+                             ``'float32'``
+    """
+
+    def __init__(self, path, dtype='float64'):
+        self.path = path
+        self.dtype = np.dtype(dtype).name
+        #: (numpy.array) energy grid of the stored solutions
+        self.e_grid = None
+        #: (list) (name, first index in state vector) of the species
+        self.species = None
+        #: (dict) index entries by key
+        self.index = {}
+        self._offsets = {}
+        self._packed = None
+        self._packed_fname = None
+
+        for dname in [path, join(path, 'index'), join(path, 'data')]:
+            if not isdir(dname):
+                try:
+                    os.makedirs(dname)
+                except OSError:
+                    # Created concurrently by another process
+                    pass
+        self._read_meta()
+        self.refresh()
+
+    def _read_meta(self):
+        fname = join(self.path, 'meta.json')
+        if not isfile(fname):
+            return
+        with open(fname, 'r') as f:
+            meta = json.load(f)
+        self.e_grid = np.array(meta['e_grid'])
+        self.species = [tuple(s) for s in meta['species']]
+        self.dtype = meta['dtype']
+        self._offsets = dict(self.species)
+
+    def _write_meta(self, mceq_run):
+        species = sorted([(p.name, p.lidx())
+                          for p in mceq_run.cascade_particles],
+                         key=lambda s: s[1])
+        meta = {'e_grid': list(mceq_run.e_grid),
+                'species': species,
+                'dim_states': mceq_run.dim_states,
+                'dtype': self.dtype}
+        _atomic_write(join(self.path, 'meta.json'),
+                      lambda f: json.dump(meta, f))
+        self._read_meta()
+
+    def refresh(self):
+        """Reads the consolidated index and the entries appended since.
+        """
+        self.index, self._packed_fname = {}, None
+        fname = join(self.path, 'index.json')
+        if isfile(fname):
+            with open(fname, 'r') as f:
+                consolidated = json.load(f)
+            self.index = consolidated['entries']
+            self._packed_fname = consolidated['solutions']
+        for fname in os.listdir(join(self.path, 'index')):
+            if not fname.endswith('.json'):
+                continue
+            with open(join(self.path, 'index', fname), 'r') as f:
+                entry = json.load(f)
+            self.index[entry['key']] = entry
+        self._packed = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, config):
+        return config_key(config) in self.index
+
+    def add(self, config, mceq_run, solution=None, grid_sol=None):
+        """Stores the solution of a configuration.
+
+        Args:
+          config (tuple): configuration, e.g. :class:`MCEq.batch.BatchConfig`
+          mceq_run (MCEqRun): instance, which provides the energy grid
+                              and the layout of the state vector. If
+                              ``solution`` is not given, its current
+                              ``solution`` and ``grid_sol`` are stored.
+          solution (numpy.array, optional): state vector at the surface
+          grid_sol (numpy.array, optional): state vectors on the depth grid
+
+        Returns:
+          str: key of the entry
+        """
+        if self.species is None:
+            self._write_meta(mceq_run)
+        elif not np.allclose(self.e_grid, mceq_run.e_grid):
+            raise Exception('ResultStore::add(): Energy grid differs ' +
+                            'from the grid of the store.')
+
+        if solution is None:
+            solution = mceq_run.solution
+            grid_sol = getattr(mceq_run, 'grid_sol', None)
+            if (grid_sol is not None and len(grid_sol) > 0 and
+                    (getattr(mceq_run, '_grid_idcs', None) is not None or
+                     getattr(mceq_run, '_grid_dtype', None) is not None)):
+                # Expand reduced intermediate solutions, see grid_species
+                # and grid_dtype of MCEq.core.MCEqRun.solve()
+                idcs = mceq_run._grid_idcs
+                if idcs is None:
+                    idcs = slice(None)
+                full = np.zeros((len(grid_sol), mceq_run.dim_states))
+                for grid_idx in xrange(len(grid_sol)):
+                    full[grid_idx, idcs] = mceq_run._get_grid_state(grid_idx)
+                grid_sol = full
+
+        key = config_key(config)
+        fname = join(self.path, 'data', key)
+        _atomic_write(fname + '.npy', lambda f: np.save(
+            f, np.asarray(solution, dtype=self.dtype)))
+        n_grid = 0
+        if grid_sol is not None and len(grid_sol) > 0:
+            grid_sol = np.asarray(grid_sol, dtype=self.dtype)
+            n_grid = grid_sol.shape[0]
+            _atomic_write(fname + '_grid.npy', lambda f: np.save(f, grid_sol))
+
+        entry = {'key': key, 'config': _normalize_config(config),
+                 'n_grid': n_grid}
+        _atomic_write(join(self.path, 'index', key + '.json'),
+                      lambda f: json.dump(entry, f))
+        self.index[key] = entry
+
+        if dbg > 1:
+            print 'ResultStore::add(): stored', key, entry['config']
+        return key
+
+    def consolidate(self):
+        """Merges the appended entries into ``index.json`` and packs all
+        solutions into one contiguous array.
+
+        The array is written to a new file, before the index, which refers
+        to it, replaces the old one. Readers with the old index keep
+        reading the old array until they call :func:`refresh`. The old
+        array is deleted afterwards. Readers which open it later, refresh
+        their index automatically.
+
+        Must not run concurrently with processes, which append to the store.
+        """
+        import re
+
+        self.refresh()
+        if not self.index:
+            return
+        keys = sorted(self.index.keys())
+        dim = len(self.species) * len(self.e_grid)
+
+        version = 0
+        if self._packed_fname is not None:
+            version = int(re.match(r'solutions_(\d+)\.npy',
+                                   self._packed_fname).group(1)) + 1
+        packed_fname = 'solutions_{0:d}.npy'.format(version)
+        tmp_fname = join(self.path, packed_fname + '.tmp')
+        packed = np.lib.format.open_memmap(tmp_fname, mode='w+',
+                                           dtype=self.dtype,
+                                           shape=(len(keys), dim))
+        for row, key in enumerate(keys):
+            packed[row] = self._read_solution(key)
+        packed.flush()
+        del packed
+        os.rename(tmp_fname, join(self.path, packed_fname))
+
+        entries = dict([(key, dict(self.index[key], row=row))
+                        for row, key in enumerate(keys)])
+        _atomic_write(join(self.path, 'index.json'),
+                      lambda f: json.dump({'solutions': packed_fname,
+                                           'entries': entries}, f))
+
+        old_fname = self._packed_fname
+        self._packed = None
+        self.index, self._packed_fname = entries, packed_fname
+        if old_fname is not None and isfile(join(self.path, old_fname)):
+            os.remove(join(self.path, old_fname))
+        for key in keys:
+            for fname in [join(self.path, 'index', key + '.json'),
+                          join(self.path, 'data', key + '.npy')]:
+                if isfile(fname):
+                    os.remove(fname)
+
+        if dbg > 0:
+            print ('ResultStore::consolidate(): {0} entries in ' +
+                   '{1}.').format(len(keys), self.path)
+
+    def _load_packed(self):
+        """Maps the consolidated solutions. If they have been replaced by
+        another :func:`consolidate`, the index is read again."""
+        if self._packed is not None:
+            return
+        try:
+            self._packed = np.load(join(self.path, self._packed_fname),
+                                   mmap_mode='r')
+        except IOError:
+            self.refresh()
+            self._packed = np.load(join(self.path, self._packed_fname),
+                                   mmap_mode='r')
+
+    def _read_solution(self, key):
+        if 'row' in self.index[key]:
+            self._load_packed()
+            # The index may have been refreshed
+            return self._packed[self.index[key]['row']]
+        return np.load(join(self.path, 'data', key + '.npy'), mmap_mode='r')
+
+    def _species_offsets(self, particle_name):
+        """Returns the offsets in the state vector, which are summed for
+        a particle name. Accepts the prefixes of
+        :func:`MCEq.core.MCEqRun.get_solution`."""
+        if particle_name.startswith('total'):
+            prefixes = ('pr_', 'pi_', 'k_', '')
+        elif particle_name.startswith('conv'):
+            prefixes = ('pi_', 'k_', '')
+        else:
+            return [self._offsets[particle_name]]
+        lep_str = particle_name.split('_')[1]
+        return [self._offsets[prefix + lep_str] for prefix in prefixes]
+
+    def _e_slice(self, e_range):
+        if e_range is None:
+            return slice(0, len(self.e_grid))
+        return slice(np.searchsorted(self.e_grid, e_range[0]),
+                     np.searchsorted(self.e_grid, e_range[1], side='right'))
+
+    def get(self, config, particle_name, e_range=None, grid_idx=None,
+            mag=0.):
+        """Reads the spectrum of a particle for one configuration.
+
+        Args:
+          config (tuple): configuration of the entry
+          particle_name (str): name, as accepted by
+                               :func:`MCEq.core.MCEqRun.get_solution`
+          e_range (tuple, optional): (min, max) energy in GeV
+          grid_idx (int, optional): index of the depth grid. If not
+                                    specified, the flux at the surface
+                                    is returned.
+          mag (float, optional): the flux is multiplied by :math:`E^{mag}`
+
+        Returns:
+          (tuple): energy grid and flux in ``e_range``
+        """
+        key = config_key(config)
+        if key not in self.index:
+            raise Exception('ResultStore::get(): No entry for ' +
+                            str(_normalize_config(config)) + '.')
+        if grid_idx is None:
+            sol = self._read_solution(key)
+        else:
+            sol = np.load(join(self.path, 'data', key + '_grid.npy'),
+                          mmap_mode='r')[grid_idx]
+
+        e_sl = self._e_slice(e_range)
+        e_grid = self.e_grid[e_sl]
+        res = np.zeros(len(e_grid))
+        for lidx in self._species_offsets(particle_name):
+            res += sol[lidx + e_sl.start:lidx + e_sl.stop]
+        return e_grid, res * e_grid ** mag
+
+    def get_all(self, particle_name, e_range=None, mag=0.):
+        """Reads the spectrum of a particle at the surface for all entries.
+
+        After :func:`consolidate`, the spectra are sliced from the
+        contiguous array of solutions.
+
+        Args:
+          particle_name (str): name, as accepted by
+                               :func:`MCEq.core.MCEqRun.get_solution`
+          e_range (tuple, optional): (min, max) energy in GeV
+          mag (float, optional): the flux is multiplied by :math:`E^{mag}`
+
+        Returns:
+          (tuple): list of configurations (normalized), energy grid and
+          fluxes of shape (n_entries, n_e)
+        """
+        if self._packed_fname is not None:
+            # Refreshes the index, if the solutions have been replaced
+            self._load_packed()
+        keys = sorted(self.index.keys())
+        e_sl = self._e_slice(e_range)
+        e_grid = self.e_grid[e_sl]
+        fluxes = np.zeros((len(keys), len(e_grid)))
+
+        if keys and all(['row' in self.index[key] for key in keys]):
+            rows = [self.index[key]['row'] for key in keys]
+            for lidx in self._species_offsets(particle_name):
+                fluxes += self._packed[rows, lidx + e_sl.start:
+                                       lidx + e_sl.stop]
+        else:
+            for i, key in enumerate(keys):
+                sol = self._read_solution(key)
+                for lidx in self._species_offsets(particle_name):
+                    fluxes[i] += sol[lidx + e_sl.start:lidx + e_sl.stop]
+
+        return ([self.index[key]['config'] for key in keys], e_grid,
+                fluxes * e_grid ** mag)
+
+
+def _data_fingerprint(data_dir, fnames):
+    """Returns a digest of the names, sizes and modification times of
+    the data files ``fnames`` in ``data_dir``. It changes, when data
+    files are replaced.
+
+    Only the given files are considered, such that caches and indices,
+    which are written to ``data_dir``, do not change the digest. If a
+    file does not exist (yet), its compressed version (``.bz2``) is used.
+    """
+    from hashlib import md5
+    stats = []
+    for fname in fnames:
+        for candidate in [fname, os.path.splitext(fname)[0] + '.bz2']:
+            full_fname = join(data_dir, candidate)
+            if isfile(full_fname):
+                st = os.stat(full_fname)
+                stats.append((candidate, st.st_size, int(st.st_mtime)))
+                break
+    return md5(repr(stats)).hexdigest()
+
+
+class SolutionCache():
+    """Memoizes solutions of :func:`MCEq.core.MCEqRun.solve`.
+
+    Solutions are kept in an in-memory LRU cache of ``max_size`` entries.
+    If ``cache_dir`` is given, they are also stored on disk and loaded
+    from there, when they have been evicted from memory or were
+    calculated by another process. The disk cache is invalidated
+    automatically, when the yield, decay or cross section files in the
+    ``data_dir`` of :mod:`mceq_config` are replaced, and explicitly by
+    :func:`invalidate`.
+
+    Args:
+      max_size (int, optional): maximal number of solutions in memory
+      cache_dir (str, optional): directory of the disk cache
+    """
+
+    def __init__(self, max_size=32, cache_dir=None):
+        from collections import OrderedDict
+        from mceq_config import config
+
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        #: (int) solutions found in memory
+        self.hits = 0
+        #: (int) solutions found on disk
+        self.disk_hits = 0
+        #: (int) solutions not found
+        self.misses = 0
+        self._lru = OrderedDict()
+
+        if cache_dir is None:
+            return
+        if not isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                pass
+        fingerprint = _data_fingerprint(
+            config['data_dir'], [config[key] for key in ['yield_fname',
+                                                         'decay_fname',
+                                                         'cs_fname']])
+        fname = join(cache_dir, 'fingerprint')
+        if isfile(fname):
+            with open(fname, 'r') as f:
+                if f.read() != fingerprint:
+                    print ('SolutionCache::__init__(): Data files changed, ' +
+                           'invalidating disk cache.')
+                    self.invalidate()
+        _atomic_write(fname, lambda f: f.write(fingerprint))
+
+    def __len__(self):
+        return len(self._lru)
+
+    def get(self, key):
+        """Returns the cached solution for ``key``.
+
+        Args:
+          key (str): digest of the configuration, see
+                     :func:`MCEq.core.MCEqRun.solution_key`
+
+        Returns:
+          (tuple): (solution, grid_sol) or ``None``, if not cached
+        """
+        if key in self._lru:
+            self._lru[key] = self._lru.pop(key)
+            self.hits += 1
+            return self._lru[key]
+
+        if self.cache_dir is not None:
+            from zipfile import BadZipfile
+            from zlib import error as ZlibError
+            fname = join(self.cache_dir, key + '.npz')
+            try:
+                with np.load(fname) as f:
+                    grid_sol = f['grid_sol'] if 'grid_sol' in f else None
+                    entry = (f['solution'], grid_sol)
+                self.disk_hits += 1
+                self._insert(key, entry)
+                return entry
+            except (IOError, ValueError, KeyError, EOFError, BadZipfile,
+                    ZlibError):
+                if isfile(fname):
+                    # Truncated or corrupt entry
+                    print 'SolutionCache::get(): removing unreadable', fname
+                    try:
+                        os.remove(fname)
+                    except OSError:
+                        pass
+
+        self.misses += 1
+        return None
+
+    def _insert(self, key, entry):
+        self._lru[key] = entry
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def put(self, key, solution, grid_sol=None):
+        """Stores a solution.
+
+        Args:
+          key (str): digest of the configuration
+          solution (numpy.array): state vector at the surface
+          grid_sol (numpy.array, optional): state vectors on the depth grid
+        """
+        solution = np.copy(solution)
+        if grid_sol is not None and len(grid_sol) > 0:
+            grid_sol = np.copy(grid_sol)
+        else:
+            grid_sol = None
+        self._insert(key, (solution, grid_sol))
+
+        if self.cache_dir is None:
+            return
+        arrays = {'solution': solution}
+        if grid_sol is not None:
+            arrays['grid_sol'] = grid_sol
+        try:
+            _atomic_write(join(self.cache_dir, key + '.npz'),
+                          lambda f: np.savez(f, **arrays))
+        except (IOError, OSError):
+            print 'SolutionCache::put(): could not store', key
+
+    def invalidate(self, disk=True):
+        """Removes all cached solutions.
+
+        Args:
+          disk (bool, optional): if ``True``, delete also the disk cache
+        """
+        from glob import glob
+        self._lru.clear()
+        if disk and self.cache_dir is not None:
+            for fname in glob(join(self.cache_dir, '*.npz')):
+                os.remove(fname)
+
+    def stats(self):
+        """Returns the hit and miss counters as dictionary."""
+        return {'hits': self.hits, 'disk_hits': self.disk_hits,
+                'misses': self.misses, 'size': len(self._lru)}
+
+
+#: instance of :class:`SolutionCache` shared by all instances of
+#: :class:`MCEq.core.MCEqRun`, see :func:`get_solution_cache`
+_solution_cache = None
+
+
+def get_solution_cache():
+    """Returns the shared :class:`SolutionCache`, configured by
+    ``solution_cache_size`` and ``solution_cache_dir`` in
+    :mod:`mceq_config`."""
+    from mceq_config import config
+    global _solution_cache
+    if _solution_cache is None:
+        cache_dir = config['solution_cache_dir']
+        if cache_dir is not None:
+            cache_dir = join(config['data_dir'], cache_dir)
+        _solution_cache = SolutionCache(config['solution_cache_size'],
+                                        cache_dir)
+    return _solution_cache
@@ -39,8 +39,9 @@ config = {
 # File name of the cross-sections tables
 "cs_fname":"cs_dict.ppd",
 
-# File where to cache interpolating splines of the atmosphere module
-'atm_cache_file':'atm_cache.ppd',
+# Directory (in data_dir) where to cache interpolating splines of the
+# atmosphere module, one file per model, location, season and angle
+'atm_cache_dir':'atm_cache',
 
 # full path to libmkl_rt.[so/dylib] (only if kernel=='MKL')
 "MKL_path": path.join(sys.prefix, 'lib', 'libmkl_rt') + lib_ext,
@@ -99,6 +100,23 @@ config = {
 # Advanced settings
 #=========================================================================
 
+# Merge this number of neighboring bins of the energy grid for fast
+# preview calculations with smaller matrices (1 = grid of the data files)
+"preview_rebin": 1,
+
+# Store yields of injected custom charm models in the data_dir
+"use_charm_cache": False,
+
+# Memoize MCEqRun.solve() for identical configurations (matrices,
+# atmosphere, angle, initial condition and integration grid)
+"use_solution_cache": False,
+
+# Maximal number of solutions kept in memory by the solution cache
+"solution_cache_size": 32,
+
+# Directory (in data_dir) of the on-disk solution cache (None = memory only)
+"solution_cache_dir": 'solution_cache',
+
 # Ratio of decay_length/interaction_length where particle interactions
 # are neglected and the resonance approximation is used
 "hybrid_crossover": 0.05,
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""Instances of :class:`MCEq.core.MCEqRun` for tests, which only
+provide the layout of the state vector and a solution."""
+
+import numpy as np
+from types import InstanceType
+
+from MCEq.core import MCEqRun
+
+#: Species of :func:`partial_run`
+species = ['pr_mu+', 'pi_mu+', 'k_mu+', 'mu+', 'numu']
+
+
+class _Particle():
+
+    def __init__(self, name, lidx, d):
+        self.name, self._lidx, self._d = name, lidx, d
+
+    def lidx(self):
+        return self._lidx
+
+    def uidx(self):
+        return self._lidx + self._d
+
+
+class _Yields():
+
+    def __init__(self, e_bins):
+        self.e_bins = e_bins
+
+
+def partial_run(d=4, seed=1):
+    """Returns an :class:`MCEq.core.MCEqRun` without matrices, whose
+    state vector contains :data:`species` with ``d`` energies each and
+    a random solution."""
+    run = InstanceType(MCEqRun)
+    run.cname = 'MCEqRun'
+    run.d = d
+    run.cascade_particles = [_Particle(name, i * d, d)
+                             for i, name in enumerate(species)]
+    run.pname2pref = dict([(p.name, p) for p in run.cascade_particles])
+    run.dim_states = d * len(species)
+    e_bins = np.logspace(0., d, d + 1)
+    run.y = _Yields(e_bins)
+    run.e_grid = np.sqrt(e_bins[1:] * e_bins[:-1])
+    run._agg_ops = {}
+    run._e_grid_mag = {}
+    run._grid_idcs = None
+    run._grid_dtype = None
+    run._grid_agg_ops = {}
+    run.solution = np.random.RandomState(seed).rand(run.dim_states)
+    run.grid_sol = []
+    return run
+
+
+def species_slice(run, name):
+    """Returns the part of the solution, which belongs to a species."""
+    ref = run.pname2pref[name]
+    return run.solution[ref.lidx():ref.uidx()]
@@ -0,0 +1,377 @@
+# -*- coding: utf-8 -*-
+"""Tests of :mod:`MCEq.batch` with a stand-in for
+:class:`MCEq.core.MCEqRun`."""
+
+import unittest
+import multiprocessing
+import numpy as np
+from types import InstanceType
+from scipy.sparse import csr_matrix
+
+from mceq_config import config
+from MCEq import batch, results, data
+from MCEq.kernels import kern_numpy
+import MCEq.core
+
+
+class _Primary():
+    """Primary model, which scales the initial condition by its tag."""
+
+    def __init__(self, tag):
+        self.tag = tag
+
+
+class _FakeRun():
+    """Linear cascade of dimension 6 with two 'species' of 3 energies.
+
+    The step size of the integration path grows with the zenith angle.
+    """
+
+    def __init__(self, **kwargs):
+        rng = np.random.RandomState(1)
+        self.e_grid = np.logspace(0., 2., 3)
+        self.dim_states = 6
+        self.int_m = csr_matrix(-0.02 * np.eye(6) +
+                                0.01 * np.tril(rng.rand(6, 6), -1))
+        self.dec_m = csr_matrix(-0.01 * np.eye(6) +
+                                0.005 * np.triu(rng.rand(6, 6), 1))
+        self.yields_params = {}
+        self.atm_config = None
+        self.theta_deg = None
+        self.exact = None
+        self.theta_calls = []
+        self.integration_path = None
+        self.solve_calls = 0
+        self.set_primary_model(_Primary, 1.)
+
+    def set_interaction_model(self, interaction_model, charm_model=None):
+        if interaction_model == 'BROKEN':
+            raise ValueError('unknown interaction model')
+        self.yields_params = {'interaction_model': interaction_model,
+                              'charm_model': charm_model}
+
+    def set_atm_model(self, atm_config, update_theta=True):
+        if atm_config == 'BROKEN':
+            raise ValueError('unknown atmosphere')
+        self.atm_config = atm_config
+        if update_theta and self.theta_deg is not None:
+            self.set_theta_deg(self.theta_deg)
+
+    def set_theta_deg(self, theta_deg, exact=False):
+        self.theta_deg, self.exact = theta_deg, exact
+        self.theta_calls.append((theta_deg, exact))
+        self.integration_path = None
+
+    def set_primary_model(self, mclass, tag):
+        self.pmodel = mclass(tag)
+        self.get_nucleon_spectrum = self.pmodel.tag
+        self.phi0 = tag * np.arange(1., 7.)
+
+    def _calculate_integration_path(self, grid_var='X'):
+        nsteps = 40
+        self.integration_path = (
+            nsteps, np.ones(nsteps) * (1. + self.theta_deg / 90.),
+            np.ones(nsteps))
+
+    def solution_key(self, **kwargs):
+        return repr((self.atm_config, self.theta_deg, list(self.phi0),
+                     sorted(kwargs.items())))
+
+    def solve(self, **kwargs):
+        self.solve_calls += 1
+        self._calculate_integration_path()
+        nsteps, dX, rho_inv = self.integration_path
+        self.solution = kern_numpy(nsteps, dX, rho_inv, self.int_m,
+                                   self.dec_m, np.copy(self.phi0), [])[0]
+
+    def get_solutions(self, particle_names):
+        spectra = np.array([self.solution[:3], self.solution[3:]])
+        return spectra[:len(particle_names), None, :]
+
+
+class _CrossSections():
+
+    def set_interaction_model(self, interaction_model):
+        pass
+
+
+class _YieldRun(_FakeRun):
+    """Runs :func:`MCEq.core.MCEqRun.set_interaction_model` on an
+    :class:`MCEq.data.InteractionYields` with one interaction model,
+    whose interaction matrix is the sum of the yield matrices.
+    """
+
+    def __init__(self, **kwargs):
+        _FakeRun.__init__(self, **kwargs)
+        rng = np.random.RandomState(2)
+        y = InstanceType(data.InteractionYields)
+        y.iam, y.charm_model = None, None
+        y.data_e_grid = self.e_grid
+        y.yield_dict = {'X': {(2212, 211): rng.rand(6, 6),
+                              (2212, 421): np.ones((6, 6))}}
+        y.index = {'X': (np.array([2212]), {2212: [211, 421]},
+                         {(2212, 211): (0, 6, 0, 6),
+                          (2212, 421): (0, 6, 0, 6)})}
+        # The charm model triples the charm yields
+        y._gen_charm_blocks = lambda model: {(2212, 421): 3. * np.ones((6,
+                                                                        6))}
+        self.y, self.cs = y, _CrossSections()
+        self.cs_params = {}
+        self.particle_species = []
+        self.delay_pmod_init = False
+
+    def set_interaction_model(self, interaction_model, charm_model=None):
+        MCEq.core.MCEqRun.set_interaction_model.im_func(
+            self, interaction_model, charm_model)
+
+    def _init_Lambda_int(self):
+        pass
+
+    def _init_Lambda_dec(self):
+        pass
+
+    def _init_default_matrices(self):
+        self.int_m = csr_matrix(-0.02 * np.eye(6) + 0.001 * np.tril(
+            sum(self.y.yields.values()), -1))
+
+
+def _reference(theta_deg, tag):
+    run = _FakeRun()
+    run.set_theta_deg(theta_deg)
+    run.set_primary_model(_Primary, tag)
+    run.solve()
+    return run.solution
+
+
+class TestGrid(unittest.TestCase):
+
+    def test_expand_grid(self):
+        configs = batch.expand_grid(
+            {'theta_deg': [0., 30., 0.], 'primary_model': [1, 2]},
+            {'interaction_model': 'SIBYLL2.3', 'atm_model': 'atm'})
+        self.assertEqual(len(configs), 4)
+        self.assertEqual(configs[0], batch.BatchConfig(
+            'SIBYLL2.3', None, 'atm', 0., 1))
+        self.assertRaises(Exception, batch.expand_grid,
+                          {'theta_deg': [0.]})
+
+    def test_plan_batch(self):
+        configs = batch.expand_grid(
+            {'interaction_model': ['A', 'B'], 'theta_deg': [30., 0.],
+             'primary_model': [1, 2]}, {'atm_model': 'atm'})
+        plan = batch.plan_batch(configs)
+        self.assertEqual([models for models, _ in plan],
+                         [('A', None), ('B', None)])
+        self.assertEqual(plan[0][1], [('atm', 0., [1, 2]),
+                                      ('atm', 30., [1, 2])])
+
+
+class TestSolvePrimaries(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((k, config[k]) for k in ['kernel_config',
+                                                   'integrator',
+                                                   'use_solution_cache'])
+        config['kernel_config'] = 'numpy'
+        config['integrator'] = 'euler'
+        config['use_solution_cache'] = False
+        self.saved_cache = results._solution_cache
+        results._solution_cache = results.SolutionCache()
+        self.run = _FakeRun()
+        self.run.set_theta_deg(30.)
+        self.primaries = [(_Primary, 2.), (_Primary, 3.)]
+
+    def tearDown(self):
+        config.update(self.saved)
+        results._solution_cache = self.saved_cache
+
+    def _check(self, solutions):
+        for (_, tag), solution in zip(self.primaries, solutions):
+            self.assertTrue(np.allclose(solution, _reference(30., tag),
+                                        rtol=1e-12))
+        # The primary model of the instance is restored
+        self.assertEqual(self.run.pmodel.tag, 1.)
+        self.assertTrue(np.array_equal(self.run.phi0, np.arange(1., 7.)))
+
+    def test_multi_rhs(self):
+        self._check(batch.solve_primaries(self.run, self.primaries))
+        self.assertEqual(self.run.solve_calls, 0)
+
+    def test_other_kernels_use_solve(self):
+        config['kernel_config'] = 'MKL'
+        self._check(batch.solve_primaries(self.run, self.primaries))
+        self.assertEqual(self.run.solve_calls, 2)
+
+    def test_solve_kwargs_use_solve(self):
+        self._check(batch.solve_primaries(self.run, self.primaries,
+                                          {'int_grid': [1., 2.]}))
+        self.assertEqual(self.run.solve_calls, 2)
+
+    def test_solution_cache(self):
+        config['use_solution_cache'] = True
+        cache = results._solution_cache
+        self._check(batch.solve_primaries(self.run, self.primaries))
+        self.assertEqual(cache.stats()['misses'], 2)
+        self._check(batch.solve_primaries(self.run, self.primaries))
+        self.assertEqual(cache.stats()['hits'], 2)
+
+
+class TestRunBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((k, config[k]) for k in ['kernel_config',
+                                                   'integrator',
+                                                   'use_solution_cache'])
+        config['kernel_config'] = 'numpy'
+        config['integrator'] = 'euler'
+        config['use_solution_cache'] = False
+        self.grid = {'interaction_model': ['A', 'B'],
+                     'theta_deg': [0., 60.],
+                     'primary_model': [(_Primary, 1.), (_Primary, 2.)]}
+        self.kwargs = {'atm_model': 'atm'}
+
+    def tearDown(self):
+        config.update(self.saved)
+
+    def _check(self, res):
+        self.assertEqual(len(res['configs']), 8)
+        for cfg, flux in zip(res['configs'], res['fluxes']):
+            ref = _reference(cfg.theta_deg, cfg.primary_model[1])
+            self.assertTrue(np.allclose(flux[0], ref[:3], rtol=1e-12))
+            self.assertTrue(np.allclose(flux[1], ref[3:], rtol=1e-12))
+        self.assertTrue(np.array_equal(res['e_grid'], _FakeRun().e_grid))
+
+    def test_serial(self):
+        self._check(batch.run_batch(self.kwargs, self.grid, ['mu', 'numu'],
+                                    mceq_run=_FakeRun()))
+
+    def test_exact_angles(self):
+        run = _FakeRun()
+        run.set_theta_deg(30.)
+        self.grid['atm_model'] = ['atm', 'other']
+        del self.kwargs['atm_model']
+        plan = batch.plan_batch(batch.expand_grid(self.grid, self.kwargs))
+        batch.run_batch(self.kwargs, self.grid, ['mu', 'numu'],
+                        mceq_run=run)
+        # Each step sets up its angle once, changing the atmosphere not
+        self.assertEqual(run.theta_calls[1:],
+                         [(theta_deg, True) for _, steps in plan
+                          for _, theta_deg, _ in steps])
+
+    def test_charm_models_of_one_interaction_model(self):
+        saved_cache = dict(data._charm_cache)
+        data.clear_charm_cache(disk=False)
+        try:
+            self.grid.update({'interaction_model': ['X'],
+                              'charm_model': ['MRS', None]})
+            res = batch.run_batch(self.kwargs, self.grid, ['mu', 'numu'],
+                                  mceq_run=_YieldRun())
+            run = _YieldRun()
+            run.set_interaction_model('X')
+        finally:
+            data._charm_cache.clear()
+            data._charm_cache.update(saved_cache)
+
+        self.assertEqual(len(res['configs']), 8)
+        for cfg, flux in zip(res['configs'], res['fluxes']):
+            if cfg.charm_model is not None:
+                continue
+            run.set_theta_deg(cfg.theta_deg)
+            run.set_primary_model(*cfg.primary_model)
+            run.solve()
+            self.assertTrue(np.allclose(flux, run.get_solutions(
+                ['mu', 'numu'])[:, 0], rtol=1e-12))
+
+    def test_empty_grid(self):
+        self.grid['theta_deg'] = []
+        res = batch.run_batch(self.kwargs, self.grid, ['mu', 'numu'],
+                              mceq_run=_FakeRun())
+        self.assertEqual(res['configs'], [])
+        self.assertEqual(res['fluxes'].shape, (0, 2, 3))
+
+    def test_pool(self):
+        saved_run = MCEq.core.MCEqRun
+        MCEq.core.MCEqRun = _FakeRun
+        try:
+            self._check(batch.run_batch(self.kwargs, self.grid,
+                                        ['mu', 'numu'], n_workers=2))
+            self.grid['interaction_model'].append('BROKEN')
+            self.assertRaises(ValueError, batch.run_batch, self.kwargs,
+                              self.grid, ['mu', 'numu'], n_workers=2)
+        finally:
+            MCEq.core.MCEqRun = saved_run
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+class TestAverageFlux(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((k, config[k]) for k in ['use_solution_cache'])
+        config['use_solution_cache'] = False
+
+    def tearDown(self):
+        config.update(self.saved)
+
+    def test_gauss_cos_theta(self):
+        nodes, weights = batch.gauss_cos_theta(4, (0.2, 1.))
+        self.assertAlmostEqual(np.sum(weights), 1.)
+        self.assertTrue(np.all((nodes > 0.2) & (nodes < 1.)))
+        # Exact for polynomials of degree 2 * n_nodes - 1
+        self.assertAlmostEqual(np.sum(weights * nodes ** 7),
+                               (1. - 0.2 ** 8) / 8. / 0.8)
+
+    def test_month_weights(self):
+        weights = batch.month_weights('MSIS00', 'Karlsruhe')
+        self.assertEqual(len(weights), 12)
+        self.assertEqual(weights[1], (('MSIS00', 'Karlsruhe', 'February'),
+                                      28.))
+        self.assertEqual(sum([w for _, w in weights]), 365.)
+
+    def _reference(self, nodes, weights, atm_weights):
+        norm = np.sum(weights) * sum([w for _, w in atm_weights])
+        ref = 0.
+        for _, w_atm in atm_weights:
+            for c, w in zip(nodes, weights):
+                sol = _reference(np.degrees(np.arccos(c)), 1.)
+                ref = ref + w_atm * w / norm * np.array([sol[:3], sol[3:]])
+        return ref
+
+    def test_serial(self):
+        run = _FakeRun()
+        atm_weights = [('a', 31.), ('b', 28.)]
+        res = batch.average_flux({}, ['mu', 'numu'], cos_theta=3,
+                                 atm_weights=atm_weights, mceq_run=run)
+        nodes, weights = batch.gauss_cos_theta(3)
+        self.assertTrue(np.allclose(res['flux'],
+                                    self._reference(nodes, weights,
+                                                    atm_weights),
+                                    rtol=1e-12))
+        self.assertTrue(run.exact)
+        self.assertRaises(Exception, batch.average_flux, {}, ['mu'],
+                          atm_weights=[], mceq_run=run)
+        self.assertRaises(Exception, batch.average_flux, {}, ['mu'],
+                          cos_theta=([-0.5], [1.]), atm_weights=atm_weights,
+                          mceq_run=run)
+
+    def test_pool(self):
+        saved_run = MCEq.core.MCEqRun
+        MCEq.core.MCEqRun = _FakeRun
+        try:
+            nodes, weights = [0.3, 0.9], [1., 3.]
+            res = batch.average_flux({'atm_model': 'a'}, ['mu', 'numu'],
+                                     cos_theta=(nodes, weights),
+                                     n_workers=2)
+            self.assertTrue(np.allclose(
+                res['flux'], self._reference(nodes, weights, [('a', 1.)]),
+                rtol=1e-12))
+            self.assertRaises(ValueError, batch.average_flux, {},
+                              ['mu', 'numu'], cos_theta=(nodes, weights),
+                              atm_weights=[('a', 1.), ('BROKEN', 1.)],
+                              n_workers=2)
+        finally:
+            MCEq.core.MCEqRun = saved_run
+        self.assertEqual(multiprocessing.active_children(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
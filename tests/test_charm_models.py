@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""Tests of the vectorized :class:`MCEq.charm_models.MRS_charm`."""
+
+import unittest
+import numpy as np
+from scipy.integrate import quad
+
+from MCEq.charm_models import MRS_charm
+
+
+class _CrossSections():
+
+    def __init__(self, e_grid):
+        self.e_grid = e_grid
+
+    def get_cs(self, pdg, mbarn=False):
+        return 250. + 10. * np.log(self.e_grid)
+
+
+def _dsig_dx(x, E):
+    """Scalar reference of :func:`MRS_charm.dsig_dx`."""
+    if E < 1e4 or x <= 0.01 or x >= 0.7:
+        return 0.
+    beta = 0.05 - 0.016 * np.log(E / 10e4)
+    if E < 1e8:
+        n = 7.6 + 0.025 * np.log(E / 1e4)
+        A = 140 + (11. * np.log(E / 1e2)) ** 1.65
+    else:
+        n = 7.6 + 0.012 * np.log(E / 1e4)
+        A = 4100. + 245. * np.log(E / 1e8)
+    return A * x ** (beta - 1.) * (1 - x ** 1.2) ** n / 1e3
+
+
+class TestMRSCharm(unittest.TestCase):
+
+    def setUp(self):
+        self.e_grid = np.logspace(3., 10., 15)
+        self.mrs = MRS_charm(self.e_grid, _CrossSections(self.e_grid))
+
+    def test_dsig_dx(self):
+        x = np.array([0.005, 0.05, 0.3, 0.69, 0.8])
+        E = np.array([1e3, 1e5, 1e9])
+        res = self.mrs.dsig_dx(x[:, np.newaxis], E)
+        self.assertEqual(res.shape, (5, 3))
+        for i, xi in enumerate(x):
+            for j, Ej in enumerate(E):
+                self.assertAlmostEqual(res[i, j], _dsig_dx(xi, Ej),
+                                       delta=1e-12 * res.max())
+        self.assertRaises(Exception, self.mrs.dsig_dx, 0.3, 2e11)
+
+    def test_sigma_cc(self):
+        E = np.array([1e5, 1e7, 1e9])
+        res = self.mrs.sigma_cc(E)
+        for Ei, sig in zip(E, res):
+            ref = 2 * quad(_dsig_dx, 0.05, 0.6, args=(Ei,))[0]
+            self.assertAlmostEqual(sig / ref, 1., places=6)
+        self.assertTrue(isinstance(self.mrs.sigma_cc(1e7), float))
+
+    def test_yield_matrix(self):
+        siginel = _CrossSections(self.e_grid).get_cs(2212)
+        for sec, dist in [(421, lambda x, e: self.mrs.D_dist(x, e, 421)),
+                          (-4122, self.mrs.LambdaC_dist)]:
+            mat = self.mrs.get_yield_matrix(-2212, sec)
+            for i, e in enumerate(self.e_grid):
+                ref = dist(self.e_grid / e, e) / e / siginel[i]
+                self.assertTrue(np.allclose(mat[:, i], ref, rtol=1e-12))
+        self.assertTrue(self.mrs.get_yield_matrix(211, 4122) is
+                        self.mrs.no_prod)
+        self.assertTrue(self.mrs.get_yield_matrix(22, 421) is
+                        self.mrs.no_prod)
+
+    def test_yield_matrices_shared(self):
+        yields = self.mrs.get_yield_matrices([2212, 211], [421, -421, 4122])
+        self.assertEqual(len(yields), 6)
+        self.assertTrue(yields[(2212, 421)] is yields[(211, -421)])
+        self.assertTrue(yields[(211, 4122)] is self.mrs.no_prod)
+        self.assertTrue(np.array_equal(yields[(2212, 4122)],
+                                       self.mrs.get_yield_matrix(2212, 4122)))
+
+
+if __name__ == '__main__':
+    unittest.main()
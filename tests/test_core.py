@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Tests of the retrieval of solutions from :class:`MCEq.core.MCEqRun`."""
+
+import unittest
+import numpy as np
+
+from tests.helpers import partial_run, species_slice
+
+
+class TestGetSolutions(unittest.TestCase):
+
+    def setUp(self):
+        self.run = partial_run()
+        self.total = sum([species_slice(self.run, name) for name in
+                          ['pr_mu+', 'pi_mu+', 'k_mu+', 'mu+']])
+        self.conv = self.total - species_slice(self.run, 'pr_mu+')
+
+    def test_get_solution(self):
+        run = self.run
+        self.assertTrue(np.allclose(run.get_solution('numu'),
+                                    species_slice(run, 'numu')))
+        self.assertTrue(np.allclose(run.get_solution('total_mu+', mag=2.),
+                                    self.total * run.e_grid ** 2))
+        self.assertTrue(np.allclose(run.get_solution('conv_mu+'),
+                                    self.conv))
+        self.assertTrue(run._get_agg_operator('total_mu+') is
+                        run._get_agg_operator('total_mu+'))
+
+    def test_get_solutions(self):
+        run = self.run
+        res = run.get_solutions(['numu', 'total_mu+'], mag=1.)
+        self.assertEqual(res.shape, (2, 1, run.d))
+        self.assertTrue(np.allclose(res[1, 0], self.total * run.e_grid))
+
+        run.grid_sol = [0.5 * run.solution, 0.25 * run.solution]
+        res = run.get_solutions(['numu', 'conv_mu+'], grid_idcs=[1, None])
+        self.assertEqual(res.shape, (2, 2, run.d))
+        self.assertTrue(np.allclose(res[1, 0], 0.25 * self.conv))
+        self.assertTrue(np.allclose(res[1, 1], self.conv))
+        self.assertTrue(np.allclose(res[0, 0],
+                                    run.get_solution('numu', grid_idx=1)))
+
+
+    def test_reduced_grid_solutions(self):
+        from MCEq.output import ListSink
+
+        run = self.run
+        states = [0.5 * run.solution, -1e-20 * run.solution]
+        for dtype in [None, 'float32', 'log16']:
+            run._set_grid_layout(['conv_mu+'], dtype)
+            sink = ListSink(run._grid_idcs, dtype)
+            for grid_step, phi in enumerate(states):
+                sink.push(grid_step, phi)
+            run.grid_sol = sink.result()
+            self.assertEqual(len(run.grid_sol[0]), 3 * run.d)
+
+            res = run.get_solutions(['conv_mu+', 'k_mu+'],
+                                    grid_idcs=[0, 1, None])
+            rtol = {None: 1e-12, 'float32': 1e-6, 'log16': 1e-2}[dtype]
+            self.assertTrue(np.allclose(res[0, 0], 0.5 * self.conv,
+                                        rtol=rtol))
+            self.assertTrue(np.allclose(res[0, 2], self.conv))
+            # Negative states decode to zero in log16, never to NaN
+            self.assertTrue(np.allclose(res[:, 1], 0., atol=1e-18))
+            self.assertRaises(Exception, run.get_solution, 'numu',
+                              grid_idx=0)
+
+
+class TestObservationLevels(unittest.TestCase):
+
+    def test_add_obs_levels(self):
+        from mceq_config import config
+        from MCEq.output import ListSink
+        from MCEq.density_profiles import get_atmosphere
+
+        use_atm_cache = config['use_atm_cache']
+        config['use_atm_cache'] = False
+        try:
+            run = partial_run()
+            run.atm_model = get_atmosphere(('CORSIKA', 'BK_USStd', None))
+            run.atm_model.set_theta(30.)
+            int_grid = [10., 500., 1000.]
+            merged, sink = run._add_obs_levels([20e3, 5e3], int_grid,
+                                               ListSink())
+        finally:
+            config['use_atm_cache'] = use_atm_cache
+
+        X_obs = run.atm_model.slant_depth_at_heights([20e3 * 1e2,
+                                                      5e3 * 1e2])
+        self.assertTrue(np.allclose(np.sort(merged),
+                                    np.sort(np.append(int_grid, X_obs))))
+        self.assertTrue(np.all(np.diff(merged) >= 0.))
+        self.assertTrue(np.all(run.obs_theta_deg < 30.))
+
+        for grid_step, X in enumerate(merged):
+            sink.push(grid_step, X * np.ones(run.dim_states))
+        self.assertEqual([phi[0] for phi in sink.result()], int_grid)
+        self.assertTrue(np.allclose([phi[0] for phi in sink.obs_sol],
+                                    X_obs))
+
+
+if __name__ == '__main__':
+    unittest.main()
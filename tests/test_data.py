@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""Tests of the index of the yield and decay files and the shared data
+registry, the cache of injected charm yields and the rebinning of the
+energy grid in :mod:`MCEq.data`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import cPickle as pickle
+from glob import glob
+from os.path import join
+import numpy as np
+from types import InstanceType
+
+from mceq_config import config
+from MCEq import data
+
+
+class TestYieldIndex(unittest.TestCase):
+
+    def test_nonzero_band(self):
+        mat = np.zeros((5, 6))
+        self.assertEqual(data._nonzero_band(mat), None)
+        mat[1, 4] = 1.
+        mat[3, 2] = 2.
+        self.assertEqual(data._nonzero_band(mat), (1, 4, 2, 5))
+
+    def test_in_band(self):
+        band = (1, 4, 2, 5)
+        self.assertTrue(data._in_band(band, (0, 2), (4, 6)))
+        self.assertFalse(data._in_band(band, (4, 6), (0, 6)))
+        self.assertFalse(data._in_band(band, (0, 6), (0, 2)))
+        self.assertFalse(data._in_band(None, (0, 6), (0, 6)))
+
+    def test_gen_yield_index(self):
+        full = np.ones((3, 3))
+        mat_dict = {(211, 13): full, (211, 22): full,
+                    (211, 14): np.zeros((3, 3)), (321, 211): full}
+        mothers, daughters, bands = data._gen_yield_index(
+            mat_dict, excl_daughters=[22])
+        self.assertEqual(list(mothers), [211, 321])
+        self.assertEqual(daughters[211], [13])
+        self.assertEqual(daughters[321], [211])
+        self.assertEqual(bands[(211, 22)], (0, 3, 0, 3))
+        self.assertFalse((211, 14) in bands)
+
+    def test_load_index_regenerates_on_change(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmp_dir, 'yields.ppd')
+            with open(fname, 'wb') as f:
+                pickle.dump({'a': 1}, f)
+            calls = []
+
+            def gen_index():
+                calls.append(None)
+                return len(calls)
+
+            self.assertEqual(data._load_index(fname, gen_index), 1)
+            self.assertTrue(os.path.isfile(
+                os.path.join(tmp_dir, 'yields_index.ppd')))
+            # Stored index is reused
+            self.assertEqual(data._load_index(fname, gen_index), 1)
+            # Modified data file invalidates the index
+            with open(fname, 'wb') as f:
+                pickle.dump({'a': 2}, f)
+            self.assertEqual(data._load_index(fname, gen_index), 2)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestRebin(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        y = InstanceType(data.InteractionYields)
+        y.data_e_bins = np.logspace(0., 7., 8)
+        y.data_e_grid = np.sqrt(y.data_e_bins[1:] * y.data_e_bins[:-1])
+        y.data_weights = np.diag(np.diff(y.data_e_bins))
+        mat = np.tril(rng.rand(7, 7))
+        mat[:, :3] = 0.
+        y.yields = {(2212, 211): mat}
+        y.band_dict = {(2212, 211): data._nonzero_band(mat)}
+        y.band = None
+        self.y = y
+
+    def test_operators(self):
+        widths = np.diff(self.y.data_e_bins)
+        R, P = data._rebin_operators(widths, 3)
+        self.assertEqual(R.shape, (3, 7))
+        self.assertTrue(np.allclose(R.dot(P), np.eye(3)))
+        # The number of particles is conserved
+        spec = np.arange(1., 8.)
+        coarse_widths = P.T.dot(widths)
+        self.assertAlmostEqual(np.dot(coarse_widths, R.dot(spec)),
+                               np.dot(widths, spec))
+
+    def test_rebin_yields(self):
+        fine = self.y
+        fine.rebin(1)
+        m_fine = fine.get_y_matrix(2212, 211)
+
+        coarse = InstanceType(data.InteractionYields)
+        coarse.__dict__.update(fine.__dict__)
+        coarse.rebin(3)
+        self.assertTrue(np.array_equal(coarse.e_bins,
+                                       fine.data_e_bins[[0, 3, 6, 7]]))
+        self.assertEqual(coarse.dim, 3)
+        m = coarse.get_y_matrix(2212, 211)
+        self.assertEqual(m.shape, (3, 3))
+
+        # Same number of secondaries from a spectrum, which is constant
+        # within the coarse bins
+        spec = np.array([3., 2., 1.])
+        self.assertAlmostEqual(
+            np.dot(np.diag(coarse.weights), m.dot(spec)),
+            np.dot(np.diag(fine.weights),
+                   m_fine.dot(coarse.to_data_grid(spec))))
+
+        band = data._nonzero_band(m)
+        self.assertEqual(data._rebin_band(fine.band_dict[(2212, 211)], 3),
+                         band)
+        self.assertEqual(band, (1, 3, 1, 3))
+        self.assertTrue(coarse.is_yield_block(2212, (1, 3), 211, (1, 2)))
+        self.assertFalse(coarse.is_yield_block(2212, (0, 1), 211, (0, 3)))
+
+        coarse.rebin(1)
+        self.assertTrue(np.array_equal(coarse.get_y_matrix(2212, 211),
+                                       m_fine))
+
+
+class TestDataRegistry(unittest.TestCase):
+
+    def test_acquire_release(self):
+        registry = data.DataRegistry()
+        calls = []
+
+        def loader():
+            calls.append(None)
+            return {'n': len(calls)}
+
+        obj = registry.acquire(('a',), loader)
+        self.assertTrue(registry.acquire(('a',), loader) is obj)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(registry.refcount(('a',)), 2)
+
+        registry.release(('a',))
+        self.assertEqual(registry.refcount(('a',)), 1)
+        registry.release(('a',))
+        self.assertEqual(registry.refcount(('a',)), 0)
+        # Unknown keys are ignored
+        registry.release(('a',))
+
+        # Dropped objects are loaded again
+        self.assertEqual(registry.acquire(('a',), loader), {'n': 2})
+        registry.clear()
+        self.assertEqual(registry.refcount(('a',)), 0)
+
+    def test_failed_instance_releases(self):
+        load_yield_file = data._load_yield_file
+        e_bins = np.logspace(0., 3., 4)
+        data._load_yield_file = lambda fname: (
+            {'A': {}}, np.sqrt(e_bins[1:] * e_bins[:-1]), e_bins,
+            {'A': (np.array([]), {}, {})})
+        key = ('InteractionYields',
+               join(config['data_dir'], config['yield_fname']))
+        try:
+            self.assertEqual(data.InteractionYields('A').iam, 'A')
+            try:
+                data.InteractionYields('B')
+            except Exception:
+                # Released, while the traceback still references the
+                # instance
+                self.assertEqual(data.data_registry.refcount(key), 0)
+            else:
+                self.fail('unknown interaction model accepted')
+        finally:
+            data._load_yield_file = load_yield_file
+            data.data_registry.release(key)
+
+    def test_shared_cross_sections(self):
+        cross_sections = data.HadAirCrossSections
+        data.HadAirCrossSections = lambda interaction_model: [
+            interaction_model]
+        key = ('HadAirCrossSections',
+               join(config['data_dir'], config['cs_fname']), 'X')
+        try:
+            with data.shared_cross_sections('X') as cs:
+                self.assertEqual(cs, ['X'])
+                self.assertEqual(data.data_registry.refcount(key), 1)
+            self.assertEqual(data.data_registry.refcount(key), 0)
+
+            def fail():
+                with data.shared_cross_sections('X'):
+                    raise ValueError('failed')
+
+            self.assertRaises(ValueError, fail)
+            self.assertEqual(data.data_registry.refcount(key), 0)
+        finally:
+            data.HadAirCrossSections = cross_sections
+
+
+class TestCharmCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved = dict((k, config[k]) for k in ['data_dir',
+                                                   'use_charm_cache'])
+        config['data_dir'] = self.tmp_dir
+        config['use_charm_cache'] = True
+        data.clear_charm_cache(disk=False)
+        self.calls = []
+
+    def tearDown(self):
+        data.clear_charm_cache(disk=False)
+        config.update(self.saved)
+        shutil.rmtree(self.tmp_dir)
+
+    def _yields(self):
+        """Returns :class:`MCEq.data.InteractionYields` with two
+        matrices and a charm model, which replaces one of them."""
+        y = InstanceType(data.InteractionYields)
+        y.iam, y.charm_model = 'SIBYLL2.3', None
+        y.data_e_grid = np.logspace(0., 2., 3)
+        y.yields = {(2212, 211): np.eye(3), (2212, 421): np.eye(3)}
+        y.secondary_dict = {2212: [211, 421]}
+        y.band_dict = {(2212, 211): (0, 3, 0, 3), (2212, 421): (0, 3, 0, 3)}
+        y.projectiles = np.array([2212])
+
+        def gen_charm_blocks(model):
+            self.calls.append(model)
+            mat = np.zeros((3, 3))
+            mat[2, 1] = 1.
+            return {(2212, 421): mat, (2212, 411): np.zeros((3, 3))}
+
+        y._gen_charm_blocks = gen_charm_blocks
+        return y
+
+    def _check(self, y):
+        self.assertEqual(y.charm_model, 'MRS')
+        self.assertEqual(y.yields[(2212, 421)][2, 1], 1.)
+        self.assertEqual(y.band_dict[(2212, 421)], (2, 3, 1, 2))
+        self.assertFalse((2212, 411) in y.band_dict)
+        self.assertEqual(sorted(y.secondary_dict[2212]), [211, 421])
+
+    def test_memory_and_disk_cache(self):
+        y = self._yields()
+        shared = y.yields
+        y.inject_custom_charm_model('MRS')
+        self._check(y)
+        # The original yield dict is not modified
+        self.assertEqual(shared[(2212, 421)][0, 0], 1.)
+        self.assertEqual(len(glob(join(self.tmp_dir,
+                                       'charm_cache_*.ppd'))), 1)
+        self.assertEqual(glob(join(self.tmp_dir, '*.tmp')), [])
+
+        y = self._yields()
+        y.inject_custom_charm_model('MRS')
+        self._check(y)
+        data.clear_charm_cache(disk=False)
+        y = self._yields()
+        y.inject_custom_charm_model('MRS')
+        self._check(y)
+        self.assertEqual(self.calls, ['MRS'])
+
+        data.clear_charm_cache()
+        self.assertEqual(glob(join(self.tmp_dir, 'charm_cache_*.ppd')), [])
+        self._yields().inject_custom_charm_model('MRS')
+        self.assertEqual(self.calls, ['MRS', 'MRS'])
+
+    def test_energy_grid_in_key(self):
+        self._yields().inject_custom_charm_model('MRS')
+        y = self._yields()
+        y.data_e_grid = 2. * y.data_e_grid
+        y.inject_custom_charm_model('MRS')
+        self.assertEqual(len(self.calls), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
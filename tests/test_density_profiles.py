@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""Tests of the atmosphere models and caches in
+:mod:`MCEq.density_profiles`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from scipy.interpolate import PPoly
+
+from mceq_config import config
+from MCEq import density_profiles as dp
+
+
+def _failing_entry(args):
+    raise ValueError('worker failed')
+
+
+class TestSplineCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved = dict((k, config[k]) for k in ['data_dir',
+                                                   'atm_cache_dir',
+                                                   'use_atm_cache'])
+        config['data_dir'] = self.tmp_dir
+        config['atm_cache_dir'] = 'atm_cache'
+        config['use_atm_cache'] = True
+        self.spline = PPoly(np.array([[1., 2.], [3., 4.]]),
+                            np.array([0., 1., 2.]))
+
+    def tearDown(self):
+        config.update(self.saved)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_dump_load(self):
+        key = ('CorsikaAtmosphere', 'South Pole', 'June')
+        dp._dump_cache(key, 30., 1234.5, self.spline)
+        dp._dump_cache(key + ('x',), 30.2, 1., self.spline)
+        # One file per entry and no temporary files
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(self.tmp_dir, 'atm_cache'))),
+            sorted([os.path.basename(dp._cache_fname(key, 30.)),
+                    os.path.basename(dp._cache_fname(key + ('x',), 30.2))]))
+
+        theta_deg, X_surf, spline = dp._load_cache(key, 30.)
+        self.assertEqual((theta_deg, X_surf), (30., 1234.5))
+        self.assertTrue(np.array_equal(spline.c, self.spline.c))
+        self.assertTrue(np.array_equal(spline.x, self.spline.x))
+
+        # Closest angle within 1 degree of the same atmosphere
+        self.assertEqual(dp._load_cache(key, 30.9)[0], 30.)
+        self.assertEqual(dp._load_cache(key, 31.), None)
+        self.assertEqual(dp._load_cache(key, 30.2)[0], 30.)
+        self.assertEqual(dp._load_cache(('CorsikaAtmosphere',), 30.), None)
+
+    def test_unreadable_entry(self):
+        key = ('CorsikaAtmosphere', 'SouthPole', 'June')
+        os.makedirs(os.path.join(self.tmp_dir, 'atm_cache'))
+        with open(dp._cache_fname(key, 30.), 'w') as f:
+            f.write('truncated')
+        self.assertEqual(dp._load_cache(key, 30.), None)
+
+    def test_set_theta_uses_cache(self):
+        atm = dp.get_atmosphere(('CORSIKA', 'BK_USStd', None))
+        atm.set_theta(45.)
+        cached = dp.get_atmosphere(('CORSIKA', 'BK_USStd', None))
+        calculate_density_spline = cached.calculate_density_spline
+        cached.calculate_density_spline = None
+        try:
+            cached.set_theta(45.)
+        finally:
+            cached.calculate_density_spline = calculate_density_spline
+        self.assertEqual(cached.X_surf, atm.X_surf)
+        X = np.linspace(0., atm.X_surf, 11)
+        self.assertTrue(np.array_equal(cached.r_X2rho(X), atm.r_X2rho(X)))
+
+
+class TestPrecomputeAtmospheres(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved = dict((k, config[k]) for k in ['data_dir',
+                                                   'atm_cache_dir'])
+        config['data_dir'] = self.tmp_dir
+        config['atm_cache_dir'] = 'atm_cache'
+        os.makedirs(os.path.join(self.tmp_dir, 'atm_cache'))
+
+    def tearDown(self):
+        config.update(self.saved)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pool_fills_cache(self):
+        atm_config = ('CORSIKA', 'BK_USStd', None)
+        timing = dp.precompute_atmospheres([atm_config], [0., 60.],
+                                           n_workers=2)
+        self.assertEqual(sorted(timing.keys()),
+                         [(atm_config, 0.), (atm_config, 60.)])
+        self.assertTrue(all(t is not None for t in timing.values()))
+
+        key = dp.get_atmosphere(atm_config)._cache_key()
+        theta_deg, X_surf, spline = dp._load_cache(key, 60.)
+        self.assertEqual(theta_deg, 60.)
+        self.assertTrue(X_surf > 0.)
+
+        # Entries in the cache are skipped
+        timing = dp.precompute_atmospheres([atm_config], [60.],
+                                           n_workers=2)
+        self.assertEqual(timing, {(atm_config, 60.): None})
+
+    def test_exact_cache_lookup(self):
+        atm_config = ('CORSIKA', 'BK_USStd', None)
+        dp.precompute_atmospheres([atm_config], [60.], n_workers=1)
+        key = dp.get_atmosphere(atm_config)._cache_key()
+        self.assertEqual(dp._load_cache(key, 60.5)[0], 60.)
+        self.assertEqual(dp._load_cache(key, 60.5, exact=True), None)
+
+        atm = dp.get_atmosphere(atm_config)
+        atm.set_theta(60.5, exact=True)
+        self.assertEqual(atm.theta_deg, 60.5)
+        self.assertEqual(dp._load_cache(key, 60.5, exact=True)[0], 60.5)
+
+    def test_worker_exception_propagates(self):
+        precompute_entry = dp._precompute_entry
+        dp._precompute_entry = _failing_entry
+        try:
+            self.assertRaises(ValueError, dp.precompute_atmospheres,
+                              [('CORSIKA', 'BK_USStd', None)], [0., 30.],
+                              n_workers=2)
+        finally:
+            dp._precompute_entry = precompute_entry
+
+
+class _FakeMSIS():
+    """Stand-in for the NRLMSISE-00 wrapper with an exponential profile."""
+
+    class input():
+        doy = 1
+        sec = 43200.
+
+    def get_density_profile(self, h_cm):
+        return 1.2e-3 * np.exp(-np.asarray(h_cm) / 8e5)
+
+
+class TestMSIS00Table(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved = dict((k, config[k]) for k in ['data_dir',
+                                                   'atm_cache_dir',
+                                                   'use_atm_cache'])
+        self.h_atm = dp.geom.h_atm
+        config['data_dir'] = self.tmp_dir
+        config['atm_cache_dir'] = 'atm_cache'
+        config['use_atm_cache'] = True
+        os.makedirs(os.path.join(self.tmp_dir, 'atm_cache'))
+
+    def tearDown(self):
+        config.update(self.saved)
+        dp.geom.h_atm = self.h_atm
+        shutil.rmtree(self.tmp_dir)
+
+    def _atmosphere(self):
+        # The NRLMSISE-00 library is not needed for the table cache
+        atm = dp.MSIS00Atmosphere.__new__(dp.MSIS00Atmosphere)
+        atm.msis = _FakeMSIS()
+        atm.location, atm.season = 'SouthPole', 'January'
+        atm._h_table, atm._log_rho_table = None, None
+        return atm
+
+    def test_table_cached_per_height_range(self):
+        atm = self._atmosphere()
+        atm._tabulate()
+        self.assertTrue(os.path.isfile(atm._table_fname()))
+        self.assertTrue(atm._h_table[-1] >= dp.geom.h_atm)
+
+        dp.geom.h_atm = 2. * self.h_atm
+        atm = self._atmosphere()
+        self.assertFalse(os.path.isfile(atm._table_fname()))
+        atm._tabulate()
+        self.assertTrue(atm._h_table[-1] >= 2. * self.h_atm)
+        self.assertAlmostEqual(atm.get_density(1.5 * self.h_atm),
+                               1.2e-3 * np.exp(-1.5 * self.h_atm / 8e5),
+                               delta=1e-3 * atm.get_density(
+                                   1.5 * self.h_atm))
+
+
+class _ExpAtmosphere(dp.CascadeAtmosphere):
+    """Isothermal atmosphere with scale height ``H``."""
+
+    location, season = 'Exponential', None
+    rho0, H = 1.2e-3, 8e5
+
+    def get_density(self, h_cm):
+        return self.rho0 * np.exp(-np.asarray(h_cm) / self.H)
+
+
+class TestSlantDepth(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((k, config[k]) for k in ['use_atm_cache'])
+        config['use_atm_cache'] = False
+        self.atm = _ExpAtmosphere()
+
+    def tearDown(self):
+        config.update(self.saved)
+
+    def test_vertical(self):
+        atm = self.atm
+        atm.thrad, atm.theta_deg = 0., 0.
+        dl_vec = np.linspace(0., dp.geom.l(0.), 50)
+        X, X_err = atm.calculate_slant_depth(dl_vec)
+        h_cm = dp.geom.h(dl_vec, 0.)
+        ref = atm.rho0 * atm.H * (np.exp(-h_cm / atm.H) -
+                                  np.exp(-dp.geom.h_atm / atm.H))
+        self.assertTrue(np.allclose(X, ref, rtol=1e-10, atol=0.))
+        self.assertTrue(X_err < 1e-8 * X[-1])
+
+    def test_density_spline(self):
+        atm = self.atm
+        atm.set_theta(60.)
+        dl_vec = np.linspace(0., dp.geom.l(atm.thrad), 7)
+        X = atm.calculate_slant_depth(dl_vec)[0]
+        self.assertAlmostEqual(atm.X_surf / X[-1], 1., places=10)
+        self.assertTrue(np.allclose(
+            atm.X2rho(X), atm.get_density(dp.geom.h(dl_vec, atm.thrad)),
+            rtol=1e-4))
+
+
+class TestCorsikaSpline(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((k, config[k]) for k in ['use_atm_cache'])
+        config['use_atm_cache'] = False
+        self.atm = dp.get_atmosphere(('CORSIKA', 'BK_USStd', None))
+
+    def tearDown(self):
+        config.update(self.saved)
+
+    def test_vertical(self):
+        atm = self.atm
+        atm.set_theta(0.)
+        self.assertAlmostEqual(atm.X_surf / atm.height2depth(dp.geom.h_obs),
+                               1., places=5)
+        # Layer boundaries of the parameterization are at 4, 10 and 40 km
+        h_cm = np.array([1e5, 4e5, 4.01e5, 1e6, 2e6, 4e6, 5e6, 1e7])
+        X = atm.X_surf - atm.height2depth(dp.geom.h_obs) + \
+            atm.height2depth(h_cm)
+        self.assertTrue(np.allclose(atm.X2rho(X), atm.get_density(h_cm),
+                                    rtol=1e-8))
+
+    def test_inclined(self):
+        atm = self.atm
+        atm.set_theta(85.)
+        # Fine reference, which is not split at the layer boundaries
+        dl_vec = np.linspace(0., dp.geom.l(atm.thrad), 20001)
+        X = atm.calculate_slant_depth(dl_vec, n_nodes=16)[0]
+        dl_vec, X = dl_vec[::1000], X[::1000]
+        self.assertAlmostEqual(atm.X_surf / X[-1], 1., places=8)
+        self.assertTrue(np.allclose(
+            atm.X2rho(X[1:]), atm.get_density(dp.geom.h(dl_vec[1:],
+                                                         atm.thrad)),
+            rtol=1e-6))
+
+
+class TestCorsikaArrays(unittest.TestCase):
+
+    def setUp(self):
+        self.atm = dp.get_atmosphere(('CORSIKA', 'BK_USStd', None))
+        self.h_cm = np.array([[0., 2e5, 4e5], [1e6, 4e6, 1.1e7]])
+
+    def test_density(self):
+        rho = self.atm.get_density(self.h_cm)
+        self.assertEqual(rho.shape, (2, 3))
+        for h, r in zip(self.h_cm.ravel(), rho.ravel()):
+            self.assertEqual(self.atm.get_density(h), r)
+
+    def test_depth_conversion(self):
+        X_v = self.atm.height2depth(self.h_cm)
+        h_cm = self.atm.depth2height(X_v)
+        self.assertEqual(X_v.shape, (2, 3))
+        for h, x, h_inv in zip(self.h_cm.ravel(), X_v.ravel(),
+                               h_cm.ravel()):
+            self.assertEqual(self.atm.height2depth(h), x)
+            self.assertEqual(self.atm.depth2height(x), h_inv)
+        self.assertTrue(np.allclose(h_cm.ravel()[1:],
+                                    self.h_cm.ravel()[1:], rtol=1e-8))
+
+    def test_rho_inv(self):
+        X = np.array([1., 100., 500., 1000.])
+        res = self.atm.rho_inv(X, 0.5)
+        for Xi, r in zip(X, res):
+            self.assertEqual(self.atm.rho_inv(Xi, 0.5), r)
+        self.assertTrue(np.allclose(
+            1. / res, self.atm.get_density(self.atm.depth2height(0.5 * X)),
+            rtol=1e-12))
+
+
+class TestTabulatedAtmosphere(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((k, config[k]) for k in ['use_atm_cache'])
+        config['use_atm_cache'] = False
+        # Exponential profile with a change of the scale height at 10 km
+        self.h_cm = np.linspace(0., 1.2e7, 25)
+        self.rho = self._density(self.h_cm)
+
+    def tearDown(self):
+        config.update(self.saved)
+
+    def _density(self, h_cm):
+        return np.where(h_cm < 1e6, 1.2e-3 * np.exp(-h_cm / 8e5),
+                        1.2e-3 * np.exp(-1e6 / 8e5 - (h_cm - 1e6) / 6e5))
+
+    def _depth(self, h_cm):
+        X_top = 1.2e-3 * np.exp(-1e6 / 8e5) * 6e5 * (
+            np.exp(-(np.maximum(h_cm, 1e6) - 1e6) / 6e5) -
+            np.exp(-(1.2e7 - 1e6) / 6e5))
+        return X_top + 1.2e-3 * 8e5 * np.maximum(
+            np.exp(-h_cm / 8e5) - np.exp(-1e6 / 8e5), 0.)
+
+    def test_depth_tables(self):
+        atm = dp.TabulatedAtmosphere(self.h_cm[::-1], self.rho[::-1])
+        h_cm = np.array([0., 3.3e5, 1e6, 2.75e6, 1.2e7])
+        self.assertTrue(np.allclose(atm.get_density(h_cm),
+                                    self._density(h_cm), rtol=1e-12))
+        X_v = atm.height2depth(h_cm)
+        self.assertTrue(np.allclose(X_v, self._depth(h_cm), rtol=1e-12))
+        self.assertTrue(np.allclose(atm.depth2height(X_v[:-1]),
+                                    h_cm[:-1], rtol=1e-10))
+        self.assertTrue(isinstance(atm.height2depth(1e5), float))
+
+        atm.set_theta(0.)
+        self.assertAlmostEqual(atm.X_surf / X_v[0], 1., places=6)
+
+    def test_load_tabulated_atmospheres(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmp_dir, 'profiles.npz')
+            np.savez(fname, h=self.h_cm,
+                     rho=np.array([self.rho, 2. * self.rho]),
+                     labels=np.array(['2017-01-01', '2017-07-01']))
+            atms = dp.load_tabulated_atmospheres(fname)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual([atm.season for atm in atms],
+                         ['2017-01-01', '2017-07-01'])
+        self.assertEqual(atms[0].location, 'profiles.npz')
+        self.assertTrue(np.allclose(atms[1].height2depth(self.h_cm),
+                                    2. * self._depth(self.h_cm),
+                                    rtol=1e-12))
+        self.assertNotEqual(atms[0]._cache_key(), atms[1]._cache_key())
+
+    def test_get_atmosphere_reads_file_once(self):
+        tmp_dir = tempfile.mkdtemp()
+        np_load, loaded = np.load, []
+
+        def load(fname):
+            loaded.append(fname)
+            return np_load(fname)
+
+        try:
+            fname = os.path.join(tmp_dir, 'profiles.npz')
+            np.savez(fname, h=self.h_cm,
+                     rho=np.array([self.rho, 2. * self.rho]))
+            np.load = load
+            atms = [dp.get_atmosphere(('TABULATED', fname, label))
+                    for label in [1, 0, 1]]
+            self.assertRaises(Exception, dp.get_atmosphere,
+                              ('TABULATED', fname, 2))
+        finally:
+            np.load = np_load
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(len(loaded), 1)
+        self.assertEqual([atm.season for atm in atms], ['1', '0', '1'])
+        # Each call returns a separate object
+        self.assertFalse(atms[0] is atms[2])
+        self.assertTrue(np.allclose(atms[0].height2depth(self.h_cm),
+                                    2. * self._depth(self.h_cm),
+                                    rtol=1e-12))
+
+    def test_range(self):
+        self.assertRaises(Exception, dp.TabulatedAtmosphere,
+                          self.h_cm[:10], self.rho[:10])
+
+
+class TestInverseSpline(unittest.TestCase):
+
+    def test_matches_ppoly(self):
+        atm = _ExpAtmosphere()
+        # Repeated knot with an empty interval, as in splines from FITPACK
+        x = np.array([0., 10., 10., 50., 100.])
+        c = np.array([[1e-7, 0., 2e-7, -1e-8],
+                      [1e-5, 3e-5, 1e-5, 2e-5],
+                      [1e-3, 2e-3, 2e-3, 3e-3]])
+        atm._set_spline(PPoly(c, x))
+        self.assertTrue(np.all(np.diff(atm._spl_x) > 0.))
+
+        X = np.array([-5., 0., 5., 10., 30., 50., 99.9, 100., 120.])
+        ref = 1. / atm.s_X2rho(X)
+        self.assertTrue(np.allclose(atm.r_X2rho(X), ref, rtol=1e-14))
+        self.assertTrue(np.allclose(atm.r_X2rho(X[::-1]), ref[::-1],
+                                    rtol=1e-14))
+        for Xi, r in zip(X, ref):
+            self.assertAlmostEqual(atm.r_X2rho(Xi) / r, 1., places=14)
+
+
+class TestObservationLevels(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = dict((k, config[k]) for k in ['use_atm_cache'])
+        config['use_atm_cache'] = False
+        self.atm = dp.get_atmosphere(('CORSIKA', 'BK_USStd', None))
+
+    def tearDown(self):
+        config.update(self.saved)
+
+    def test_vertical(self):
+        self.atm.set_theta(0.)
+        h_cm = np.array([dp.geom.h_obs, 1e5, 5e5, 2e6])
+        X = self.atm.slant_depth_at_heights(h_cm)
+        self.assertEqual(X[0], self.atm.X_surf)
+        self.assertTrue(np.allclose(X, self.atm.height2depth(h_cm),
+                                    rtol=1e-4))
+        self.assertTrue(np.allclose(dp.geom.theta_at_h(h_cm, 0.), 0.))
+
+    def test_inclined(self):
+        self.atm.set_theta(70.)
+        h_cm = np.array([1e5, 5e5, 2e6])
+        X = self.atm.slant_depth_at_heights(h_cm)
+        self.assertTrue(np.all(np.diff(X) < 0.))
+        self.assertTrue(np.all(X > self.atm.height2depth(h_cm)))
+
+        theta = dp.geom.theta_at_h(np.append(dp.geom.h_obs, h_cm),
+                                   self.atm.thrad)
+        self.assertAlmostEqual(theta[0], self.atm.thrad)
+        self.assertTrue(np.all(np.diff(theta) < 0.))
+        self.assertRaises(Exception, self.atm.slant_depth_at_heights,
+                          [2. * dp.geom.h_atm])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Tests of :mod:`MCEq.interpolation`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from MCEq.interpolation import ZenithInterpolator, FluxTable, \
+    load_flux_table
+
+
+def _model_flux(cos_theta, e_grid):
+    """Spectra of two particles, which depend on the zenith angle."""
+    spec = e_grid ** -2. / (cos_theta + 0.1)
+    return np.array([spec, 0.5 * spec])
+
+
+class _FakeRun():
+    """Stand-in for :class:`MCEq.core.MCEqRun` with an analytic flux.
+
+    Without ``exact``, the angle is rounded to full degrees like a
+    lookup in the atmosphere cache.
+    """
+
+    e_grid = np.logspace(0., 3., 4)
+
+    def __init__(self):
+        self.theta_deg = None
+        self.exact_calls = []
+
+    def set_theta_deg(self, theta_deg, exact=False):
+        self.exact_calls.append(exact)
+        self.theta_deg = theta_deg if exact else np.round(theta_deg)
+
+    def solve(self):
+        pass
+
+    def get_solutions(self, particle_names):
+        flux = _model_flux(np.cos(np.radians(self.theta_deg)), self.e_grid)
+        return flux[:len(particle_names), None, :]
+
+
+class TestZenithInterpolator(unittest.TestCase):
+
+    def setUp(self):
+        self.run = _FakeRun()
+        self.zen_int = ZenithInterpolator(self.run, ['mu', 'numu'],
+                                          cos_theta_range=(0.05, 1.),
+                                          rtol=1e-3, max_nodes=60)
+        self.zen_int.build()
+
+    def test_nodes_use_exact_angles(self):
+        self.assertTrue(all(self.run.exact_calls))
+        for cos_theta, log_flux in self.zen_int.log_flux.iteritems():
+            self.assertTrue(np.allclose(
+                log_flux, np.log(_model_flux(cos_theta, self.run.e_grid)),
+                rtol=1e-12))
+
+    def test_interpolation(self):
+        self.assertTrue(self.zen_int.max_error <= 1e-3)
+        cos_theta = np.linspace(0.05, 1., 17)
+        expected = np.array([_model_flux(c, self.run.e_grid)
+                             for c in cos_theta])
+        res = self.zen_int(cos_theta)
+        self.assertTrue(np.allclose(res, expected, rtol=2e-3))
+        self.assertTrue(np.allclose(self.zen_int(0.3, 'numu'),
+                                    _model_flux(0.3, self.run.e_grid)[1],
+                                    rtol=2e-3))
+        self.assertRaises(Exception, self.zen_int, 0.01)
+
+
+class TestFluxTable(unittest.TestCase):
+
+    def setUp(self):
+        self.e_grid = np.logspace(0., 3., 7)
+        self.cos_theta = np.linspace(0., 1., 5)
+        log_flux = np.array(
+            [[np.log(f * _model_flux(c, self.e_grid)[0])
+              for c in self.cos_theta] for f in [1., 2.]])
+        self.table = FluxTable([14, -14], self.cos_theta, self.e_grid,
+                               log_flux)
+
+    def test_weights_on_nodes(self):
+        pdg = np.array([14, -14, 14, 12])
+        energy = self.e_grid[[1, 1, 4, 4]]
+        cos_theta = self.cos_theta[[0, 2, 4, 4]]
+        expected = np.array([
+            _model_flux(0., self.e_grid)[0, 1],
+            2. * _model_flux(0.5, self.e_grid)[0, 1],
+            _model_flux(1., self.e_grid)[0, 4], 0.])
+        self.assertTrue(np.allclose(
+            self.table.weights(pdg, energy, cos_theta), expected,
+            rtol=1e-6))
+
+    def test_out_of_range(self):
+        res = self.table.weights(14, [0.5, 2e3], 0.5)
+        self.assertTrue(np.all(res == 0.))
+        # cos(theta) is clipped
+        self.assertAlmostEqual(
+            self.table.weights(14, 10., -0.5) / self.table.weights(14, 10.,
+                                                                   0.),
+            1., places=6)
+
+    def test_save_load(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmp_dir, 'table')
+            self.table.save(fname)
+            loaded = load_flux_table(fname)
+            args = ([14, -14], [3., 30.], [0.1, 0.9])
+            self.assertTrue(np.array_equal(loaded.weights(*args),
+                                           self.table.weights(*args)))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_equidistant_grids(self):
+        self.assertRaises(Exception, FluxTable, [14], [0., 0.2, 1.],
+                          self.e_grid, np.zeros((1, 3, 7)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""Tests of the intermediate solutions of the forward-euler kernels."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from MCEq.kernels import kern_numpy, DenseOutput
+from MCEq.output import ListSink, FunctionalSink, MemmapSink, ObsLevelSink
+
+
+def _euler(dX, int_grid, sink=None):
+    """Integrates :math:`\\Phi' = M \\Phi` of dimension 3 with the
+    steps ``dX``."""
+    int_m = csr_matrix([[-1., 0., 0.], [0.5, -0.2, 0.], [0., 0.3, -0.1]])
+    dec_m = csr_matrix((3, 3))
+    dX = np.asarray(dX, dtype=np.float64)
+    return kern_numpy(dX.size, dX, np.ones(dX.size), int_m, dec_m,
+                      np.array([1., 0., 0.]), int_grid,
+                      sink=sink or ListSink())
+
+
+class TestDenseOutput(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(3)
+        self.dX = 0.01 * (0.5 + rng.rand(300))
+        self.X = np.append(0., np.cumsum(self.dX))
+
+    def test_step_boundaries_are_exact(self):
+        int_grid = self.X[[0, 10, 150, -1]]
+        grid_sol = _euler(self.dX, int_grid)[1]
+        self.assertEqual(len(grid_sol), 4)
+        for X, phi in zip(int_grid, grid_sol):
+            n = np.searchsorted(self.X, X)
+            ref = _euler(self.dX[:n], None)[0]
+            self.assertTrue(np.allclose(phi, ref, rtol=1e-12))
+
+    def test_interpolation(self):
+        int_grid = np.linspace(0.1, self.X[-1] - 0.1, 17)
+        grid_sol = _euler(self.dX, int_grid)[1]
+        for X, phi in zip(int_grid, grid_sol):
+            # Euler with a step ending at X
+            n = np.searchsorted(self.X, X)
+            dX = np.append(self.dX[:n - 1], X - self.X[n - 1])
+            ref = _euler(dX, None)[0]
+            self.assertTrue(np.allclose(phi, ref, rtol=1e-3, atol=1e-6))
+
+    def test_end_of_path(self):
+        # In the last step, beyond the end and duplicate depths
+        int_grid = [self.X[-1] - 0.3 * self.dX[-1], self.X[-1] + 1.]
+        grid_sol = _euler(self.dX, int_grid)[1]
+        self.assertEqual(len(grid_sol), 1)
+        grid_sol = _euler(self.dX, [0.5, 0.5])[1]
+        self.assertTrue(np.array_equal(grid_sol[0], grid_sol[1]))
+
+    def test_reduced_interpolation(self):
+        weights = np.array([[1., 1., 1.], [0., 2., 0.]])
+        int_grid = np.linspace(0., self.X[-1], 9)
+        full = np.array(_euler(self.dX, int_grid)[1])
+        reduced = _euler(self.dX, int_grid, FunctionalSink(weights))[1]
+        self.assertEqual(reduced.shape, (9, 2))
+        self.assertTrue(np.allclose(reduced, full.dot(weights.T),
+                                    rtol=1e-12))
+
+
+    def test_selected_elements(self):
+        int_grid = np.linspace(0.05, self.X[-1] - 0.05, 9)
+        full = np.array(_euler(self.dX, int_grid)[1])
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmp_dir, 'sol.npy')
+            for sink in [ListSink([2, 0]), ListSink([2, 0], 'float32'),
+                         MemmapSink(fname, 9, [2, 0])]:
+                res = np.array(_euler(self.dX, int_grid, sink)[1])
+                self.assertEqual(res.shape, (9, 2))
+                self.assertTrue(np.allclose(res, full[:, [2, 0]],
+                                            rtol=1e-6))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_stored_states_are_reduced(self):
+        phi, dphi = np.arange(5.), np.ones(5)
+        for sink in [ListSink([1, 3]), MemmapSink(None, 1, [1, 3])]:
+            dense = DenseOutput([0.5], sink)
+            dense.step(0., 1., phi, dphi)
+            self.assertEqual([a.shape for a in dense._last[2:]],
+                             [(2,), (2,)])
+
+        # Full states are kept until the last observation level
+        sink = ObsLevelSink(ListSink([1, 3]), np.array([-1, 0, 1]),
+                            np.array([0, -1, -1]))
+        dense = DenseOutput([0.5, 1.5, 2.5], sink)
+        dense.step(0., 1., phi, dphi)
+        self.assertEqual(dense._last[2].shape, (5,))
+        dense.step(1., 1., phi, dphi)
+        self.assertEqual(dense._last[2].shape, (2,))
+        dense.step(2., 1., phi, dphi)
+        dense.finish(phi)
+        self.assertEqual(sink.obs_sol[0].shape, (5,))
+        self.assertEqual([v.shape for v in sink.result()], [(2,), (2,)])
+        # Linear segment in the last step
+        self.assertTrue(np.allclose(sink.result()[1], [1.5, 3.5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
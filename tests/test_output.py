@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Tests of the sinks for intermediate solutions in :mod:`MCEq.output`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from MCEq import output
+from MCEq.kernels import kern_numpy
+
+
+def _integrate(sink, int_grid):
+    """Integrates a small linear system with intermediate solutions."""
+    rng = np.random.RandomState(2)
+    int_m = csr_matrix(-0.05 * np.eye(5) + 0.02 * np.tril(rng.rand(5, 5), -1))
+    dec_m = csr_matrix(-0.01 * np.eye(5))
+    nsteps = 20
+    return kern_numpy(nsteps, np.ones(nsteps), np.ones(nsteps), int_m, dec_m,
+                      np.arange(1., 6.), int_grid, sink=sink)
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_log16_round_trip(self):
+        phi = np.array([-1e-12, -3., 0., 1e-310, 1e-250, 1e-3, 2.5, 1e30])
+        enc = output.encode_state(phi, 'log16')
+        self.assertEqual(enc.dtype, np.float16)
+        dec = output.decode_state(enc, 'log16')
+        self.assertEqual(dec.dtype, np.float64)
+        self.assertFalse(np.any(np.isnan(dec)))
+        self.assertTrue(np.all(dec[:4] == 0.))
+        self.assertTrue(np.allclose(dec[4:], phi[4:], rtol=0.3))
+        # Relative precision is about 5e-4 |log(phi)|
+        self.assertTrue(np.all(np.abs(dec[5:] / phi[5:] - 1.) <
+                               5e-4 * np.abs(np.log(phi[5:])) + 1e-3))
+
+    def test_float_types(self):
+        phi = np.array([-1e-12, 0., 1.5])
+        enc = output.encode_state(phi, 'float32')
+        self.assertEqual(enc.dtype, np.float32)
+        self.assertTrue(np.allclose(output.decode_state(enc, 'float32'),
+                                    phi))
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.int_grid = [2., 7.5, 15.]
+        self.ref = _integrate(output.ListSink(), self.int_grid)[1]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_list_sink(self):
+        self.assertEqual(len(self.ref), 3)
+        idcs = np.array([1, 3])
+        res = _integrate(output.ListSink(idcs, 'float32'), self.int_grid)[1]
+        self.assertEqual(res[0].dtype, np.float32)
+        self.assertTrue(np.allclose(res, np.array(self.ref)[:, idcs],
+                                    rtol=1e-6))
+
+    def test_callback_sink(self):
+        received = []
+        sink = output.CallbackSink(
+            lambda grid_step, phi: received.append((grid_step,
+                                                    np.copy(phi))))
+        self.assertEqual(_integrate(sink, self.int_grid)[1], None)
+        self.assertEqual([step for step, _ in received], [0, 1, 2])
+        self.assertTrue(np.allclose([phi for _, phi in received], self.ref))
+
+    def test_memmap_sink(self):
+        for background in [False, True]:
+            fname = os.path.join(self.tmp_dir, 'profile.npy')
+            sink = output.MemmapSink(fname, len(self.int_grid),
+                                     idcs=np.array([0, 4]),
+                                     dtype='float64', background=background,
+                                     queue_size=1)
+            res = _integrate(sink, self.int_grid)[1]
+            self.assertTrue(np.allclose(res, np.array(self.ref)[:, [0, 4]]))
+            self.assertTrue(np.allclose(np.load(fname), res))
+
+    def test_functional_sink(self):
+        weights = csr_matrix([[1., 0., 0., 0., 1.], [0., 0., 2., 0., 0.]])
+        res = _integrate(output.FunctionalSink(weights), self.int_grid)[1]
+        self.assertEqual(res.shape, (3, 2))
+        self.assertTrue(np.allclose(res, weights.dot(np.transpose(
+            self.ref)).T, rtol=1e-12))
+
+    def test_energy_integrals(self):
+        from tests.helpers import partial_run, species_slice
+        run = partial_run(d=4)
+        widths = np.diff(run.y.e_bins)
+        weights = output.energy_integrals(run, ['numu', 'conv_mu+'])
+        self.assertEqual(weights.shape, (2, run.dim_states))
+        conv = sum([species_slice(run, name) for name in
+                    ['pi_mu+', 'k_mu+', 'mu+']])
+        self.assertTrue(np.allclose(
+            weights.dot(run.solution),
+            [np.sum(widths * species_slice(run, 'numu')),
+             np.sum(widths * conv)]))
+
+        # Bins with centers between the limits, weighted by E**2
+        weights = output.energy_integrals(run, ['numu'], e_min=5.,
+                                          e_max=500., mag=2.)
+        sel = (run.e_grid >= 5.) & (run.e_grid <= 500.)
+        self.assertEqual(np.sum(sel), 2)
+        self.assertAlmostEqual(
+            weights.dot(run.solution)[0],
+            np.sum((widths * run.e_grid ** 2 *
+                    species_slice(run, 'numu'))[sel]))
+
+    def test_state_indices(self):
+        from tests.helpers import partial_run
+        run = partial_run(d=3)
+        self.assertEqual(list(output.state_indices(run, ['numu', 'pi_mu+'])),
+                         [12, 13, 14, 3, 4, 5])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""Tests of :class:`MCEq.results.ResultStore` and
+:class:`MCEq.results.SolutionCache`."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from mceq_config import config
+from MCEq.results import ResultStore, SolutionCache, config_key
+
+
+class _Particle():
+
+    def __init__(self, name, lidx):
+        self.name, self._lidx = name, lidx
+
+    def lidx(self):
+        return self._lidx
+
+
+class _FakeRun():
+    """Provides the energy grid and layout of the state vector for
+    the species mu+ and its components from pions, kaons and prompt
+    decays."""
+
+    e_grid = np.logspace(0., 3., 4)
+    dim_states = 16
+    cascade_particles = [_Particle(name, 4 * i) for i, name in
+                         enumerate(['pr_mu+', 'pi_mu+', 'k_mu+', 'mu+'])]
+
+    def __init__(self, scale):
+        self.solution = scale * np.arange(1., 17.)
+        self.grid_sol = [0.5 * self.solution, 0.25 * self.solution]
+
+
+class TestResultStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.store = ResultStore(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _config(self, theta_deg):
+        return ('SIBYLL2.3', None, ('CORSIKA', 'BK_USStd', None),
+                theta_deg, (_FakeRun, 'H3a'))
+
+    def _check_get(self, store, theta_deg, scale):
+        sol = scale * np.arange(1., 17.)
+        e_grid, flux = store.get(self._config(theta_deg), 'mu+')
+        self.assertTrue(np.array_equal(e_grid, _FakeRun.e_grid))
+        self.assertTrue(np.allclose(flux, sol[12:16]))
+        e_grid, flux = store.get(self._config(theta_deg), 'total_mu+',
+                                 e_range=(5., 500.), mag=1.)
+        self.assertTrue(np.array_equal(e_grid, _FakeRun.e_grid[1:3]))
+        total = sol[1:3] + sol[5:7] + sol[9:11] + sol[13:15]
+        self.assertTrue(np.allclose(flux, total * e_grid))
+
+    def test_numeric_types_share_keys(self):
+        self.assertEqual(config_key(self._config(0)),
+                         config_key(self._config(0.)))
+        self.assertEqual(config_key(self._config(np.float32(30.))),
+                         config_key(self._config(30)))
+        self.assertNotEqual(config_key((True,)), config_key((1.,)))
+
+        self.store.add(self._config(0.), _FakeRun(1.))
+        self.assertTrue(self._config(0) in self.store)
+        self._check_get(self.store, 0, 1.)
+
+    def test_add_and_consolidate(self):
+        for i, theta_deg in enumerate([0., 30., 60.]):
+            self.store.add(self._config(theta_deg), _FakeRun(i + 1.))
+        self.assertEqual(len(ResultStore(self.path)), 3)
+
+        for consolidated in [False, True]:
+            if consolidated:
+                self.store.consolidate()
+            for i, theta_deg in enumerate([0., 30., 60.]):
+                self._check_get(self.store, theta_deg, i + 1.)
+            configs, e_grid, fluxes = self.store.get_all('mu+')
+            self.assertEqual(fluxes.shape, (3, 4))
+            for config, flux in zip(configs, fluxes):
+                scale = [0., 30., 60.].index(config[3]) + 1.
+                self.assertTrue(np.allclose(flux,
+                                            scale * np.arange(13., 17.)))
+
+        e_grid, flux = self.store.get(self._config(30.), 'mu+', grid_idx=1)
+        self.assertTrue(np.allclose(flux, 0.5 * np.arange(13., 17.)))
+
+    def test_reader_during_consolidation(self):
+        self.store.add(self._config(0.), _FakeRun(1.))
+        self.store.add(self._config(30.), _FakeRun(2.))
+        self.store.consolidate()
+
+        reader = ResultStore(self.path)
+        mapped_reader = ResultStore(self.path)
+        self._check_get(mapped_reader, 30., 2.)
+
+        # New entry sorted before the others shifts all rows
+        self.store.add(self._config(-10.), _FakeRun(3.))
+        self.store.consolidate()
+
+        for store in [reader, mapped_reader]:
+            self._check_get(store, 0., 1.)
+            self._check_get(store, 30., 2.)
+        self.assertEqual(len(reader.get_all('mu+')[0]), 3)
+        mapped_reader.refresh()
+        self._check_get(mapped_reader, -10., 3.)
+
+    def test_energy_grid_mismatch(self):
+        self.store.add(self._config(0.), _FakeRun(1.))
+        other = _FakeRun(1.)
+        other.e_grid = 2. * other.e_grid
+        self.assertRaises(Exception, self.store.add, self._config(1.),
+                          other)
+        self.assertRaises(Exception, self.store.get, self._config(1.),
+                          'mu+')
+
+
+class TestSolutionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.saved = dict((k, config[k]) for k in ['data_dir',
+                                                   'yield_fname'])
+        config['data_dir'] = self.data_dir
+        config['yield_fname'] = 'yield_dict.ppd'
+        self._write('yield_dict.ppd', 'yields')
+        self.cache_dir = os.path.join(self.data_dir, 'solution_cache')
+
+    def tearDown(self):
+        config.update(self.saved)
+        shutil.rmtree(self.data_dir)
+
+    def _write(self, fname, content):
+        with open(os.path.join(self.data_dir, fname), 'w') as f:
+            f.write(content)
+
+    def test_lru(self):
+        cache = SolutionCache(max_size=2)
+        for i in xrange(3):
+            cache.put(str(i), i * np.ones(3))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('0'), None)
+        solution, grid_sol = cache.get('2')
+        self.assertTrue(np.array_equal(solution, 2 * np.ones(3)))
+        self.assertEqual(grid_sol, None)
+        self.assertEqual(cache.stats(), {'hits': 1, 'disk_hits': 0,
+                                         'misses': 1, 'size': 2})
+
+    def test_disk_cache(self):
+        cache = SolutionCache(cache_dir=self.cache_dir)
+        cache.put('a', np.ones(3), [np.zeros(3), np.ones(3)])
+
+        cache = SolutionCache(cache_dir=self.cache_dir)
+        solution, grid_sol = cache.get('a')
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+        self.assertTrue(np.array_equal(grid_sol,
+                                       [np.zeros(3), np.ones(3)]))
+
+        cache.invalidate()
+        self.assertEqual(SolutionCache(cache_dir=self.cache_dir).get('a'),
+                         None)
+
+    def test_corrupt_entry_is_a_miss(self):
+        cache = SolutionCache(cache_dir=self.cache_dir)
+        cache.put('a', np.arange(1000.))
+        cache.put('b', np.ones(3))
+        fname = os.path.join(self.cache_dir, 'a.npz')
+        with open(fname, 'rb') as f:
+            content = f.read()
+        with open(fname, 'wb') as f:
+            f.write(content[:len(content) // 2])
+        with open(os.path.join(self.cache_dir, 'b.npz'), 'w') as f:
+            f.write('corrupt')
+
+        cache = SolutionCache(cache_dir=self.cache_dir)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.stats()['misses'], 2)
+        self.assertFalse(os.path.isfile(fname))
+
+    def test_generated_files_keep_disk_cache(self):
+        SolutionCache(cache_dir=self.cache_dir).put('a', np.ones(3))
+        self._write('yield_dict_index.ppd', 'index')
+        self._write('charm_cache_x.npz', 'charm')
+        os.makedirs(os.path.join(self.data_dir, 'atm_cache'))
+        cache = SolutionCache(cache_dir=self.cache_dir)
+        self.assertNotEqual(cache.get('a'), None)
+
+    def test_replaced_data_file_invalidates(self):
+        SolutionCache(cache_dir=self.cache_dir).put('a', np.ones(3))
+        self._write('yield_dict.ppd', 'other yields')
+        self.assertEqual(SolutionCache(cache_dir=self.cache_dir).get('a'),
+                         None)
+
+
+if __name__ == '__main__':
+    unittest.main()